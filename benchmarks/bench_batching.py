@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Compare submitting many tiny tasks one job each against bundling them.
+
+Makes `--tasks` tasks that each write a small target file after
+`--work` seconds, and runs them through `util_hutlab.batching.LocalGrid`,
+which stands in for the grid and spends `--latency` seconds "queued" before
+every job: first one job per task, then bundled into jobs of
+`--batch-minutes` on `--batch-cores` cores (each task counting as one
+minute). `--slots` jobs run at once, as on a busy queue.
+
+```sh
+python3 benchmarks/bench_batching.py --tasks 400 --latency 0.5 --batch-minutes 50 --batch-cores 4
+```
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.batching import LocalGrid, Task, submit
+
+
+def make_tasks(folder, n, work):
+    return [Task("task{}".format(i), "sleep {} && echo {} > {}".format(work, i, os.path.join(folder, "t{}".format(i))),
+        (), (os.path.join(folder, "t{}".format(i)),), time=1, mem=100, cores=1) for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bundling small grid tasks.")
+    parser.add_argument("--tasks", help="number of tasks", default=200, type=int)
+    parser.add_argument("--work", help="seconds each task takes", default=0.01, type=float)
+    parser.add_argument("--latency", help="seconds each job waits before starting", default=0.2, type=float)
+    parser.add_argument("--slots", help="jobs running at once", default=8, type=int)
+    parser.add_argument("--batch-minutes", help="minutes per bundle (tasks count as one minute)", default=25,
+        type=int)
+    parser.add_argument("--batch-cores", help="cores per bundle", default=4, type=int)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    tmp = tempfile.mkdtemp(prefix="bench_batching_")
+    try:
+        print("mode\tjobs\tseconds\ttasks/s")
+        for mode, minutes in [("one job per task", None), ("bundled", args.batch_minutes)]:
+            folder = os.path.join(tmp, mode.replace(" ", "_"))
+            os.mkdir(folder)
+            tasks = make_tasks(folder, args.tasks, args.work)
+            grid = LocalGrid(cores=args.slots * args.batch_cores if minutes else args.slots, latency=args.latency)
+            submit(grid, tasks, os.path.join(folder, "bundles"), minutes, args.batch_cores,
+                runner=sys.executable + " {} {} --cores {} --quiet")
+            start = time.perf_counter()
+            failed = grid.go()
+            elapsed = time.perf_counter() - start
+            if failed or not all(os.path.isfile(t.targets[0]) for t in tasks):
+                raise RuntimeError("{}: tasks failed or targets missing".format(mode))
+            print("{}\t{}\t{:.2f}\t{:.0f}".format(mode, len(grid.submitted), elapsed, args.tasks / elapsed))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Compare concatenation strategies used by `bin/catfiles.py`.
+
+Writes a set of synthetic lane files to a temporary directory, then
+concatenates them with:
+
+    - `whole`: the original path, `out.write(infile.read())` for each file
+    - `stream`: bounded chunks through a reusable userspace buffer
+    - `zerocopy`: `copy_file_range`/`sendfile` where the kernel supports it
+    - `prefetch`: zerocopy, with the next files opened and read ahead on
+      threads (the default for `bin/catfiles.py`)
+
+The first three open and read the inputs one at a time. Use `--kib` for the
+many-small-files layout, and `--latency` to add a delay to every open, as a
+stand-in for a network filesystem, which the prefetch hides.
+
+Each strategy runs in a fresh subprocess so peak RSS can be reported
+independently.
+
+```sh
+python3 benchmarks/bench_catfiles.py --files 4 --size 256
+python3 benchmarks/bench_catfiles.py --files 2000 --kib 64 --latency 0.002
+```
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import catfiles
+from util_hutlab.catfiles import concatenate, CHUNK_SIZE, PREFETCH
+
+
+def whole(infiles, outpath):
+    with open(outpath, "w+b") as out:
+        for f in infiles:
+            with open(f, "rb") as infile:
+                out.write(infile.read())
+
+
+METHODS = {
+    "whole": whole,
+    "stream": lambda infiles, outpath: concatenate(infiles, outpath, CHUNK_SIZE, zerocopy=False, prefetch_files=0),
+    "zerocopy": lambda infiles, outpath: concatenate(infiles, outpath, CHUNK_SIZE, zerocopy=True, prefetch_files=0),
+    "prefetch": lambda infiles, outpath: concatenate(infiles, outpath, CHUNK_SIZE, zerocopy=True,
+        prefetch_files=PREFETCH),
+}
+
+
+def make_inputs(folder, nfiles, size_kib):
+    block = os.urandom(1024 * min(size_kib, 1024))
+    paths = []
+    for n in range(nfiles):
+        path = os.path.join(folder, "lane{}.fastq".format(n))
+        with open(path, "wb") as f:
+            for _ in range(size_kib * 1024 // len(block)):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+
+def run_one(method, latency, outpath, infiles):
+    if latency:
+        def slow_open(path, *args, **kwargs):
+            time.sleep(latency)
+            return open(path, *args, **kwargs)
+        catfiles.open = slow_open  # the module's opens, not the benchmark's
+    start = time.perf_counter()
+    METHODS[method](infiles, outpath)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{}\t{}".format(elapsed, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fastq concatenation.")
+    parser.add_argument("--files", help="number of input files", default=4, type=int)
+    parser.add_argument("--size", help="size of each input file in MiB", default=64, type=int)
+    parser.add_argument("--kib", help="size of each input file in KiB (instead of --size)", type=int)
+    parser.add_argument("--latency", help="seconds added to every open of an input (not for whole)", default=0,
+        type=float)
+    parser.add_argument("--methods", help="comma separated methods to run", default=",".join(METHODS))
+    parser.add_argument("--run-one", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one[0], float(args.run_one[1]), args.run_one[2], args.run_one[3:])
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_catfiles_")
+    try:
+        kib = args.kib or args.size * 1024
+        infiles = make_inputs(tmp, args.files, kib)
+        total_mb = args.files * kib / 1024.0
+        outpath = os.path.join(tmp, "out.fastq")
+        print("method\tseconds\tMiB/s\tpeak_rss_MiB")
+        for method in args.methods.split(","):
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", method, str(args.latency),
+                outpath] + infiles,
+                stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            elapsed, peak = map(float, result.stdout.split())
+            if os.path.getsize(outpath) != args.files * kib * 1024:
+                raise RuntimeError("{} wrote the wrong number of bytes".format(method))
+            print("{}\t{:.3f}\t{:.1f}\t{:.1f}".format(method, elapsed, total_mb / elapsed, peak))
+            os.remove(outpath)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
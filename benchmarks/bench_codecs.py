@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""
+Measure `bin/selectcols.py` throughput on compressed tables, per codec.
+
+For each of plain, gzip, bzip2 and xz, times reading a compressed table
+(with the codec inline on the parsing thread, and on a background thread
+as `selectcols.py` does) and writing a compressed output. Rates are in MB
+of uncompressed table per second.
+
+```sh
+python3 benchmarks/bench_codecs.py --rows 20000 --cols 500
+```
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.selectcols import select_columns, open_table, open_output, CODECS
+from bench_selectcols import make_table
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed input and output.")
+    parser.add_argument("--rows", help="number of rows", default=20000, type=int)
+    parser.add_argument("--cols", help="number of sample columns", default=500, type=int)
+    parser.add_argument("--every", help="select every nth column", default=2, type=int)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_codecs_")
+    try:
+        plain = os.path.join(tmp, "table.tsv")
+        make_table(plain, args.rows, args.cols, 0.3)
+        size_mb = os.path.getsize(plain) / 1e6
+        columns = ["sample{}".format(i) for i in range(0, args.cols, args.every)]
+
+        def select(table, out):
+            select_columns(table, out, columns, "\t", True, False)
+
+        print("codec\tratio\tread_inline_MB/s\tread_threaded_MB/s\twrite_threaded_MB/s")
+        for codec in ["plain"] + sorted(CODECS):
+            path = plain
+            if codec != "plain":
+                path = "{}.{}".format(plain, codec)
+                with open(plain, "rb") as src, CODECS[codec](path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+
+            def inline():
+                opener = open if codec == "plain" else CODECS[codec]
+                with opener(path, "rt") as table:
+                    select(table, io.StringIO())
+
+            def threaded():
+                with open_table(path) as table:
+                    select(table, io.StringIO())
+
+            def write():
+                outpath = os.path.join(tmp, "out.tsv" + ("" if codec == "plain" else "." + codec))
+                with open(plain, "r") as table, open_output(outpath) as out:
+                    select(table, out)
+
+            ratio = size_mb * 1e6 / os.path.getsize(path)
+            print("{}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}".format(codec, ratio, size_mb / timed(inline),
+                size_mb / timed(threaded), size_mb / timed(write)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
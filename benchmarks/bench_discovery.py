@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+Time file discovery and grouping in `bin/catfiles.py` on a synthetic tree.
+
+Builds `--lanes` lane folders holding paired-end files for `--files` files
+in total, then compares the original glob + per-sample list scan against
+the `os.scandir` walker and single-pass grouping.
+
+Then times listing the tree with file sizes, as the workflows plan their
+tasks: `os.walk` plus a stat per file, `FileListing.scan` on one and on
+`--jobs` threads, and a rescan answered from its listing cache.
+
+```sh
+python3 benchmarks/bench_discovery.py --files 100000 --lanes 200
+```
+"""
+
+import argparse
+from glob import glob
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.catfiles import find_files, group_files
+from util_hutlab.discovery import FileListing
+
+REGEX = r"lane\d+\/(sample\d+)_L\d+_r(1|2)\.fastq"
+
+
+def make_tree(folder, nfiles, nlanes):
+    per_lane = nfiles // nlanes
+    for lane in range(nlanes):
+        lanedir = os.path.join(folder, "lane{}".format(lane))
+        os.mkdir(lanedir)
+        for n in range(per_lane):
+            name = "sample{}_L{}_r{}.fastq".format(n // 2, lane, n % 2 + 1)
+            open(os.path.join(lanedir, name), "w").close()
+
+
+def old_discover_group(directory, regex, idgroup=0, pairgroup=1):
+    files = glob(directory+"/**/*.fastq*", recursive=True)
+    files = [f for f in files if re.search(regex, f)]
+    matches = [re.search(regex, x) for x in files]
+    ids = sorted(set([x.groups()[idgroup] for x in matches]))
+    groups = {}
+    for i in ids:
+        groups[(i, "1")] = [files[j] for j in range(len(files)) if matches[j].groups()[idgroup] == i and matches[j].groups()[pairgroup] == "1"]
+        groups[(i, "2")] = [files[j] for j in range(len(files)) if matches[j].groups()[idgroup] == i and matches[j].groups()[pairgroup] == "2"]
+    return groups
+
+
+def new_discover_group(directory, regex, idgroup=0, pairgroup=1):
+    return group_files(find_files(directory), regex, idgroup, pairgroup, paired_end=True)
+
+
+def walk_stat(directory):
+    sizes = {}
+    for folder, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(".fastq"):
+                path = os.path.join(folder, name)
+                if os.path.isfile(path):
+                    sizes[path] = os.path.getsize(path)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fastq discovery and grouping.")
+    parser.add_argument("--files", help="total number of files", default=100000, type=int)
+    parser.add_argument("--lanes", help="number of lane folders", default=200, type=int)
+    parser.add_argument("--skip-old", help="don't time the original implementation", action="store_true")
+    parser.add_argument("--jobs", help="threads listing folders", default=8, type=int)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_discovery_")
+    try:
+        make_tree(tmp, args.files, args.lanes)
+        methods = [("scandir+dict", new_discover_group)]
+        if not args.skip_old:
+            methods.insert(0, ("glob+scan", old_discover_group))
+        print("method\tseconds\tgroups")
+        for name, func in methods:
+            start = time.perf_counter()
+            groups = func(tmp, REGEX)
+            print("{}\t{:.3f}\t{}".format(name, time.perf_counter() - start, len(groups)))
+
+        cache = os.path.join(tmp, ".listing.json")
+        listings = [
+            ("walk+stat", lambda: walk_stat(tmp)),
+            ("scan", lambda: FileListing.scan([tmp], ".fastq", jobs=1).find()),
+            ("scan {} threads".format(args.jobs), lambda: FileListing.scan([tmp], ".fastq", jobs=args.jobs).find()),
+            ("scan, cache written", lambda: FileListing.scan([tmp], ".fastq", jobs=args.jobs, cache=cache).find()),
+        ]
+        # make the folders old enough for their listings to be trusted
+        old = time.time() - 60
+        for folder, _, _ in os.walk(tmp):
+            os.utime(folder, (old, old))
+        listings.append(("scan, from cache", listings[-1][1]))
+        print("listing\tseconds\tfiles")
+        for name, func in listings:
+            start = time.perf_counter()
+            files = func()
+            print("{}\t{:.3f}\t{}".format(name, time.perf_counter() - start, len(files)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+Measure `bin/selectcols.py` throughput on synthetic wide tables.
+
+Generates a tab-separated table with `--rows` features and `--cols` sample
+columns (a fraction `--zeros` of the rows all zero), selects every
+`--every`-th column and reports rows/s and MB/s for the original per-field
+writer, the batched core and (if numpy is installed) the memory-mapped
+numpy path, and then the batched core with a row filter (values of at least
+`--min-abundance` in `--min-samples` columns).
+
+```sh
+python3 benchmarks/bench_selectcols.py --rows 20000 --cols 2000 --every 3
+```
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.selectcols import select_columns, select_columns_mmap, BLOCK_SIZE, Filters, load_numpy
+
+
+def make_table(path, nrows, ncols, zeros, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write("\t".join(["feature"] + ["sample{}".format(i) for i in range(ncols)]) + "\n")
+        zero_row = "\t".join(["0"] * ncols)
+        for r in range(nrows):
+            if rng.random() < zeros:
+                f.write("feature{}\t{}\n".format(r, zero_row))
+            else:
+                vals = ["{:.5f}".format(rng.random()) if rng.random() < 0.3 else "0" for _ in range(ncols)]
+                f.write("feature{}\t{}\n".format(r, "\t".join(vals)))
+
+
+def original(table, out, columns, sep, keep_first=False, keep_zeros=False):
+    """The per-field implementation selectcols.py started with."""
+    def getcols(row, indicies):
+        return [row[i] for i in indicies]
+
+    def writerow(row_list, out_handle, separator):
+        for i in range(len(row_list)):
+            out_handle.write(row_list[i])
+            if not i == len(row_list) - 1:
+                out_handle.write(separator)
+        out_handle.write("\n")
+
+    cols = table.readline().rstrip("\n").split(sep)
+    colnos = [i for i, x in enumerate(cols) if x in columns]
+    if keep_first and not colnos[0] == 0:
+        colnos.insert(0, 0)
+    writerow(getcols(cols, colnos), out, sep)
+    for l in table:
+        row = getcols(l.rstrip("\n").split(sep), colnos)
+        if keep_zeros:
+            writerow(row, out, sep)
+        else:
+            vals = row[1:] if keep_first else row
+            if not sum([x for x in map(float, vals)]) == 0:
+                writerow(row, out, sep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark column selection.")
+    parser.add_argument("--rows", help="number of rows", default=20000, type=int)
+    parser.add_argument("--cols", help="number of sample columns", default=1000, type=int)
+    parser.add_argument("--every", help="select every nth column", default=2, type=int)
+    parser.add_argument("--zeros", help="fraction of all-zero rows", default=0.3, type=float)
+    parser.add_argument("--min-abundance", help="abundance for the filtered run", default=0.5, type=float)
+    parser.add_argument("--min-samples", help="samples for the filtered run", default=3, type=int)
+    parser.add_argument("--skip-original", help="don't time the original implementation", action="store_true")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_selectcols_")
+    try:
+        path = os.path.join(tmp, "table.tsv")
+        make_table(path, args.rows, args.cols, args.zeros)
+        size_mb = os.path.getsize(path) / 1e6
+        columns = ["sample{}".format(i) for i in range(0, args.cols, args.every)]
+
+        methods = [("batched", select_columns)]
+        if not args.skip_original:
+            methods.insert(0, ("original", original))
+        if load_numpy() is not None:
+            methods.append(("numpy", None))
+
+        print("method\tseconds\trows/s\tMB/s")
+        outputs = []
+        for name, func in methods:
+            start = time.perf_counter()
+            if name == "numpy":
+                out = io.BytesIO()
+                select_columns_mmap(path, out, columns, "\t", True, False)
+                outputs.append(out.getvalue().decode())
+            else:
+                out = io.StringIO()
+                with open(path, "r", buffering=BLOCK_SIZE) as table:
+                    func(table, out, columns, "\t", True, False)
+                outputs.append(out.getvalue())
+            elapsed = time.perf_counter() - start
+            print("{}\t{:.3f}\t{:.0f}\t{:.1f}".format(name, elapsed, args.rows / elapsed, size_mb / elapsed))
+        if len(set(outputs)) != 1:
+            raise RuntimeError("outputs differ")
+
+        filters = Filters(args.min_abundance, args.min_samples)
+        start = time.perf_counter()
+        with open(path, "r", buffering=BLOCK_SIZE) as table:
+            select_columns(table, io.StringIO(), columns, "\t", True, False, filters=filters)
+        elapsed = time.perf_counter() - start
+        print("filtered\t{:.3f}\t{:.0f}\t{:.1f}".format(elapsed, args.rows / elapsed, size_mb / elapsed))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Fit the task sizing model on this machine and check how well it predicts.
+
+Runs a stand-in for a mapping task (decompress a gzipped input while holding
+an "index" file in memory) through `util_hutlab.sizing.record` for every
+combination of `--inputs` and `--indexes` sizes (in MB), fits a model to the
+resulting log, and reports the coefficients, the fit's error on each run
+when it is left out, and the resources the model would request.
+
+With `--log`, fits an existing resource log instead and reports the same
+per-run errors for each kind of task in it.
+
+```sh
+python3 benchmarks/bench_sizing.py --inputs 8 16 32 64 --indexes 50 100 200
+python3 benchmarks/bench_sizing.py --log runs.jsonl
+```
+"""
+
+import argparse
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.sizing import GB, SizingModel, read_log, record
+
+# holds the index in memory, then reads the whole input through gzip
+TASK = "import gzip, sys\nindex = open(sys.argv[2], 'rb').read()\nfor _ in gzip.open(sys.argv[1]): pass\n"
+
+
+def make_input(path, mb, seed=0):
+    """Gzipped FASTQ-like text of about `mb` MB before compression."""
+    rng = random.Random(seed)
+    with gzip.open(path, "wt", compresslevel=1) as f:
+        written = 0
+        while written < mb * 1024 * 1024:
+            seq = "".join(rng.choice("ACGT") for _ in range(100))
+            record = "@read{}\n{}\n+\n{}\n".format(written, seq, "I" * 100)
+            f.write(record)
+            written += len(record)
+
+
+def loo_errors(runs, key, min_records):
+    """Relative error of each run's `key` when predicted by a model fitted to the others."""
+    errors = []
+    for i in range(len(runs)):
+        model = SizingModel.fit(runs[:i] + runs[i + 1:], min_records)
+        r = runs[i]
+        fit = model.kinds.get(r["kind"])
+        if fit is None:
+            continue
+        x = (r["input_bytes"] / GB, r["index_bytes"] / GB)
+        coefs = fit[key]
+        predicted = coefs[0] + coefs[1] * x[0] + coefs[2] * x[1]
+        actual = r["cpu"] / max(r["refs"], 1) if key == "cpu" else r["max_rss_mb"]
+        errors.append(abs(predicted - actual) / actual if actual else 0.0)
+    return errors
+
+
+def report(records, min_records):
+    model = SizingModel.fit(records, min_records)
+    print("kind\truns\tcpu s/GB input\tcpu s/GB index\tMB/GB input\tMB/GB index\ttime margin\tmem margin")
+    for kind, fit in sorted(model.kinds.items()):
+        print("{}\t{}\t{:.3g}\t{:.3g}\t{:.3g}\t{:.3g}\t{:.2f}\t{:.2f}".format(kind, fit["runs"], fit["cpu"][1],
+            fit["cpu"][2], fit["mem"][1], fit["mem"][2], fit["time_margin"], fit["mem_margin"]))
+    print("kind\tleave-one-out error\tmedian\tmax")
+    for kind in sorted(model.kinds):
+        runs = [r for r in records if r["kind"] == kind and r.get("returncode") == 0]
+        for key in ("cpu", "mem"):
+            errors = sorted(loo_errors(runs, key, min_records))
+            if errors:
+                print("{}\t{}\t{:.1%}\t{:.1%}".format(kind, key, errors[len(errors) // 2], errors[-1]))
+
+    start = time.perf_counter()
+    SizingModel.fit(records * max(1, 100000 // max(len(records), 1)), min_records)
+    print("fitting {} records took {:.2f}s".format(len(records) * max(1, 100000 // max(len(records), 1)),
+        time.perf_counter() - start))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fitting the task sizing model.")
+    parser.add_argument("--inputs", help="input sizes, in MB of text", default=[4, 8, 16, 32], type=int, nargs="+")
+    parser.add_argument("--indexes", help="index sizes in MB", default=[25, 50, 100], type=int, nargs="+")
+    parser.add_argument("--log", help="fit this resource log instead of running the stand-in task")
+    parser.add_argument("--min-records", help="runs needed to model a kind of task", default=5, type=int)
+    args = parser.parse_args()
+
+    if args.log:
+        report(read_log(args.log), args.min_records)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_sizing_")
+    try:
+        log = os.path.join(tmp, "runs.jsonl")
+        inputs = {}
+        for mb in args.inputs:
+            inputs[mb] = os.path.join(tmp, "input{}.fastq.gz".format(mb))
+            make_input(inputs[mb], mb, seed=mb)
+        for mb in args.indexes:
+            # a MB at a time: the peak memory recorded for a child includes this process's at fork
+            with open(os.path.join(tmp, "index{}".format(mb)), "wb") as f:
+                for _ in range(mb):
+                    f.write(os.urandom(1024 * 1024))
+        for imb, path in sorted(inputs.items()):
+            for xmb in args.indexes:
+                index = os.path.join(tmp, "index{}".format(xmb))
+                record(log, [sys.executable, "-c", TASK, path, index], "stand_in",
+                    os.path.getsize(path), os.path.getsize(index))
+        model = report(read_log(log), args.min_records)
+        if "stand_in" in model.kinds:
+            print("input MB\tindex MB\trequest")
+            for imb, path in sorted(inputs.items()):
+                xmb = args.indexes[-1]
+                print("{}\t{}\t{}".format(imb, xmb, model.resources("stand_in", {}, os.path.getsize(path),
+                    xmb * 1024 * 1024)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
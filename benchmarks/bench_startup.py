@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Measure what it costs to run the utilities once per file, as pipelines do.
+
+Times, per call and in milliseconds:
+
+    - `import util_hutlab` and each submodule, in a fresh interpreter
+    - `bin/selectcols.py` and `bin/crap2.py` on tiny files, one process per call
+    - the same work through `util_hutlab.select_table` and `util_hutlab.getlines`
+      in a loop inside one process
+
+```sh
+python3 benchmarks/bench_startup.py --calls 50
+```
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import util_hutlab
+
+
+def per_call(func, calls):
+    """Milliseconds per call of `func`, best of three rounds of `calls` calls."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1000
+
+
+def run(*argv):
+    subprocess.run([sys.executable] + list(argv), check=True, cwd=ROOT, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup and per-call overhead.")
+    parser.add_argument("--calls", help="calls per timing round", default=20, type=int)
+    args = parser.parse_args()
+
+    # the library warns as it goes, which would be timed too
+    logging.disable(logging.WARNING)
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        table = os.path.join(tmp, "table.tsv")
+        with open(table, "w") as f:
+            f.write("feature\ta\tb\tc\n")
+            for i in range(20):
+                f.write("f{}\t{}\t0\t1\n".format(i, i % 3))
+        colfile = os.path.join(tmp, "columns.txt")
+        with open(colfile, "w") as f:
+            f.write("a\nc\n")
+        out = os.path.join(tmp, "out.tsv")
+
+        print("what\tms/call")
+        for module in ["util_hutlab", "util_hutlab.catfiles", "util_hutlab.selectcols", "util_hutlab.lines"]:
+            ms = per_call(lambda: run("-c", "import " + module), args.calls)
+            print("import {}\t{:.1f}".format(module, ms))
+
+        ms = per_call(lambda: run("bin/selectcols.py", table, "-c", colfile, "-s", "t", "-k", "-o", out), args.calls)
+        print("bin/selectcols.py\t{:.1f}".format(ms))
+        ms = per_call(lambda: util_hutlab.select_table(table, out, ["a", "c"], "\t", keep_first=True), args.calls)
+        print("util_hutlab.select_table\t{:.2f}".format(ms))
+
+        ms = per_call(lambda: run("bin/crap2.py", table, out, "5"), args.calls)
+        print("bin/crap2.py\t{:.1f}".format(ms))
+        ms = per_call(lambda: util_hutlab.getlines(table, out, 5), args.calls)
+        print("util_hutlab.getlines\t{:.2f}".format(ms))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
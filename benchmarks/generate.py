@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+Seeded synthetic inputs for the benchmarks: FASTQ trees and abundance tables.
+
+`make_fastq_tree` writes a sequencing run laid out by lane, as `bin/catfiles.py`
+sees it in production:
+
+```
+run/
+    lane1/
+        S001_L1_R1.fastq.gz
+        S001_L1_R2.fastq.gz
+        ...
+    lane2/
+        ...
+```
+
+single-end (`S001_L1.fastq`) or paired, plain or gzipped, and returns the
+regular expression that groups it by sample. `make_abundance_table` writes a
+wide, sparse table (features by samples, mostly zeros, some rows all zeros)
+like a merged MetaPhlAn or HUMAnN profile. The same arguments and seed always
+give the same bytes.
+
+```sh
+python3 benchmarks/generate.py fastq run/ --samples 8 --lanes 4 --reads 20000 --paired --gz
+python3 benchmarks/generate.py table profile.tsv --features 20000 --samples 1000
+```
+"""
+
+import argparse
+import gzip
+import os
+import random
+
+BASES = "ACGT"
+QUALITIES = "".join(chr(c) for c in range(ord("#"), ord("J") + 1))
+# Distinct reads generated per file; records pick from these, which keeps
+# generation fast without making the data trivially compressible
+POOL = 512
+GZIP_LEVEL = 1
+
+
+def fastq_regex(paired, gz):
+    """Regular expression grouping the files of `make_fastq_tree` by sample (and mate)."""
+    ext = r"\.fastq" + (r"\.gz" if gz else "")
+    if paired:
+        return r"lane\d+/(S\d+)_L\d+_R(1|2)" + ext
+    return r"lane\d+/(S\d+)_L\d+" + ext
+
+
+def _reads(rng, n, length):
+    return ["".join(rng.choice(BASES) for _ in range(length)) for _ in range(n)]
+
+
+def _quals(rng, n, length):
+    return ["".join(rng.choice(QUALITIES) for _ in range(length)) for _ in range(n)]
+
+
+def write_fastq(path, reads, sample, lane, mate, read_length=100, seed=0, gz=False):
+    """Write `reads` records of `read_length` bases to `path`. Returns the bytes written (uncompressed)."""
+    rng = random.Random("{}-{}-{}-{}".format(seed, sample, lane, mate))
+    seqs = _reads(rng, POOL, read_length)
+    quals = _quals(rng, POOL, read_length)
+    picks = [rng.randrange(POOL) for _ in range(reads)]
+    total = 0
+    with open(path, "wb") as raw:
+        # no name or mtime in the gzip header, so the bytes only depend on the seed
+        f = gzip.GzipFile("", "wb", GZIP_LEVEL, raw, mtime=0) if gz else raw
+        for start in range(0, reads, 10000):
+            chunk = "".join("@{}:L{}:{} {}:N:0\n{}\n+\n{}\n".format(sample, lane, i, mate or 1, seqs[p],
+                quals[(p + i) % POOL]) for i, p in enumerate(picks[start:start + 10000], start)).encode()
+            f.write(chunk)
+            total += len(chunk)
+        if gz:
+            f.close()
+    return total
+
+
+def make_fastq_tree(folder, samples=4, lanes=2, reads=10000, paired=False, gz=False, read_length=100, seed=0):
+    """Write a lane-structured FASTQ tree to `folder` and return the regex that groups it."""
+    ext = ".fastq.gz" if gz else ".fastq"
+    for lane in range(1, lanes + 1):
+        lanedir = os.path.join(folder, "lane{}".format(lane))
+        if not os.path.isdir(lanedir):
+            os.makedirs(lanedir)
+        for s in range(1, samples + 1):
+            sample = "S{:03d}".format(s)
+            for mate in ((1, 2) if paired else (None,)):
+                name = "{}_L{}{}{}".format(sample, lane, "_R{}".format(mate) if mate else "", ext)
+                write_fastq(os.path.join(lanedir, name), reads, sample, lane, mate, read_length, seed, gz)
+    return fastq_regex(paired, gz)
+
+
+def make_abundance_table(path, features=10000, samples=500, density=0.05, zero_rows=0.3, sep="\t", seed=0):
+    """Write a features x samples abundance table to `path`, mostly zeros.
+
+    A fraction `zero_rows` of the rows are all zeros; the rest have about
+    `density` of their values above zero. Feature labels are zero-padded, so
+    rows are sorted by label. Returns the sample names.
+    """
+    rng = random.Random(seed)
+    names = ["sample{:05d}".format(i) for i in range(samples)]
+    zeros = ["0"] * samples
+    with open(path, "w") as f:
+        f.write(sep.join(["feature"] + names) + "\n")
+        for r in range(features):
+            row = zeros
+            if rng.random() >= zero_rows:
+                row = list(zeros)
+                k = min(samples, max(1, int(rng.expovariate(1.0 / (density * samples)))))
+                for i in rng.sample(range(samples), k):
+                    row[i] = "{:.5g}".format(rng.expovariate(1.0))
+            f.write("feature{:07d}{}{}\n".format(r, sep, sep.join(row)))
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write seeded synthetic benchmark inputs.")
+    commands = parser.add_subparsers(dest="command")
+    fastq = commands.add_parser("fastq", help="a lane-structured FASTQ tree", prog="generate.py fastq")
+    fastq.add_argument("folder", help="folder to write the tree to")
+    fastq.add_argument("--samples", default=4, type=int)
+    fastq.add_argument("--lanes", default=2, type=int)
+    fastq.add_argument("--reads", help="records per file", default=10000, type=int)
+    fastq.add_argument("--read-length", default=100, type=int)
+    fastq.add_argument("--paired", action="store_true")
+    fastq.add_argument("--gz", action="store_true")
+    fastq.add_argument("--seed", default=0, type=int)
+    table = commands.add_parser("table", help="a wide sparse abundance table", prog="generate.py table")
+    table.add_argument("path", help="table file to write")
+    table.add_argument("--features", default=10000, type=int)
+    table.add_argument("--samples", default=500, type=int)
+    table.add_argument("--density", help="fraction of values above zero in rows that aren't all zeros",
+        default=0.05, type=float)
+    table.add_argument("--zero-rows", help="fraction of rows that are all zeros", default=0.3, type=float)
+    table.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    if args.command == "fastq":
+        regex = make_fastq_tree(args.folder, args.samples, args.lanes, args.reads, args.paired, args.gz,
+            args.read_length, args.seed)
+        print(regex)
+    elif args.command == "table":
+        make_abundance_table(args.path, args.features, args.samples, args.density, args.zero_rows, seed=args.seed)
+    else:
+        parser.error("give a command: fastq or table")
+
+
+if __name__ == "__main__":
+    main()
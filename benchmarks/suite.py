@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+Run `bin/catfiles.py` and `bin/selectcols.py` on generated inputs at several
+scales, and compare their throughput and peak memory against a baseline.
+
+Inputs come from `generate.py` (seeded, so every machine benchmarks the same
+bytes) and are kept in `--workdir` between runs, where they're only
+regenerated when a scale's parameters change. Each case runs `--repeat`
+times as its own process, through `util_hutlab.sizing.record`, and the
+fastest run is kept; its peak memory is that of the tool's process alone.
+
+```sh
+python3 benchmarks/suite.py --scales small,medium --workdir /scratch/bench --save-baseline baseline.json
+python3 benchmarks/suite.py --scales small,medium --workdir /scratch/bench --baseline baseline.json
+```
+
+Against a `--baseline`, a case regresses when its throughput drops by more
+than `--threshold` (a fraction), or its peak memory grows by more than that
+fraction plus a few MB; the exit status is then 1. `--save-baseline` adds
+this run's results to the file (replacing the same cases and scales), so
+scales can be recorded separately. Baselines only compare runs on the same
+machine.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.metrics import read_metrics
+from util_hutlab.sizing import record
+from generate import make_abundance_table, make_fastq_tree
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+BASELINE_VERSION = 1
+# Peak memory can grow by this many MB on top of the threshold before it counts
+# as a regression, so small cases don't trip on interpreter noise
+MEM_SLACK = 10
+
+# Inputs at each scale: FASTQ samples, lanes and records per file, and table
+# features (rows) and samples (columns)
+SCALES = {
+    "small": {"samples": 4, "lanes": 2, "reads": 10000, "features": 20000, "columns": 500},
+    "medium": {"samples": 12, "lanes": 4, "reads": 50000, "features": 50000, "columns": 1000},
+    "large": {"samples": 32, "lanes": 8, "reads": 100000, "features": 200000, "columns": 2000},
+}
+
+# tool -> case -> (input, extra arguments); FASTQ inputs are (paired, gz)
+CASES = {
+    "catfiles": {
+        "single": ((False, False), []),
+        "paired": ((True, False), ["-p"]),
+        "paired_gz": ((True, True), ["-p"]),
+        "validate": ((True, False), ["-p", "--validate"]),
+    },
+    "selectcols": {
+        "columns": ("table", ["--column-glob", "sample*[02468]", "-k"]),
+        "filter": ("table", ["--column-glob", "sample*", "-k", "--min-samples", "5"]),
+        "jobs": ("table", ["--column-glob", "sample*[02468]", "-k", "-j", "4"]),
+    },
+}
+
+
+def dataset(workdir, scale, kind):
+    """Path of the input `kind` ("table" or (paired, gz)) at `scale`, generated if needed.
+
+    Returns the path, its size in bytes and, for FASTQ trees, the regex grouping it.
+    """
+    p = SCALES[scale]
+    if kind == "table":
+        path = os.path.join(workdir, scale, "table.tsv")
+        params = {"features": p["features"], "samples": p["columns"]}
+    else:
+        paired, gz = kind
+        path = os.path.join(workdir, scale, "fastq_{}_{}".format("paired" if paired else "single",
+            "gz" if gz else "plain"))
+        params = {"samples": p["samples"], "lanes": p["lanes"], "reads": p["reads"], "paired": paired, "gz": gz}
+    marker = path + ".params.json"
+    saved = None
+    if os.path.isfile(marker):
+        with open(marker) as f:
+            saved = json.load(f)
+    if saved is None or saved["params"] != params:
+        print("generating {}".format(path), file=sys.stderr)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if kind == "table":
+            make_abundance_table(path, **params)
+            regex = None
+        else:
+            regex = make_fastq_tree(path, **params)
+        size = os.path.getsize(path) if kind == "table" else sum(os.path.getsize(os.path.join(d, f))
+            for d, _, files in os.walk(path) for f in files)
+        saved = {"params": params, "size": size, "regex": regex}
+        with open(marker, "w") as f:
+            json.dump(saved, f)
+    return path, saved["size"], saved["regex"]
+
+
+def command(tool, path, regex, extra, out):
+    if tool == "catfiles":
+        return [sys.executable, os.path.join(BIN, "catfiles.py"), path, "-r", regex, "-o", out, "-q"] + extra
+    return [sys.executable, os.path.join(BIN, "selectcols.py"), path, "-s", "t", "-o", out, "-q"] + extra
+
+
+def run_case(workdir, tool, case, scale, repeat, runs):
+    """The fastest of `repeat` runs of a case: `{seconds, bytes_per_s, max_rss_mb}`."""
+    kind, extra = CASES[tool][case]
+    path, size, regex = dataset(workdir, scale, kind)
+    out = os.path.join(workdir, "out")
+    best = None
+    for _ in range(repeat):
+        if os.path.isdir(out):
+            shutil.rmtree(out)
+        elif os.path.exists(out):
+            os.remove(out)
+        name = "{}/{}/{}".format(tool, case, scale)
+        if record(None, command(tool, path, regex, extra, out), tool, size, metrics=runs, name=name):
+            raise RuntimeError("{} failed".format(name))
+        run = read_metrics([runs])[-1]
+        if best is None or run["wall"] < best["wall"]:
+            best = run
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    elif os.path.exists(out):
+        os.remove(out)
+    return {"seconds": best["wall"], "bytes": size, "bytes_per_s": round(size / max(best["wall"], 1e-6)),
+        "max_rss_mb": best["max_rss_mb"]}
+
+
+def compare(result, base, threshold):
+    """"ok", "slower", "more memory" (or both), or "new" if there's no baseline."""
+    if base is None:
+        return "new"
+    problems = []
+    if result["bytes_per_s"] < base["bytes_per_s"] * (1 - threshold):
+        problems.append("slower")
+    if result["max_rss_mb"] > base["max_rss_mb"] * (1 + threshold) + MEM_SLACK:
+        problems.append("more memory")
+    return ", ".join(problems) or "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tools at several scales against a baseline.")
+    parser.add_argument("--scales", help="comma separated scales ({})".format(", ".join(SCALES)), default="small")
+    parser.add_argument("--tools", help="comma separated tools", default=",".join(CASES))
+    parser.add_argument("--cases", help="comma separated cases to run (default: all of each tool's)")
+    parser.add_argument("--repeat", help="runs of each case, keeping the fastest", default=3, type=int)
+    parser.add_argument("--workdir", help="folder for the generated inputs, kept between runs (default: a "
+        "temporary folder)")
+    parser.add_argument("--baseline", help="baseline results to compare against")
+    parser.add_argument("--threshold", help="fraction throughput can drop (or memory grow) before it's a "
+        "regression (default: %(default)s)", default=0.15, type=float)
+    parser.add_argument("--save-baseline", help="add these results to this baseline file")
+    args = parser.parse_args()
+
+    for scale in args.scales.split(","):
+        if scale not in SCALES:
+            parser.error("unknown scale {}".format(scale))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved.get("version") != BASELINE_VERSION:
+            sys.exit("{} is from another version of the suite, save a new baseline".format(args.baseline))
+        baseline = saved["results"]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_suite_")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    runs = os.path.join(workdir, "runs.jsonl")
+    results = {}
+    regressed = False
+    try:
+        print("tool\tcase\tscale\tMB\tseconds\tMB/s\tpeak MB\tbaseline MB/s\tbaseline peak MB\tstatus")
+        for scale in args.scales.split(","):
+            for tool in args.tools.split(","):
+                for case in CASES[tool]:
+                    if args.cases and case not in args.cases.split(","):
+                        continue
+                    key = "{}/{}/{}".format(tool, case, scale)
+                    results[key] = r = run_case(workdir, tool, case, scale, args.repeat, runs)
+                    base = baseline.get(key)
+                    status = compare(r, base, args.threshold)
+                    regressed = regressed or status not in ("ok", "new")
+                    print("{}\t{}\t{}\t{:.1f}\t{:.3f}\t{:.1f}\t{:.1f}\t{}\t{}\t{}".format(tool, case, scale,
+                        r["bytes"] / 1e6, r["seconds"], r["bytes_per_s"] / 1e6, r["max_rss_mb"],
+                        "{:.1f}".format(base["bytes_per_s"] / 1e6) if base else "",
+                        "{:.1f}".format(base["max_rss_mb"]) if base else "", status))
+                    sys.stdout.flush()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    if args.save_baseline:
+        saved = {"version": BASELINE_VERSION, "results": {}}
+        if os.path.isfile(args.save_baseline):
+            with open(args.save_baseline) as f:
+                saved = json.load(f)
+        saved["results"].update(results)
+        with open(args.save_baseline, "w") as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -51,13 +51,45 @@ concatenated/
     patient2.R2.fastq
     patient3.R1.fastq
     patient3.R2.fastq
+```
+
+Inputs may be gzipped (`.fastq.gz`). By default (`--compress auto`) a sample
+whose inputs include any gzipped file is written as `{id}.R1.fastq.gz`:
+gzipped inputs are appended as-is, since gzip files can be concatenated, and
+plain inputs are compressed in parallel on `--compress-threads` cores. Use
+`--compress gzip` or `--compress none` to force the output format.
+
+With `--incremental`, a manifest of the inputs behind each output (paths,
+sizes, mtimes and, with `--hash`, a sampled content hash) is kept in
+`.catfiles_manifest.json` in the output folder. Rerunning skips outputs whose
+inputs are unchanged, and when new lanes only add files to the end of a
+sample's sorted list, just those files are appended.
+
+With `--validate`, records are checked as they are copied (4-line structure,
+sequence/quality lengths and, for paired-end reads, matching record counts
+and read names between mates). Per-output counts go to `--stats`, and samples
+that fail are removed. In incremental mode only the files copied in that run
+are checked.
+
+Inputs are copied strictly in sorted order, but the next `--prefetch` files
+(4 by default) are opened and their first few MB read on separate threads
+while each one is copied, so runs split into hundreds of small per-tile files
+don't wait on an open and a first read for every file, which on a network
+filesystem can take longer than the copy itself.
+
+With `--metrics FILE`, a line of JSON is appended to FILE with the seconds
+spent finding, grouping and copying files, the bytes copied and their rate,
+and peak memory (see `bin/metrics.py`).
 """
 
 import argparse
-import os
-from glob import glob
-import re
 import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import metrics
+from util_hutlab.catfiles import CHUNK_SIZE, GZIP_LEVEL, PREFETCH, concatenate_samples, logger
 
 
 parser = argparse.ArgumentParser(description="Concatenate fastq files from same subject.", usage=__doc__)
@@ -72,6 +104,28 @@ parser.add_argument("--idgroup", help="regex group containing sampleID", default
 parser.add_argument("--pairgroup", help="regex group paired-end ID", default=1, type=int)
 
 parser.add_argument("--dryrun", help="output logs but do not write files", action="store_true")
+parser.add_argument("--chunk-size", help="bytes per read when streaming (default: %(default)s)",
+    default=CHUNK_SIZE, type=int)
+parser.add_argument("--no-zerocopy", help="always stream through userspace, never use sendfile/copy_file_range",
+    action="store_true")
+parser.add_argument("--compress", help="output compression; auto gzips outputs when any input is gzipped",
+    choices=["auto", "gzip", "none"], default="auto")
+parser.add_argument("--level", help="gzip compression level", default=GZIP_LEVEL, type=int)
+parser.add_argument("--compress-threads", help="cores used to gzip plain input (default: all)",
+    default=os.cpu_count() or 1, type=int)
+parser.add_argument("-i", "--incremental",
+    help="keep a manifest in the output folder and only redo outputs whose inputs changed", action="store_true")
+parser.add_argument("--hash", help="with --incremental, also fingerprint inputs by content", action="store_true")
+parser.add_argument("--validate",
+    help="check FASTQ structure (and mate read names with -p) while copying; failing samples are removed",
+    action="store_true")
+parser.add_argument("--stats", help="TSV of per-output validation stats (default: OUTPUT/validation.tsv)")
+parser.add_argument("-j", "--jobs", help="number of output files to write concurrently", default=1, type=int)
+parser.add_argument("--prefetch",
+    help="input files opened and read ahead while each is copied, per output (default: %(default)s; 0 for none)",
+    default=PREFETCH, type=int)
+parser.add_argument("--metrics",
+    help="append the time, bytes and files of each phase (discover, group, plan, copy) to this JSON-lines file")
 
 # Logging options
 parser.add_argument("-v", "--verbose", help="Display info status messages", action="store_true")
@@ -81,108 +135,55 @@ parser.add_argument("--debug", help="Set logging to debug", action="store_true")
 parser.add_argument("-l", "--log",
     help="File path for log file")
 
-args = parser.parse_args()
 
-logger = logging.getLogger("Concatenate") # create logger
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
+def main():
+    args = parser.parse_args()
 
-sh = logging.StreamHandler()
-sh.setFormatter(formatter)
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
 
-# set level based on args
-if args.debug:
-    sh.setLevel(logging.DEBUG)
-elif args.verbose:
-    sh.setLevel(logging.INFO)
-elif args.quiet:
-    sh.setLevel(logging.ERROR)
-else:
-    sh.setLevel(logging.WARNING)
+    sh = logging.StreamHandler()
+    sh.setFormatter(formatter)
 
-logger.addHandler(sh) # add handler to logger
-
-if args.log and not args.dryrun:
-    logpath = os.path.abspath(args.log)
-
-    if os.path.isdir(logpath):
-        logpath = os.path.join(logpath, "concatenate.log")
-
-    fh = logging.FileHandler(logpath)
+    # set level based on args
     if args.debug:
-        fh.setLevel(logging.DEBUG)
+        sh.setLevel(logging.DEBUG)
+    elif args.verbose:
+        sh.setLevel(logging.INFO)
+    elif args.quiet:
+        sh.setLevel(logging.ERROR)
     else:
-        fh.setLevel(logging.INFO)
-
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
+        sh.setLevel(logging.WARNING)
 
+    logger.addHandler(sh) # add handler to logger
 
-output = args.output
-directory = args.directory
+    if args.log and not args.dryrun:
+        logpath = os.path.abspath(args.log)
 
-files = glob(directory+"/**/*.fastq*", recursive=True)
+        if os.path.isdir(logpath):
+            logpath = os.path.join(logpath, "concatenate.log")
 
-paired_end = args.paired_end
-regex = args.regex
-
-idgroup = args.idgroup
-pairgroup = args.pairgroup
+        fh = logging.FileHandler(logpath)
+        if args.debug:
+            fh.setLevel(logging.DEBUG)
+        else:
+            fh.setLevel(logging.INFO)
 
-logger.info("Looking for matching files")
+        fh.setFormatter(formatter)
+        logger.addHandler(fh)
 
-files = [f for f in files if re.search(regex, f)]
-if not files:
-    logger.warning("no matching files found")
 
-matches = [re.search(regex, x) for x in files]
-ids = sorted(set([x.groups()[idgroup] for x in matches]))
-logger.info("List of sample IDs:\n{}".format(ids))
+    if args.metrics:
+        metrics.start("catfiles", args.output)
+    try:
+        failed = concatenate_samples(args.directory, args.regex, args.output, args.paired_end, args.idgroup,
+            args.pairgroup, args.dryrun, args.chunk_size, not args.no_zerocopy, args.compress, args.level,
+            args.compress_threads, args.incremental, args.hash, args.validate, args.stats, args.jobs, args.prefetch)
+    finally:
+        metrics.stop().write(args.metrics)
+    if failed:
+        sys.exit(1)
 
-if not os.path.isdir(output) and not args.dryrun:
-    os.mkdir(output)
 
-for i in ids:
-    logger.info("Combining files for {}".format(i))
-    if paired_end:
-        f1 = [files[j] for j in range(len(files)) if matches[j].groups()[idgroup] == i and matches[j].groups()[pairgroup] == "1"]
-        f2 = [files[j] for j in range(len(files)) if matches[j].groups()[idgroup] == i and matches[j].groups()[pairgroup] == "2"]
-    else:
-        f1 = [files[j] for j in range(len(files)) if matches[j].groups()[idgroup] == i]
-        f2 = []
-
-    if not f1:
-        if paired_end:
-            logger.warning("no matches found for first read pair")
-        else:
-            logger.warning("no matches found")
-    else:
-        f1.sort()
-
-    if paired_end and not f2:
-        logger.warning("no matches found for second read pair")
-    elif paired_end:
-        f2.sort()
-
-    for f in f1:
-        if paired_end:
-            logger.info("1st pair - using file {}".format(os.path.basename(f)))
-        else:
-            logger.info("Using file {}".format(os.path.basename(f)))
-
-    for f in f2:
-        logger.info("2nd pair - using file {}".format(os.path.basename(f)))
-
-    logger.info("Writing to {}".format(os.path.basename("{}.R1.fastq".format(i))))
-    if not args.dryrun:
-        with open(os.path.join(output, "{}.R1.fastq".format(i)), "w+b") as out1:
-            for f in f1:
-                with open(f, "rb") as infile:
-                    out1.write(infile.read())
-    if paired_end:
-        logger.info("Writing to {}".format(os.path.basename("{}.R2.fastq".format(i))))
-        if not args.dryrun:
-            with open(os.path.join(output, "{}.R2.fastq".format(i)), "w+b") as out2:
-                for f in f2:
-                    with open(f, "rb") as infile:
-                        out2.write(infile.read())
+if __name__ == "__main__":
+    main()
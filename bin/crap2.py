@@ -1,30 +1,82 @@
 #!/usr/bin/env python
 
-import os
+"""
+Copy a file from line N (counting from 1) to the end, eg to resume processing
+of a large FASTQ or SAM file:
+
+```sh
+$ python bin/crap2.py reads.fastq rest.fastq 4000001
+```
+
+The file is read in binary mode and newlines are counted a block at a time, so
+the text is never decoded. Everything after the starting line is block-copied.
+With `--index`, a sidecar file `FILE.lineidx` stores the offset of every k-th
+line (rebuilt when the file's size or mtime changes), so later runs seek
+straight to the nearest one.
+
+`--end M` stops before line M, and with `--records` both numbers count FASTQ
+records (4 lines) instead of lines:
+
+```sh
+$ python bin/crap2.py reads.fastq some.fastq 1000001 --end 2000001 --records
+```
+
+`--split K` cuts a FASTQ file into K record-aligned shards of about the same
+size, written at the same time. The shard number goes in place of `{}` in the
+output name. Shard boundaries are found by seeking to the approximate offset
+and looking for the start of the next record, so the file isn't scanned first:
+
+```sh
+$ python bin/crap2.py reads.fastq reads.{}.fastq --split 8
+```
+
+With `--metrics FILE`, a line of JSON is appended to FILE with the seconds
+spent finding the starting line and copying, the bytes and lines copied and
+their rates, and peak memory (see `bin/metrics.py`).
+"""
+
+import argparse
 import logging
+import os
+import sys
 
-def getlines(f, o, n):
-  with open(f, "r") as infile, open(o, "w") as outfile:
-    c = 0
-    lines = 0
-    logging.warn("skipping until line {}".format(n))
-    n = int(n)
-    for l in infile:
-      c += 1
-      if c == n:
-        lines += 1
-        logging.warn("writing starting at line {}".format(c))
-        outfile.write(l)
-	for l in infile:
-	  lines +=1
-	  outfile.write(l)
-    logging.warn("wrote {} out of {} lines".format(lines, c))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import metrics
+from util_hutlab.lines import INDEX_EVERY, INDEX_SUFFIX, getlines, getrecords, split_records
 
 
 if __name__ == '__main__':
-  import sys
-  infile = sys.argv[1]
-  outfile = sys.argv[2]
-  startline = sys.argv[3]
-  getlines(infile, outfile, startline)  
-
+  parser = argparse.ArgumentParser(description="Copy a file from a given line to the end.", usage=__doc__)
+  parser.add_argument("infile", help="file to read")
+  parser.add_argument("outfile", help="file to write")
+  parser.add_argument("startline", help="first line to write, counting from 1", nargs="?", default=1, type=int)
+  parser.add_argument("-e", "--end", help="stop before this line", type=int)
+  parser.add_argument("-r", "--records", help="count startline and --end in FASTQ records (4 lines)",
+    action="store_true")
+  parser.add_argument("--split",
+    help="split a FASTQ file into this many shards, named by putting the shard number in place of {} in outfile",
+    type=int)
+  parser.add_argument("-j", "--jobs", help="threads writing shards with --split (default: one per shard)",
+    type=int)
+  parser.add_argument("-i", "--index",
+    help="use (and build or refresh) a sidecar index FILE{} of line offsets".format(INDEX_SUFFIX),
+    action="store_true")
+  parser.add_argument("--every", help="lines between index entries", default=INDEX_EVERY, type=int)
+  parser.add_argument("--metrics",
+    help="append the time, bytes and lines of each phase (index, seek, copy) to this JSON-lines file")
+  args = parser.parse_args()
+  if args.split and "{}" not in args.outfile:
+    parser.error("with --split, outfile needs a {} for the shard number")
+  if args.metrics:
+    metrics.start("crap2", args.infile)
+  try:
+    if args.split:
+      outputs = [args.outfile.format(i) for i in range(args.split)]
+      records = split_records(args.infile, outputs, args.jobs)
+      logging.warning("wrote {} records in {} shards".format(sum(records), len(outputs)))
+    elif args.records:
+      getrecords(args.infile, args.outfile, args.startline, args.index, args.every, args.end)
+    else:
+      getlines(args.infile, args.outfile, args.startline, args.index, args.every, args.end)
+  finally:
+    metrics.stop().write(args.metrics)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Gather the metrics files written with `--metrics` across the tasks of a run.
+
+`bin/catfiles.py`, `bin/selectcols.py` and `bin/crap2.py` append one line of
+JSON per run to their `--metrics` file, and the workflows' `--metrics` does
+the same for each of their tasks. All of them can share one file:
+
+```sh
+$ python bin/metrics.py metrics.jsonl
+```
+
+prints, for each tool and phase, the number of runs, the total seconds,
+bytes and rows, and the overall and median bytes/s, then the `--slowest`
+runs (lowest bytes/s) of each phase, with their names and hosts, to find
+slow lanes or nodes. `--tool` and `--phase` restrict both to one tool or
+phase.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.metrics import read_metrics, slowest, summarize
+
+
+parser = argparse.ArgumentParser(description="Summarize metrics files.", usage=__doc__)
+parser.add_argument("metrics", help="metrics files (JSON lines)", nargs="+")
+parser.add_argument("--tool", help="only runs of this tool (or kind of workflow task)")
+parser.add_argument("--phase", help="only this phase")
+parser.add_argument("-n", "--slowest", help="slowest runs to list per phase (default: %(default)s)", default=10,
+    type=int)
+
+
+def rate(bytes_per_s):
+    return "" if bytes_per_s is None else "{:.1f}".format(bytes_per_s / 1e6)
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
+
+    entries = [e for e in read_metrics(args.metrics) if args.tool is None or e.get("tool") == args.tool]
+    summary = [s for s in summarize(entries) if args.phase is None or s["phase"] == args.phase]
+    if not summary:
+        sys.exit("no runs found")
+
+    print("tool\tphase\truns\tseconds\tbytes\trows\tMB/s\tmedian MB/s")
+    for s in summary:
+        print("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format(s["tool"], s["phase"], s["runs"], s["seconds"], s["bytes"],
+            s["rows"], rate(s["bytes_per_s"]), rate(s["median_bytes_per_s"])))
+
+    if args.slowest > 0:
+        print("\ntool\tphase\tname\thost\tseconds\tMB/s")
+        for s in summary:
+            if s["bytes_per_s"] is None:
+                continue
+            runs = [e for e in entries if e.get("tool") == s["tool"]]
+            for bytes_per_s, e in slowest(runs, s["phase"], args.slowest):
+                print("{}\t{}\t{}\t{}\t{}\t{}".format(s["tool"], s["phase"], e.get("name"), e.get("host"),
+                    e["phases"][s["phase"]]["seconds"], rate(bytes_per_s)))
+
+
+if __name__ == "__main__":
+    main()
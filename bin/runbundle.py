@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+Run a bundle of workflow tasks written by `util_hutlab.batching.submit`.
+
+The workflows bundle small tasks (`--batch-minutes`) and submit one grid job
+per bundle, which runs:
+
+```sh
+$ python bin/runbundle.py output/bundles/bundle_03.json --cores 4
+```
+
+Tasks run as many at once as fit on `--cores`, tasks whose targets are newer
+than their dependencies are skipped, and each task's exit status and run
+time are appended to `bundle_03.json.status`. The targets of failed tasks
+are removed and the exit status is 1 if any task failed, so rerunning the
+bundle redoes only those.
+
+`--task I` runs only the I-th task (counting from 0) of the bundle, to
+submit a bundle as an array job instead:
+
+```sh
+$ sbatch --array=0-24 --wrap 'python bin/runbundle.py bundle_03.json --task $SLURM_ARRAY_TASK_ID'
+```
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.batching import STATUS_SUFFIX, logger, read_manifest, run_tasks
+
+
+parser = argparse.ArgumentParser(description="Run a bundle of workflow tasks.", usage=__doc__)
+parser.add_argument("manifest", help="bundle manifest (JSON)")
+parser.add_argument("-c", "--cores", help="cores to share between tasks (default: all)",
+    default=os.cpu_count() or 1, type=int)
+parser.add_argument("--task", help="run only this task of the bundle, counting from 0", type=int)
+parser.add_argument("--force", help="run tasks even when their targets are up to date", action="store_true")
+parser.add_argument("-q", "--quiet", help="Suppress most output", action="store_true")
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
+    logger.setLevel(logging.ERROR if args.quiet else logging.INFO)
+
+    tasks = read_manifest(args.manifest)
+    if args.task is not None:
+        if not 0 <= args.task < len(tasks):
+            sys.exit("{} has {} tasks, there's no task {}".format(args.manifest, len(tasks), args.task))
+        tasks = [tasks[args.task]]
+    failed = run_tasks(tasks, args.cores, args.manifest + STATUS_SUFFIX, not args.force)
+    if failed:
+        logger.error("{} of {} tasks failed: {}".format(len(failed), len(tasks), ", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
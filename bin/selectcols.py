@@ -1,12 +1,8 @@
 #!/usr/bin/env python
 
-import argparse
-import os
-from glob import glob
-import re
-import logging
+"""
+Usage
 
-""" Usage
 Given a table file (eg .tsv or .csv), and a list of column names (one label per
 line), this script will generate a new file with only the specified columns.
 
@@ -38,18 +34,102 @@ row1	1	3
 row2	4	6
 row3	7	9
 ```
+
+With `--numpy` (requires numpy), the table is memory-mapped and dense numeric
+blocks are filtered with array operations. Blocks that aren't plain numbers
+(ragged rows, `NA`, `nan`, CRLF line ends...) go through the normal path, so
+the output is identical either way. It pays off when most columns are kept
+(1.4-2.5x faster with all of them, up to 4.5x with `-z`); with fewer than
+three quarters of them selected the normal path is faster, and is used
+instead.
+
+With `--index`, a sidecar file `TABLE.selidx` stores the header, row offsets and
+which rows are all zeros. It is rebuilt when the table's size or mtime
+changes; later runs seek past all-zero rows without reading them.
+
+With `--jobs N`, the table is cut at newlines into ~16 MB pieces that are
+filtered on N processes and written back in order, to a file or STDOUT.
+
+Tables compressed with gzip, bzip2 or xz are detected automatically, and an
+output name ending in `.gz`, `.bz2` or `.xz` is compressed accordingly. Both
+run on their own threads so parsing isn't held up by the codec.
+
+Rows can also be filtered on their values: `--min-abundance X --min-samples N`
+keeps rows with at least N selected values of X or more, `--min-prevalence P`
+keeps rows present (above 0, or at least X) in a fraction P of the selected
+columns, and `--label-regex RE` keeps rows whose first field matches RE. These
+run in the same pass as the column selection, on every path.
+
+Columns can also be picked with `--column-regex` and `--column-glob` (each can
+be given more than once), matched once against the header. `-r FILE` keeps only
+the rows whose first field is one of the labels in FILE (one per line); with no
+column options, all columns are kept. If the table's rows are sorted by label
+(as with `LC_ALL=C sort`), `--sorted` stops reading after the last label in
+FILE.
+
+With `--batch-dir DIR`, the same selection is applied to every table given
+(paths, quoted globs, or a `--manifest` with one path per line), each written
+to DIR under its own name. Up to `--jobs` tables are processed at a time, and
+a summary of rows kept and dropped per table goes to
+`DIR/selectcols_summary.tsv`:
+
+```sh
+$ python3 bin/selectcols.py 'tables/*_pathabundance.tsv' -c columns.txt -s t -k -b selected/ -j 8
+```
+
+With `--metrics FILE`, a line of JSON is appended to FILE with the seconds
+spent reading, filtering and writing, the bytes and rows that went through
+and their rates, and peak memory (see `bin/metrics.py`).
 """
 
+import argparse
+from glob import glob
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import metrics
+from util_hutlab.selectcols import (ColumnPatterns, Filters, INDEX_SUFFIX, logger, parse_separator, same_file,
+                                   select_table, select_tables)
+
 # Required arguments
 parser = argparse.ArgumentParser(description="Get selected columns from table.", usage=__doc__)
-parser.add_argument("table", help="table file")
-parser.add_argument("-c", "--columns", help="text file with one column name per line", required=True)
+parser.add_argument("table", help="table file (with --batch-dir, any number of tables or quoted globs)", nargs="*")
+
+# Column and row selection (at least one is required)
+parser.add_argument("-c", "--columns", help="text file with one column name per line")
+parser.add_argument("--column-regex", help="keep columns whose name matches this regular expression",
+    action="append", default=[])
+parser.add_argument("--column-glob", help="keep columns whose name matches this glob", action="append", default=[])
+parser.add_argument("-r", "--rows", help="text file with one row label (first field) per line")
+parser.add_argument("--sorted", help="table rows are sorted by label, so stop after the last one in --rows",
+    action="store_true")
 
 # Optional arguments
 parser.add_argument("-s", "--separator", help="separator for columns", default=",")
 parser.add_argument("-o", "--output", help="name of output file", default=False)
 parser.add_argument("-k", "--keep-first", help="Keep first column", action="store_true")
 parser.add_argument("-z", "--keep-zeros", help="Keep rows with only zeros", action="store_true")
+parser.add_argument("--numpy", help="memory-map the table and filter dense numeric blocks with numpy",
+    action="store_true")
+parser.add_argument("-j", "--jobs", help="number of worker processes (with --batch-dir, tables at a time)", default=1,
+    type=int)
+parser.add_argument("--min-abundance", help="count a value as present when it is at least this (default: above 0)",
+    type=float)
+parser.add_argument("--min-samples", help="keep rows with at least this many present values", default=1, type=int)
+parser.add_argument("--min-prevalence", help="keep rows present in at least this fraction of the selected columns",
+    type=float)
+parser.add_argument("--label-regex", help="keep rows whose first field matches this regular expression")
+parser.add_argument("-b", "--batch-dir", help="select from every table into files of the same name in this folder")
+parser.add_argument("--manifest", help="with --batch-dir, text file with one table path per line")
+parser.add_argument("--summary", help="with --batch-dir, TSV of rows kept and dropped per table "
+    "(default: BATCH_DIR/selectcols_summary.tsv)")
+parser.add_argument("-i", "--index",
+    help="use (and build or refresh) a sidecar index TABLE{} to skip all-zero rows".format(INDEX_SUFFIX),
+    action="store_true")
+parser.add_argument("--metrics",
+    help="append the time, bytes and rows of each phase (parse, filter, write) to this JSON-lines file")
 
 # Logging options
 parser.add_argument("-v", "--verbose", help="Display info status messages", action="store_true")
@@ -59,99 +139,105 @@ parser.add_argument("-l", "--log",
     help="File path for log file")
 
 
-args = parser.parse_args()
-
-logger = logging.getLogger("Column selector") # create logger
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
-
-sh = logging.StreamHandler()
-sh.setFormatter(formatter)
-
-# set level based on args
-if args.debug:
-    sh.setLevel(logging.DEBUG)
-elif args.verbose:
-    sh.setLevel(logging.INFO)
-elif args.quiet:
-    sh.setLevel(logging.ERROR)
-else:
-    sh.setLevel(logging.WARNING)
-
-logger.addHandler(sh) # add handler to logger
-
-if args.log:
-    logpath = os.path.abspath(args.log)
-
-    if os.path.isdir(logpath):
-        logpath = os.path.join(logpath, "column_select.log")
-
-    fh = logging.FileHandler(logpath)
-    fh.setFormatter(formatter)
-    fh.setLevel(logging.DEBUG)
-    logger.addHandler(fh)
-
-if args.output:
-    out = open(args.output, "w+")
-else:
-    from sys import stdout
-    out = stdout
-
-# Begin script
-sep = args.separator
-if sep == "\\t" or sep == "t" or sep == "tab":
-    sep = "\t"
-elif sep == "s" or sep == "space" or sep == " ":
-    sep = " "
-elif sep == "c" or sep == "comma" or sep == ",":
-    sep = ","
-else:
-    raise ValueError("Invalid separator")
-
-def getcols(row, indicies):
-    return [row[i] for i in indicies]
-
-def writerow(row_list, out_handle, separator):
-    for i in range(len(row_list)):
-        out_handle.write(row_list[i])
-        if not i == len(row_list) - 1:
-            out_handle.write(separator)
-    out_handle.write("\n")
-
-columns = []
-with open(args.columns, "r") as colfile:
-    for line in colfile:
-        columns.append(line.strip())
-
-logger.info("Getting Columns:")
-logger.info(columns)
-
-
-with open(args.table, "r") as table:
-    cols = table.readline().rstrip("\n").split(sep)
-    colnos = [i for i, x in enumerate(cols) if x in columns]
-
-    columns = None
-    if args.keep_first and not colnos[0] == 0:
-        colnos.insert(0, 0)
-
-    logger.debug(colnos)
-
-    cols = getcols(cols, colnos)
-    writerow(cols, out, sep)
-
-    for l in table:
-        row = getcols(l.rstrip("\n").split(sep), colnos)
-        if args.keep_zeros:
-            writerow(row, out, sep)
+def main():
+    args = parser.parse_args()
+    if not (args.columns or args.column_regex or args.column_glob or args.rows):
+        parser.error("one of -c/--columns, --column-regex, --column-glob or -r/--rows is required")
+
+    tables = []
+    for pattern in args.table:
+        tables.extend(sorted(glob(pattern)) or [pattern])
+    if args.manifest:
+        with open(args.manifest, "r") as manifest:
+            tables.extend(line.strip() for line in manifest if line.strip())
+    if args.batch_dir is None and len(tables) != 1:
+        parser.error("give one table, or use --batch-dir for several")
+    if args.batch_dir is not None and args.output:
+        parser.error("--output can't be used with --batch-dir")
+
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S')
+
+    sh = logging.StreamHandler()
+    sh.setFormatter(formatter)
+
+    # set level based on args
+    if args.debug:
+        sh.setLevel(logging.DEBUG)
+    elif args.verbose:
+        sh.setLevel(logging.INFO)
+    elif args.quiet:
+        sh.setLevel(logging.ERROR)
+    else:
+        sh.setLevel(logging.WARNING)
+
+    logger.addHandler(sh) # add handler to logger
+
+    if args.log:
+        logpath = os.path.abspath(args.log)
+
+        if os.path.isdir(logpath):
+            logpath = os.path.join(logpath, "column_select.log")
+
+        fh = logging.FileHandler(logpath)
+        fh.setFormatter(formatter)
+        fh.setLevel(logging.DEBUG)
+        logger.addHandler(fh)
+
+    # Begin script
+    sep = parse_separator(args.separator)
+
+    columns = []
+    if args.columns:
+        with open(args.columns, "r") as colfile:
+            for line in colfile:
+                columns.append(line.strip())
+
+    logger.info("Getting Columns:")
+    logger.info(columns)
+
+    if args.column_regex or args.column_glob:
+        logger.info("Column patterns: {}".format(args.column_regex + args.column_glob))
+        columns = ColumnPatterns(columns, args.column_regex, args.column_glob)
+    elif not args.columns:
+        # rows only: every column, with the labels kept as labels
+        columns = ColumnPatterns(globs=["*"])
+        args.keep_first = True
+
+    labels = None
+    if args.rows:
+        with open(args.rows, "r") as rowfile:
+            labels = frozenset(line.rstrip("\r\n") for line in rowfile) - {""}
+        logger.info("Getting {} rows".format(len(labels)))
+
+    filters = None
+    if args.min_abundance is not None or args.min_samples != 1 or args.min_prevalence is not None or \
+            args.label_regex is not None or labels is not None:
+        filters = Filters(args.min_abundance, args.min_samples, args.min_prevalence, args.label_regex, labels,
+            args.sorted)
+        logger.info("Filtering rows: {}".format(filters._replace(labels=labels and len(labels))))
+
+    if args.metrics:
+        metrics.start("selectcols", args.batch_dir or tables[0])
+    try:
+        if args.batch_dir is not None:
+            logger.info("Selecting from {} tables into {}".format(len(tables), args.batch_dir))
+            try:
+                failed = select_tables(tables, args.batch_dir, columns, sep, args.keep_first, args.keep_zeros,
+                    args.numpy, args.jobs, args.index, filters, args.summary)
+            except ValueError as e:
+                parser.error(str(e))
+            if failed:
+                logger.error("Failed tables:\n{}".format(failed))
+                sys.exit(1)
         else:
-            if args.keep_first:
-                vals = row[1:]
-            else:
-                vals = row
-            if not sum([x for x in map(float, vals)]) == 0:
-                writerow(row, out, sep)
+            if args.output and same_file(tables[0], args.output):
+                parser.error("--output is the table itself, use another file")
+            select_table(tables[0], args.output, columns, sep, args.keep_first, args.keep_zeros, args.numpy,
+                args.jobs, args.index, filters)
+    finally:
+        metrics.stop().write(args.metrics)
 
 
-if args.output:
-    out.close()
+if __name__ == "__main__":
+    main()
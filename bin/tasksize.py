@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Record what workflow tasks use, and fit per-task resource requests from it.
+
+`run` runs a command and appends its wall time, CPU time and peak memory,
+along with the sizes it was given, to a resource log (one JSON object per
+line). The workflows do this for every task when given `--resource-log`:
+
+```sh
+$ python bin/tasksize.py run runs.jsonl --kind panphlan_map --input-bytes 2147483648 -- panphlan_map.py ...
+```
+
+With `--metrics FILE` (the workflows' `--metrics`), the run is also appended
+to a metrics file in the format of `util_hutlab.metrics`, named by `--name`,
+to be gathered with `bin/metrics.py`. The resource log can then be left out.
+
+`fit` turns one or more logs into a model, which the workflows read with
+`--sizing` to set `time`, `mem` and `cores` for each task from its input and
+index sizes:
+
+```sh
+$ python bin/tasksize.py fit runs.jsonl -o sizing.json
+```
+
+`show` prints what a model would request for a task of the given sizes.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.sizing import MIN_RECORDS, SizingModel, logger, read_log, record
+
+
+parser = argparse.ArgumentParser(description="Record and model task resource use.", usage=__doc__)
+commands = parser.add_subparsers(dest="command")
+
+run = commands.add_parser("run", help="run a command and log its resource use", prog="tasksize.py run")
+run.add_argument("log", help="resource log to append to", nargs="?")
+run.add_argument("--kind", help="kind of task, eg panphlan_map", required=True)
+run.add_argument("--input-bytes", help="size of the task's input", default=0, type=int)
+run.add_argument("--index-bytes", help="size of one reference's index", default=0, type=int)
+run.add_argument("--refs", help="references handled by the task", default=1, type=int)
+run.add_argument("--cores", help="cores the task was given", default=1, type=int)
+run.add_argument("--metrics", help="metrics file to append the run to")
+run.add_argument("--name", help="name of the task in the metrics file")
+
+fit = commands.add_parser("fit", help="fit a sizing model to resource logs", prog="tasksize.py fit")
+fit.add_argument("logs", help="resource logs", nargs="+")
+fit.add_argument("-o", "--output", help="model file to write", required=True)
+fit.add_argument("--min-records", help="runs needed to model a kind of task (default: %(default)s)",
+    default=MIN_RECORDS, type=int)
+
+show = commands.add_parser("show", help="print the resources a model gives a task", prog="tasksize.py show")
+show.add_argument("model", help="model file")
+show.add_argument("--kind", help="kind of task", required=True)
+show.add_argument("--input-bytes", help="size of the task's input", default=0, type=int)
+show.add_argument("--index-bytes", help="size of one reference's index", default=0, type=int)
+show.add_argument("--refs", help="references handled by the task", default=1, type=int)
+show.add_argument("--cores", help="cores to size for (default: chosen by the model)", type=int)
+
+
+def main():
+    # everything after -- is the command to run, options and all
+    argv = sys.argv[1:]
+    cmd = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv[:len(argv) - len(cmd) - 1] if "--" in argv else argv)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d,%H:%M:%S',
+        level=logging.INFO)
+
+    if args.command == "run":
+        if not cmd:
+            run.error("give the command to run after --")
+        if not (args.log or args.metrics):
+            run.error("give a resource log, --metrics, or both")
+        sys.exit(record(args.log, cmd, args.kind, args.input_bytes, args.index_bytes, args.refs, args.cores,
+            args.metrics, args.name))
+    elif args.command == "fit":
+        records = []
+        for log in args.logs:
+            records.extend(read_log(log))
+        model = SizingModel.fit(records, args.min_records)
+        for kind, f in sorted(model.kinds.items()):
+            logger.info("{}: {} runs, cpu {}, mem {}".format(kind, f["runs"],
+                ", ".join("{:.4g}".format(c) for c in f["cpu"]), ", ".join("{:.4g}".format(c) for c in f["mem"])))
+        model.save(args.output)
+    elif args.command == "show":
+        model = SizingModel.load(args.model)
+        if args.kind not in model.kinds:
+            sys.exit("{} has no fit for {}".format(args.model, args.kind))
+        print(json.dumps(model.resources(args.kind, {}, args.input_bytes, args.index_bytes, args.refs, args.cores)))
+    else:
+        parser.error("give a command: run, fit or show")
+
+
+if __name__ == "__main__":
+    main()
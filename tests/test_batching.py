@@ -0,0 +1,149 @@
+"""
+Bundling tiny shell tasks with `submit` and running them with `LocalGrid`,
+through `bin/runbundle.py` as a grid job would.
+"""
+
+import json
+import os
+import shlex
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.batching import BUNDLE_PAD, STATUS_SUFFIX, LocalGrid, Task, pack, run_tasks, submit
+
+RUNNER = shlex.quote(sys.executable) + " {} {} --cores {} --quiet"
+
+
+def write(path, text="x\n"):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read_status(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def make_tasks(folder, n=6, time=10):
+    """`n` tasks, each copying its own input to its own target."""
+    tasks = []
+    for i in range(n):
+        source, target = os.path.join(folder, "in{}".format(i)), os.path.join(folder, "out{}".format(i))
+        write(source, "{}\n".format(i))
+        tasks.append(Task("t{}".format(i), "cp {} {}".format(shlex.quote(source), shlex.quote(target)), (source,),
+            (target,), time, 100 * (i + 1), 1))
+    return tasks
+
+
+def test_pack_bounds():
+    times = [50, 5, 12, 30, 7, 7, 25, 3, 90, 14, 1, 40]
+    tasks = [Task("t{}".format(i), "true", (), ("out{}".format(i),), t, 100 + i, 1 + i % 3)
+        for i, t in enumerate(times)]
+    bundles = pack(tasks, 60, cores=2)
+    assert sorted(t.name for b in bundles for t in b.tasks) == sorted(t.name for t in tasks)
+    for b in bundles:
+        work = sum(t.time * min(t.cores, 2) for t in b.tasks)
+        longest = max(t.time for t in b.tasks)
+        # the target is only passed by a task that doesn't fit in it on its own
+        assert work <= 60 * 2 or len(b.tasks) == 1
+        assert b.cores <= 2
+        # long enough for the longest task, and never more than running them one after another
+        assert longest + BUNDLE_PAD <= b.time <= sum(t.time for t in b.tasks) + BUNDLE_PAD
+        assert max(t.mem for t in b.tasks) <= b.mem <= sum(t.mem for t in b.tasks)
+    assert [b.name for b in bundles] == ["bundle_{:d}".format(i) for i in range(len(bundles))]
+
+
+def test_pack_refuses_dependent_tasks():
+    tasks = [Task("a", "true", (), ("x",)), Task("b", "true", ("x",), ("y",))]
+    with pytest.raises(ValueError):
+        pack(tasks, 60)
+
+
+def test_submit_bundles_carry_their_tasks_files(tmp_path):
+    tasks = make_tasks(str(tmp_path))
+    # a dependency shared by two tasks is listed once
+    tasks[1] = tasks[1]._replace(depends=tasks[1].depends + tasks[0].depends)
+    grid = LocalGrid()
+    bundles = submit(grid, tasks, str(tmp_path / "bundles"), minutes=20, runner=RUNNER)
+    assert len(bundles) == 3
+    assert [s.name for s in grid.submitted] == [b.name for b in bundles]
+    for job, bundle in zip(grid.submitted, bundles):
+        assert list(job.depends) == sorted(set(d for t in bundle.tasks for d in t.depends))
+        assert sorted(job.targets) == sorted(t for task in bundle.tasks for t in task.targets)
+        assert (job.time, job.mem, job.cores) == (bundle.time, bundle.mem, bundle.cores)
+
+
+def test_submit_without_minutes_adds_each_task():
+    tasks = [Task("a", "true", ("x",), ("y",), 5, 10, 2)]
+    grid = LocalGrid()
+    assert submit(grid, tasks) == []
+    assert grid.submitted == tasks
+
+
+def test_bundles_run_and_record_status(tmp_path):
+    tasks = make_tasks(str(tmp_path))
+    grid = LocalGrid(cores=2)
+    bundles = submit(grid, tasks, str(tmp_path / "bundles"), minutes=20, cores=2, runner=RUNNER)
+    assert grid.go() == []
+    for i in range(len(tasks)):
+        with open(str(tmp_path / "out{}".format(i))) as f:
+            assert f.read() == "{}\n".format(i)
+    for b in bundles:
+        status = read_status(str(tmp_path / "bundles" / (b.name + ".json" + STATUS_SUFFIX)))
+        assert sorted(s["name"] for s in status) == sorted(t.name for t in b.tasks)
+        assert all(s["returncode"] == 0 and s["seconds"] >= 0 for s in status)
+
+
+def test_up_to_date_tasks_are_skipped(tmp_path):
+    tasks = make_tasks(str(tmp_path), n=2)
+    status = str(tmp_path / "status")
+    assert run_tasks(tasks, status=status) == []
+    # t0's input changes; t1's target stays newer than its input
+    write(tasks[0].depends[0], "changed\n")
+    os.utime(tasks[0].depends[0], (2e9, 2e9))
+    os.utime(tasks[1].targets[0], (2e9, 2e9))
+    os.remove(tasks[1].depends[0])
+    write(tasks[1].depends[0], "not copied\n")
+    os.utime(tasks[1].depends[0], (1e9, 1e9))
+    assert run_tasks(tasks, status=status) == []
+    second = read_status(status)[2:]
+    assert sorted(second, key=lambda s: s["name"])[1] == {"name": "t1", "returncode": 0, "skipped": True}
+    assert "skipped" not in [s for s in second if s["name"] == "t0"][0]
+    with open(tasks[0].targets[0]) as f:
+        assert f.read() == "changed\n"
+    with open(tasks[1].targets[0]) as f:
+        assert f.read() == "1\n"
+    # a missing target is never up to date
+    os.remove(tasks[1].targets[0])
+    assert run_tasks(tasks[1:], status=status) == []
+    assert "skipped" not in read_status(status)[-1]
+
+
+def test_failed_tasks_lose_their_targets(tmp_path):
+    tasks = make_tasks(str(tmp_path), n=3)
+    bad = str(tmp_path / "bad")
+    tasks.append(Task("bad", "echo partial > {}; exit 3".format(shlex.quote(bad)), (), (bad,), 10, 100, 1))
+    # a task after the bundle, depending on the failed task's target, doesn't run
+    after = str(tmp_path / "after")
+    grid = LocalGrid()
+    bundles = submit(grid, tasks, str(tmp_path / "bundles"), minutes=60, runner=RUNNER)
+    assert len(bundles) == 1
+    grid.add_task_gridable("cp {} {}".format(shlex.quote(bad), shlex.quote(after)), depends=[bad], targets=[after],
+        name="after")
+    assert grid.go() == [bundles[0].name, "after"]
+    assert not os.path.exists(bad)
+    assert not os.path.exists(after)
+    # the other tasks of the bundle still ran, and keep their targets
+    assert all(os.path.isfile(t.targets[0]) for t in tasks[:3])
+    status = read_status(str(tmp_path / "bundles" / (bundles[0].name + ".json" + STATUS_SUFFIX)))
+    assert {s["name"]: s["returncode"] for s in status} == {"t0": 0, "t1": 0, "t2": 0, "bad": 3}
+
+    # rerunning the bundle only redoes the failed task
+    grid = LocalGrid()
+    submit(grid, tasks, str(tmp_path / "bundles"), minutes=60, runner=RUNNER)
+    assert grid.go() == [bundles[0].name]
+    status = read_status(str(tmp_path / "bundles" / (bundles[0].name + ".json" + STATUS_SUFFIX)))[4:]
+    assert {s["name"]: s.get("skipped", False) for s in status} == {"t0": True, "t1": True, "t2": True,
+        "bad": False}
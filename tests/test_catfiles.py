@@ -0,0 +1,209 @@
+"""
+`bin/catfiles.py` has to write the same bytes however it copies: zero-copy or
+streamed, gzip inputs passed through or decompressed, in one go or appended
+to later. With --validate, a sample with broken FASTQ fails on its own.
+"""
+
+import gzip
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import catfiles
+from util_hutlab.catfiles import PREFETCH_BYTES, concatenate, concatenate_samples, copyfile, group_files
+
+REGEX = r"(S\d+)_L\d+_R([12])"
+
+
+def fastq(name, n, seed=0):
+    """`n` FASTQ records named `name`/1, `name`/2... as bytes."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        seq = "".join(rng.choice("ACGT") for _ in range(rng.randint(20, 80)))
+        qual = "".join(rng.choice("@+#5?IF") for _ in seq)
+        records.append("@{}/{} lane\n{}\n+\n{}\n".format(name, i, seq, qual))
+    return "".join(records).encode()
+
+
+def write(path, data, gzipped=False):
+    with open(path, "wb") as f:
+        f.write(gzip.compress(data) if gzipped else data)
+    return path
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Plain files of every size the copy treats differently: empty, read ahead whole, and larger."""
+    sizes = [0, 10, PREFETCH_BYTES - 1, PREFETCH_BYTES, PREFETCH_BYTES + 123, 2 * PREFETCH_BYTES + 7]
+    rng = random.Random(1)
+    return [write(str(tmp_path / "in{}.fastq".format(n)), rng.randbytes(size)) for n, size in enumerate(sizes)]
+
+
+def test_zerocopy_matches_streamed(inputs, tmp_path, monkeypatch):
+    calls = []
+    zerocopy = catfiles._zerocopy
+    monkeypatch.setattr(catfiles, "_zerocopy", lambda infd, outfd: calls.append(1) or zerocopy(infd, outfd))
+    expected = b"".join(read(f) for f in inputs)
+    streamed, copied = str(tmp_path / "streamed.fastq"), str(tmp_path / "zerocopy.fastq")
+    for prefetch_files in (0, 2):
+        assert concatenate(inputs, streamed, chunk_size=1000, zerocopy=False, prefetch_files=prefetch_files) == \
+            len(expected)
+        assert not calls
+        assert concatenate(inputs, copied, chunk_size=1000, zerocopy=True, prefetch_files=prefetch_files) == \
+            len(expected)
+        # only the files too large to be read ahead whole are copied in the kernel
+        assert len(calls) == 3
+        del calls[:]
+        assert read(streamed) == read(copied) == expected
+
+
+def test_copyfile_resumes_after_buffered_reads(inputs, tmp_path, monkeypatch):
+    # a reader that has buffered ahead of what it returned, and a kernel that can't copy these files
+    path = inputs[-1]
+    for unsupported in (False, True):
+        if unsupported:
+            monkeypatch.setattr(catfiles, "_zerocopy", lambda infd, outfd: None)
+        out = str(tmp_path / "out")
+        with open(path, "rb") as f, open(out, "wb") as o:
+            o.write(f.read(5))
+            assert copyfile(f, o, chunk_size=1000) == os.path.getsize(path) - 5
+            assert f.read() == b""
+        assert read(out) == read(path)
+
+
+def test_group_files_pairs_mates():
+    files = ["/d/S2_L002_R1.fastq", "/d/S1_L002_R2.fastq", "/d/S1_L001_R1.fastq", "/d/S1_L002_R1.fastq",
+             "/d/S1_L001_R2.fastq", "/d/S10_L001_R1.fastq", "/d/notes.fastq"]
+    assert group_files(files, REGEX, paired_end=True) == {
+        ("S1", "1"): ["/d/S1_L001_R1.fastq", "/d/S1_L002_R1.fastq"],
+        ("S1", "2"): ["/d/S1_L001_R2.fastq", "/d/S1_L002_R2.fastq"],
+        ("S2", "1"): ["/d/S2_L002_R1.fastq"],
+        ("S10", "1"): ["/d/S10_L001_R1.fastq"],
+    }
+    # single-end: both mates' files go to one group
+    assert group_files(files, REGEX)[("S1", None)] == ["/d/S1_L001_R1.fastq", "/d/S1_L001_R2.fastq",
+        "/d/S1_L002_R1.fastq", "/d/S1_L002_R2.fastq"]
+    # the groups can be picked out of a pattern with more of them
+    assert list(group_files(["/d/x_S1_L001_R2.fastq"], r"(x)_(S\d+)_L\d+_R([12])", idgroup=1, pairgroup=2,
+        paired_end=True)) == [("S1", "2")]
+
+
+def test_paired_samples_are_written_mate_by_mate(tmp_path):
+    folder, output = tmp_path / "in", str(tmp_path / "out")
+    folder.mkdir()
+    data = {}
+    for sample in ("S1", "S2"):
+        for lane in ("L001", "L002"):
+            for mate in ("1", "2"):
+                name = "{}_{}_R{}.fastq".format(sample, lane, mate)
+                data[name] = write(str(folder / name), fastq(sample + lane, 5, seed=len(data)))
+    assert concatenate_samples(str(folder), REGEX, output, paired_end=True, compress="none") == set()
+    assert sorted(os.listdir(output)) == ["S1.R1.fastq", "S1.R2.fastq", "S2.R1.fastq", "S2.R2.fastq"]
+    for sample in ("S1", "S2"):
+        for mate in ("1", "2"):
+            lanes = [data["{}_{}_R{}.fastq".format(sample, lane, mate)] for lane in ("L001", "L002")]
+            assert read(os.path.join(output, "{}.R{}.fastq".format(sample, mate))) == b"".join(map(read, lanes))
+
+
+def test_gzip_inputs_pass_through(tmp_path):
+    plain = [fastq("a", 30, 1), fastq("b", 30, 2)]
+    gz = write(str(tmp_path / "a.fastq.gz"), plain[0], gzipped=True)
+    txt = write(str(tmp_path / "b.fastq"), plain[1])
+    out = str(tmp_path / "out.fastq.gz")
+    for prefetch_files in (0, 2):
+        concatenate([gz, txt], out, compress=True, threads=2, prefetch_files=prefetch_files)
+        # the gzip input is copied as it is, and the plain one appended as more gzip members
+        assert read(out).startswith(read(gz))
+        assert gzip.decompress(read(out)) == b"".join(plain)
+        concatenate([gz, txt], out, compress=False, prefetch_files=prefetch_files)
+        assert read(out) == b"".join(plain)
+    concatenate([], out, compress=True)
+    assert gzip.decompress(read(out)) == b""
+
+
+def test_incremental_run_appends_gzip_members(tmp_path):
+    folder, output = tmp_path / "in", str(tmp_path / "out")
+    folder.mkdir()
+    records = [fastq("S1L{}".format(n), 10, n) for n in range(3)]
+    write(str(folder / "S1_L001_R1.fastq.gz"), records[0], gzipped=True)
+    write(str(folder / "S1_L002_R1.fastq"), records[1])
+    assert concatenate_samples(str(folder), REGEX, output, incremental=True) == set()
+    out = os.path.join(output, "S1.R1.fastq.gz")
+    first = read(out)
+    assert gzip.decompress(first) == records[0] + records[1]
+
+    write(str(folder / "S1_L003_R1.fastq.gz"), records[2], gzipped=True)
+    assert concatenate_samples(str(folder), REGEX, output, incremental=True) == set()
+    # what was written before is kept as it is, and the new lane added after it
+    assert read(out) == first + read(str(folder / "S1_L003_R1.fastq.gz"))
+    assert gzip.decompress(read(out)) == b"".join(records)
+
+
+def truncated(r1, r2):
+    return b"\n".join(r1.split(b"\n")[:-3]) + b"\n", r2
+
+
+def short_quality(r1, r2):
+    lines = r1.split(b"\n")
+    lines[4 * 2 + 3] = lines[4 * 2 + 3][:-1]
+    return b"\n".join(lines), r2
+
+
+def bad_header(r1, r2):
+    lines = r1.split(b"\n")
+    lines[4 * 1] = b"X" + lines[4 * 1][1:]
+    return b"\n".join(lines), r2
+
+
+def missing_mate(r1, r2):
+    return r1, b"\n".join(r2.split(b"\n")[4:])
+
+
+CORRUPTIONS = [
+    (truncated, "S2_L001_R1{} ends with a truncated record"),
+    (short_quality, "record 3 sequence and quality lengths differ"),
+    (bad_header, "record 2 header does not start with '@'"),
+    (missing_mate, "mates have different record counts (10 vs 9)"),
+]
+
+
+@pytest.mark.parametrize("gzipped", [False, True], ids=["plain", "gz"])
+@pytest.mark.parametrize("corrupt,error", CORRUPTIONS, ids=[c.__name__ for c, _ in CORRUPTIONS])
+def test_validation_fails_only_the_bad_sample(tmp_path, corrupt, error, gzipped):
+    folder, output = tmp_path / "in", str(tmp_path / "out")
+    folder.mkdir()
+    ext = ".fastq.gz" if gzipped else ".fastq"
+    expected = {}
+    for sample in ("S1", "S2", "S3"):
+        mates = [fastq(sample, 5, seed=1), fastq(sample, 5, seed=2)]
+        lanes = [mates, [fastq(sample + "b", 5, seed=3), fastq(sample + "b", 5, seed=4)]]
+        if sample == "S2":
+            lanes[0] = list(corrupt(*lanes[0]))
+        for n, lane in enumerate(lanes, 1):
+            for mate, data in zip(("1", "2"), lane):
+                write(str(folder / "{}_L00{}_R{}{}".format(sample, n, mate, ext)), data, gzipped)
+                expected.setdefault((sample, mate), []).append(data)
+    failed = concatenate_samples(str(folder), REGEX, output, paired_end=True, compress="none", validate=True,
+        jobs=2, prefetch_files=0)
+    assert failed == {"S2"}
+    assert sorted(os.listdir(output)) == ["S1.R1.fastq", "S1.R2.fastq", "S3.R1.fastq", "S3.R2.fastq",
+        "validation.tsv"]
+    for sample in ("S1", "S3"):
+        for mate in ("1", "2"):
+            assert read(os.path.join(output, "{}.R{}.fastq".format(sample, mate))) == \
+                b"".join(expected[(sample, mate)])
+    with open(os.path.join(output, "validation.tsv")) as f:
+        rows = [line.rstrip("\n").split("\t") for line in f][1:]
+    status = dict((row[1], row[4]) for row in rows)
+    assert status["S2.R1.fastq"] == error.format(ext)
+    assert all(status[name] == "ok" for name in ("S1.R1.fastq", "S1.R2.fastq", "S3.R1.fastq", "S3.R2.fastq"))
+    assert dict((row[1], row[2]) for row in rows)["S1.R1.fastq"] == "10"
@@ -0,0 +1,126 @@
+"""
+Planning strain profiling from a small synthetic MetaPhlAn profile.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.clades import (keep_samples, plan_sam, read_profiles, read_samples, read_table, sample_name,
+                                samples_with, top_clades, write_profile, write_samples)
+
+LINEAGE = "k__Bacteria|p__Proteobacteria|c__Gammaproteobacteria|o__Enterobacterales|f__Enterobacteriaceae"
+SAMPLES = ["S1", "S2", "S3", "S4"]
+# species rows: mean abundance and prevalence rank them differently
+ROWS = [
+    (LINEAGE, [90.0, 90.0, 90.0, 90.0]),
+    (LINEAGE + "|g__Escherichia", [60.0, 0.0, 0.0, 10.0]),
+    (LINEAGE + "|g__Escherichia|s__Escherichia_coli", [60.0, 0.0, 0.0, 10.0]),   # mean 17.5, in 2
+    (LINEAGE + "|g__Klebsiella|s__Klebsiella_pneumoniae", [0.0, 2.0, 1.0, 1.0]),  # mean 1, in 3
+    (LINEAGE + "|g__Shigella|s__Shigella_flexneri", [0.0, 0.0, 8.0, 0.0]),        # mean 2, in 1
+    (LINEAGE + "|g__Shigella|s__Shigella_sonnei", [0.0, 0.0, 0.0, 0.0]),          # in none
+    (LINEAGE + "|g__Escherichia|s__Escherichia_coli|t__GCF_000005845", [60.0, 0.0, 0.0, 10.0]),
+]
+
+
+def names(clades):
+    return [c.name for c in clades]
+
+
+def test_top_clades_by_mean():
+    top = top_clades(SAMPLES, iter(ROWS), 2)
+    assert names(top) == ["s__Escherichia_coli", "s__Shigella_flexneri"]
+    assert top[0].mean == 17.5
+    assert top[0].prevalence == 0.5
+    assert top[0].samples == ["S1", "S4"]
+    assert top[0].lineage == ROWS[2][0]
+    assert top[0].values == ROWS[2][1]
+
+
+def test_top_clades_by_prevalence():
+    top = top_clades(SAMPLES, iter(ROWS), 2, by="prevalence")
+    assert names(top) == ["s__Klebsiella_pneumoniae", "s__Escherichia_coli"]
+    assert top[0].samples == ["S2", "S3", "S4"]
+
+
+def test_top_clades_skips_other_levels_and_absent_clades():
+    top = top_clades(SAMPLES, iter(ROWS), 10)
+    assert names(top) == ["s__Escherichia_coli", "s__Shigella_flexneri", "s__Klebsiella_pneumoniae"]
+    assert names(top_clades(SAMPLES, iter(ROWS), 10, min_abundance=5.0)) == ["s__Escherichia_coli",
+        "s__Shigella_flexneri"]
+    assert top_clades(SAMPLES, iter(ROWS), 0) == []
+    with pytest.raises(ValueError):
+        top_clades(SAMPLES, iter(ROWS), 2, by="median")
+
+
+def test_samples_with():
+    assert samples_with(top_clades(SAMPLES, iter(ROWS), 2)) == {"S1": ["s__Escherichia_coli"],
+        "S3": ["s__Shigella_flexneri"], "S4": ["s__Escherichia_coli"]}
+
+
+def test_keep_samples():
+    top = top_clades(SAMPLES, iter(ROWS), 2)
+    sams = ["/in/{}_bowtie2.sam".format(s) for s in SAMPLES + ["S5"]]
+    assert sample_name(sams[0], "_bowtie2") == "S1"
+    # S2 has neither clade; S5 is newer than the profile, so it's kept
+    assert keep_samples(sams, "_bowtie2", top, SAMPLES) == ["/in/S1_bowtie2.sam", "/in/S3_bowtie2.sam",
+        "/in/S4_bowtie2.sam", "/in/S5_bowtie2.sam"]
+
+
+def test_merged_table_and_profiles_plan_the_same(tmp_path):
+    table = str(tmp_path / "merged.tsv")
+    with open(table, "w") as f:
+        f.write("#mpa_v30_CHOCOPhlAn_201901\n")
+        f.write("ID\t" + "\t".join(s + "_taxonomic_profile" for s in SAMPLES) + "\n")
+        for clade, values in ROWS:
+            f.write("\t".join([clade] + [str(v) for v in values]) + "\n")
+    samples, rows = read_table(table)
+    samples = [sample_name(s, "_taxonomic_profile") for s in samples]
+    from_table = top_clades(samples, rows, 3)
+
+    paths = []
+    for i, sample in enumerate(SAMPLES):
+        paths.append(str(tmp_path / "{}_taxonomic_profile.tsv".format(sample)))
+        with open(paths[-1], "w") as f:
+            f.write("#SampleID\tMetaphlan2_Analysis\n")
+            for clade, values in ROWS:
+                if values[i]:
+                    f.write("{}\t{}\n".format(clade, values[i]))
+    samples, rows = read_profiles(paths, SAMPLES)
+    assert top_clades(samples, rows, 3) == from_table
+
+
+def test_write_profile_keeps_only_the_plan(tmp_path):
+    top = top_clades(SAMPLES, iter(ROWS), 2, by="prevalence")
+    path = str(tmp_path / "plan_profile.tsv")
+    write_profile(path, SAMPLES, top)
+    samples, rows = read_table(path)
+    assert samples == SAMPLES
+    rows = list(rows)
+    assert rows == [(c.lineage, c.values) for c in top]
+    # whatever ranking is applied to it, there is nothing else to choose from
+    assert sorted(names(top_clades(samples, iter(rows), 20))) == sorted(names(top))
+
+
+def test_plan_sam_links_planned_samples_and_empties_the_rest(tmp_path):
+    sams = {}
+    for sample in ("S1", "S2"):
+        sams[sample] = str(tmp_path / "{}_bowtie2.sam".format(sample))
+        with open(sams[sample], "w") as f:
+            f.write("@HD\tVN:1.0\n@SQ\tSN:marker1\tLN:100\nread1\t0\tmarker1\t1\t42\t4M\t*\t0\t0\tACGT\tIIII\n")
+    listed = str(tmp_path / "samples.txt")
+    write_samples(listed, ["S1"])
+    assert read_samples(listed) == {"S1"}
+    planned = tmp_path / "planned"
+    planned.mkdir()
+    for sample, sam in sams.items():
+        target = str(planned / os.path.basename(sam))
+        plan_sam(sam, "_bowtie2", read_samples(listed), target)
+        # running the task again replaces what the last plan made
+        plan_sam(sam, "_bowtie2", read_samples(listed), target)
+    with open(str(planned / "S1_bowtie2.sam")) as f, open(sams["S1"]) as g:
+        assert f.read() == g.read()
+    with open(str(planned / "S2_bowtie2.sam")) as f:
+        assert f.read() == "@HD\tVN:1.0\n@SQ\tSN:marker1\tLN:100\n"
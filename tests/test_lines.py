@@ -0,0 +1,170 @@
+"""
+`bin/crap2.py` has to copy exactly the lines (and records) that reading the
+file line by line would give, with or without its index, and its shards have
+to start on real records.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import lines
+from util_hutlab.lines import (INDEX_SUFFIX, LineIndex, getlines, getrecords, newline_offsets, record_start,
+                               split_records)
+
+# empty lines, lines longer than the scan blocks below, and the same with an unterminated last line
+SHAPES = {
+    "empty": b"",
+    "one": b"only line\n",
+    "mixed": b"".join(b"x" * (i * 7 % 23) + b"\n" for i in range(40)),
+    "unterminated": b"".join(b"line %d\n" % i for i in range(25)) + b"no newline",
+    "blank": b"\n" * 30,
+}
+
+
+def reference(path, n, end=None):
+    """Lines `n` to `end` (exclusive) of the file at `path`, the way reading it line by line gives them."""
+    with open(path, "rb") as f:
+        found = list(iter(f.readline, b""))
+    n = max(n, 1)
+    return found[n - 1:None if end is None else max(end, n) - 1]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def offsets(path, every):
+    """What a `LineIndex` of the file at `path` should hold."""
+    with open(path, "rb") as f:
+        return [0] + list(newline_offsets(f, every))
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture(params=sorted(SHAPES))
+def shaped(request, tmp_path):
+    return write(str(tmp_path / "data.txt"), SHAPES[request.param])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10, 1000])
+@pytest.mark.parametrize("every", [1, 2, 7])
+def test_newline_offsets(shaped, every, chunk_size):
+    data = read(shaped)
+    ends = [i + 1 for i, c in enumerate(bytearray(data)) if c == ord("\n")]
+    with open(shaped, "rb") as f:
+        assert list(newline_offsets(f, every, chunk_size)) == ends[every - 1::every]
+        # counting from the middle of the file
+        middle = len(data) // 2
+        f.seek(middle)
+        assert list(newline_offsets(f, every, chunk_size)) == [e for e in ends if e > middle][every - 1::every]
+
+
+@pytest.mark.parametrize("scan_block", [1, 3, lines.SCAN_BLOCK], ids=["scan1", "scan3", "scan"])
+@pytest.mark.parametrize("index,every", [(False, None), (True, 1), (True, 3), (True, 100000)],
+    ids=["", "index1", "index3", "index"])
+def test_getlines_matches_readline(shaped, tmp_path, monkeypatch, scan_block, index, every):
+    monkeypatch.setattr(lines, "SCAN_BLOCK", scan_block)
+    total = len(reference(shaped, 1))
+    out = str(tmp_path / "out")
+    # past the end too: a file shorter than n gives nothing
+    for n in range(0, total + 3):
+        for end in [None] + sorted(set([0, 1, n, n + 1, n + 4, total, total + 1, total + 2])):
+            want = reference(shaped, n, end)
+            assert getlines(shaped, out, n, index, every or lines.INDEX_EVERY, end) == len(want)
+            assert read(out) == b"".join(want)
+
+
+@pytest.mark.parametrize("index", [False, True])
+def test_getrecords_matches_readline(tmp_path, index):
+    records = [b"@r%d\n%s\n+\n%s\n" % (i, b"ACGT" * i, b"@+IJ" * i) for i in range(1, 12)]
+    path, out = write(str(tmp_path / "reads.fastq"), b"".join(records)[:-1]), str(tmp_path / "out")
+    records[-1] = records[-1][:-1]
+    for n in range(0, len(records) + 3):
+        for end in [None] + list(range(0, len(records) + 3)):
+            want = records[max(n, 1) - 1:None if end is None else max(end, 1) - 1]
+            assert getrecords(path, out, n, index, 5, end) == len(want)
+            assert read(out) == b"".join(want)
+
+
+def test_index_is_rebuilt_when_the_file_changes(tmp_path):
+    path, out = write(str(tmp_path / "data.txt"), SHAPES["mixed"]), str(tmp_path / "out")
+    assert getlines(path, out, 12, True, 4) == 29
+    index = LineIndex.load(path + INDEX_SUFFIX, path, 4)
+    assert index is not None
+    assert list(index.offsets) == offsets(path, 4)
+    # an index made with another stride isn't used for this one
+    assert LineIndex.load(path + INDEX_SUFFIX, path, 3) is None
+
+    # the same size but other lines, and a different mtime: the old offsets would cut lines in half
+    write(path, SHAPES["mixed"][::-1])
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, index.mtime + 10 ** 9))
+    assert LineIndex.load(path + INDEX_SUFFIX, path, 4) is None
+    for n in (1, 5, 12, 30):
+        for end in (None, n + 3):
+            want = reference(path, n, end)
+            assert getlines(path, out, n, True, 4, end) == len(want)
+            assert read(out) == b"".join(want)
+    rebuilt = LineIndex.load(path + INDEX_SUFFIX, path, 4)
+    assert list(rebuilt.offsets) == offsets(path, 4)
+
+    # lines appended: the size changes
+    write(path, SHAPES["mixed"][::-1] + b"\nmore\nlines\n")
+    assert LineIndex.load(path + INDEX_SUFFIX, path, 4) is None
+    assert getlines(path, out, 2, True, 4) == len(reference(path, 2))
+    assert read(out) == b"".join(reference(path, 2))
+
+
+def fastq_records(n, length=8):
+    """`n` records whose quality lines start with '@' or '+', and some of which are all '@' and '+'."""
+    records = []
+    for i in range(n):
+        qual = (b"@+" * length)[i % 2:][:length] if i % 3 else b"+" * length
+        records.append(b"@read%d\n%s\n+\n%s\n" % (i, b"ACGT" * (length // 4), qual))
+    return records
+
+
+def test_record_start_skips_quality_lines(tmp_path):
+    records = fastq_records(30)
+    path = write(str(tmp_path / "reads.fastq"), b"".join(records))
+    starts = [sum(map(len, records[:i])) for i in range(len(records) + 1)]
+    with open(path, "rb") as f:
+        for offset in range(0, starts[-1] + 1):
+            assert record_start(f, offset) == min(s for s in starts if s >= offset)
+
+
+@pytest.mark.parametrize("jobs", [None, 1, 3])
+@pytest.mark.parametrize("shards", [1, 2, 3, 7, 40])
+def test_split_records(tmp_path, shards, jobs):
+    records = fastq_records(31, 12)
+    data = b"".join(records)
+    path = write(str(tmp_path / "reads.fastq"), data)
+    outputs = [str(tmp_path / "shard{}.fastq".format(i)) for i in range(shards)]
+    counts = split_records(path, outputs, jobs)
+    parts = [read(o) for o in outputs]
+    assert b"".join(parts) == data
+    assert sum(counts) == len(records)
+    starts = set(sum(map(len, records[:i])) for i in range(len(records) + 1))
+    offset = 0
+    for part, count in zip(parts, counts):
+        # every shard starts on a record (or is empty) and holds whole records
+        assert offset in starts
+        assert part.count(b"\n") == 4 * count
+        offset += len(part)
+
+
+def test_split_records_removes_every_shard_when_one_fails(tmp_path):
+    path = write(str(tmp_path / "reads.fastq"), b"".join(fastq_records(20)))
+    outputs = [str(tmp_path / "shard{}.fastq".format(i)) for i in range(4)]
+    outputs[2] = str(tmp_path / "missing" / "shard2.fastq")
+    with pytest.raises(OSError):
+        split_records(path, outputs, 2)
+    assert not any(os.path.exists(o) for o in outputs)
@@ -0,0 +1,122 @@
+"""
+Every way `bin/selectcols.py` can run (serial, --numpy, --jobs, --index and
+their combinations) has to write the same bytes for the same table.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import selectcols
+from util_hutlab.selectcols import (load_index, load_numpy, select_columns_indexed, select_columns_mmap,
+                                    select_columns_parallel, select_table)
+
+TESTFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testfiles")
+
+# numbers, all-zero rows (in several spellings), exponents, a row with an
+# extra field and an unterminated last line. NA is only in s2: telling whether
+# a row is all zeros fails on it, so selecting s2 without -z is an error
+ROWS = [
+    ["id", "s1", "s2", "s3", "s4"],
+    ["r1", "1", "0", "2.5", "0"],
+    ["r2", "0", "0", "0", "0"],
+    ["r3", "0.0", "-0", "0e0", "0.000"],
+    ["r4", "0", "NA", "0", "1"],
+    ["r5", "1e-5", "0", "0", "0"],
+    ["r6", "0", "0", "0", "7", "extra"],
+    ["r7", "0e3", "2E2", "0", "0"],
+    ["r8", "4", "5", "6", "7"],
+    ["r9", "0", "0", "0", "0"],
+]
+
+# chunk sizes small enough that every path cuts these tables into several pieces
+CHUNK = 24
+
+
+def write_table(path, newline, rows=ROWS):
+    with open(path, "wb") as f:
+        f.write(newline.join("\t".join(r) for r in rows).encode())
+
+
+@pytest.fixture(params=["testfile", "lf", "crlf"])
+def table(request, tmp_path):
+    if request.param == "testfile":
+        path = str(tmp_path / "table_with_columns.txt")
+        with open(os.path.join(TESTFILES, "table_with_columns.txt"), "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        return path, ["col1", "col3"], ["col1", "col2", "col3"]
+    path = str(tmp_path / "table.tsv")
+    write_table(path, "\n" if request.param == "lf" else "\r\n")
+    return path, ["s1", "s3"], ["s1", "s2", "s3", "s4"]
+
+
+def serial(path, out, columns, keep_first, keep_zeros):
+    select_table(path, out, columns, "\t", keep_first, keep_zeros)
+
+
+def numpy(path, out, columns, keep_first, keep_zeros):
+    with open(out, "wb") as f:
+        select_columns_mmap(path, f, columns, "\t", keep_first, keep_zeros, chunk_size=CHUNK)
+
+
+def jobs(path, out, columns, keep_first, keep_zeros, use_numpy=False, index=None):
+    with open(out, "wb") as f:
+        select_columns_parallel(path, f, columns, "\t", keep_first, keep_zeros, 2, use_numpy, CHUNK, index)
+
+
+def jobs_numpy(path, out, columns, keep_first, keep_zeros):
+    jobs(path, out, columns, keep_first, keep_zeros, use_numpy=True)
+
+
+def indexed(path, out, columns, keep_first, keep_zeros, use_numpy=False):
+    with open(out, "wb") as f:
+        select_columns_indexed(path, f, columns, "\t", keep_first, keep_zeros, load_index(path, "\t"), use_numpy,
+            CHUNK)
+
+
+def indexed_numpy(path, out, columns, keep_first, keep_zeros):
+    indexed(path, out, columns, keep_first, keep_zeros, use_numpy=True)
+
+
+def indexed_jobs(path, out, columns, keep_first, keep_zeros):
+    jobs(path, out, columns, keep_first, keep_zeros, index=load_index(path, "\t"))
+
+
+def table_path(path, out, columns, keep_first, keep_zeros):
+    # the way the script picks a path, with every option on
+    select_table(path, out, columns, "\t", keep_first, keep_zeros, use_numpy=True, jobs=2, use_index=True)
+
+
+PATHS = [numpy, jobs, jobs_numpy, indexed, indexed_numpy, indexed_jobs, table_path]
+
+
+@pytest.mark.parametrize("path", PATHS, ids=[p.__name__ for p in PATHS])
+@pytest.mark.parametrize("keep_zeros", [False, True], ids=["", "z"])
+@pytest.mark.parametrize("keep_first", [False, True], ids=["", "k"])
+@pytest.mark.parametrize("selection", ["some", "all"])
+def test_paths_match_serial(table, path, keep_first, keep_zeros, selection, tmp_path):
+    if path in (numpy, jobs_numpy, indexed_numpy, table_path) and load_numpy() is None:
+        pytest.skip("numpy is not installed")
+    table_file, some, every = table
+    columns = some if selection == "some" else every
+    expected, got = str(tmp_path / "serial.out"), str(tmp_path / "path.out")
+    try:
+        serial(table_file, expected, columns, keep_first, keep_zeros)
+    except ValueError:
+        with pytest.raises(ValueError):
+            path(table_file, got, columns, keep_first, keep_zeros)
+        return
+    path(table_file, got, columns, keep_first, keep_zeros)
+    with open(expected, "rb") as e, open(got, "rb") as g:
+        assert g.read() == e.read()
+
+
+def test_numpy_handles_dense_chunks():
+    # the comparison above only means something if numpy does take some chunks
+    if load_numpy() is None:
+        pytest.skip("numpy is not installed")
+    chunk = b"r1\t1\t0\t2.5\nr2\t0\t0\t0\nr3\t4\t1e-5\t0\n"
+    assert selectcols._numpy_chunk(chunk, [0, 1, 2, 3], 4, "\t", True, False) == (b"r1\t1\t0\t2.5\nr3\t4\t1e-5\t0\n", 2)
+    assert selectcols._numpy_chunk(chunk.replace(b"\n", b"\r\n"), [0, 1, 2, 3], 4, "\t", True, True) is None
@@ -0,0 +1,51 @@
+"""
+Utilities for work in the Huttenhower Lab, importable without the scripts.
+
+The functions behind `bin/catfiles.py`, `bin/selectcols.py` and `bin/crap2.py`
+can be called in-process, eg to run many selections without starting a new
+interpreter for each:
+
+```python
+import util_hutlab
+
+for table in tables:
+    util_hutlab.select_table(table, table + ".selected", columns, sep="\\t")
+```
+
+Submodules are only imported when one of their functions is first used, so
+`import util_hutlab` itself is close to free.
+"""
+
+import importlib
+
+# public name -> submodule it lives in
+_EXPORTS = {
+    "concatenate": "catfiles",
+    "concatenate_samples": "catfiles",
+    "select_columns": "selectcols",
+    "select_table": "selectcols",
+    "select_tables": "selectcols",
+    "ColumnPatterns": "selectcols",
+    "Filters": "selectcols",
+    "getlines": "lines",
+    "getrecords": "lines",
+    "split_records": "lines",
+    "SizingModel": "sizing",
+    "LocalGrid": "batching",
+    "FileListing": "discovery",
+    "top_clades": "clades",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    globals()[name] = value  # later lookups don't come back here
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
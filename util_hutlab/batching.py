@@ -0,0 +1,232 @@
+"""
+Bundling many small gridable tasks into fewer, larger grid jobs.
+
+Queue time and scheduler overhead can dwarf tasks that take a few minutes.
+`pack` bin-packs independent tasks into bundles of about a target number of
+minutes on a given number of cores, and `submit` adds one gridable task per
+bundle to a workflow. Each bundle's tasks are written to a JSON manifest
+that `bin/runbundle.py` runs on the allocated node: as many at once as the
+cores allow, skipping tasks whose targets are already up to date, and
+recording how each one went in `<manifest>.status`. The bundle fails if any
+of its tasks did, and rerunning it only redoes those.
+
+`LocalGrid` takes the place of an anadama2 Workflow and runs what is
+submitted to it on this machine, for trying out a workflow without a grid.
+"""
+
+from collections import namedtuple
+import heapq
+import json
+import logging
+import math
+import os
+import shlex
+import subprocess
+import time
+
+from .storage import atomic_write
+
+logger = logging.getLogger("Batching")
+
+# A shell command for the grid, with its files and resources (minutes, MB)
+Task = namedtuple("Task", ["name", "command", "depends", "targets", "time", "mem", "cores"])
+Task.__new__.__defaults__ = ((), (), 30, 1000, 1)
+
+Bundle = namedtuple("Bundle", ["name", "tasks", "time", "mem", "cores"])
+
+STATUS_SUFFIX = ".status"
+# minutes added to each bundle's time request, for starting and checking its tasks
+BUNDLE_PAD = 2
+
+
+def _check_independent(tasks):
+    targets = set(t for task in tasks for t in task.targets)
+    for task in tasks:
+        clash = targets.intersection(task.depends)
+        if clash:
+            raise ValueError("task {} depends on {}, made by another task; only independent tasks "
+                "can be bundled".format(task.name, sorted(clash)[0]))
+
+
+def _bundle_resources(tasks, cores):
+    # list scheduling finishes within (total work) / cores + (longest task)
+    work = sum(t.time * min(t.cores, cores) for t in tasks)
+    minutes = int(math.ceil(float(work) / cores + max(t.time for t in tasks))) + BUNDLE_PAD
+    # tasks running at the same time: as many of the largest as fit on the cores
+    at_once = max(cores // min(t.cores for t in tasks), 1)
+    mem = sum(sorted((t.mem for t in tasks), reverse=True)[:at_once])
+    return min(minutes, sum(t.time for t in tasks) + BUNDLE_PAD), mem
+
+
+def pack(tasks, minutes, cores=1, prefix="bundle"):
+    """Bin-pack independent `tasks` into bundles of about `minutes` each on `cores` cores.
+
+    Tasks are placed largest first (by core-minutes) into the least loaded
+    bundle with room, opening a new one when none has, so the bundles come
+    out close to even. A task longer than `minutes` gets a bundle to itself.
+    """
+    tasks = list(tasks)
+    _check_independent(tasks)
+    capacity = minutes * cores
+    bins = []  # (load, number, tasks), least loaded first
+    for task in sorted(tasks, key=lambda t: (t.time * min(t.cores, cores), t.name), reverse=True):
+        work = task.time * min(task.cores, cores)
+        if bins and bins[0][0] + work <= capacity:
+            load, n, members = heapq.heappop(bins)
+        else:
+            load, n, members = 0, len(bins), []
+        members.append(task)
+        heapq.heappush(bins, (load + work, n, members))
+    bundles = []
+    width = len(str(len(bins)))
+    for _, n, members in sorted(bins, key=lambda b: b[1]):
+        ncores = min(cores, sum(t.cores for t in members))
+        time_, mem = _bundle_resources(members, ncores)
+        bundles.append(Bundle("{}_{:0{}d}".format(prefix, n, width), members, time_, mem, ncores))
+    return bundles
+
+
+def write_manifest(bundle, path):
+    with atomic_write(path) as f:
+        json.dump({"name": bundle.name, "tasks": [t._asdict() for t in bundle.tasks]}, f, indent=1)
+
+
+def read_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    return [Task(**t) for t in manifest["tasks"]]
+
+
+def submit(workflow, tasks, folder=None, minutes=None, cores=1, runner="python {} {} --cores {}",
+        prefix="bundle"):
+    """Add `tasks` to `workflow` as gridable tasks, bundled when `minutes` is given.
+
+    Without `minutes` each task is added on its own. Otherwise bundle
+    manifests are written to `folder` and each bundle is added as one task
+    running `runner`, formatted with the runbundle.py path and the manifest
+    path (both quoted for the shell) and the cores.
+    """
+    tasks = list(tasks)
+    if not minutes:
+        for t in tasks:
+            workflow.add_task_gridable(t.command, depends=list(t.depends), targets=list(t.targets), name=t.name,
+                time=t.time, mem=t.mem, cores=t.cores)
+        return []
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "runbundle.py")
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    bundles = pack(tasks, minutes, cores, prefix)
+    for b in bundles:
+        manifest = os.path.abspath(os.path.join(folder, b.name + ".json"))
+        write_manifest(b, manifest)
+        workflow.add_task_gridable(runner.format(shlex.quote(script), shlex.quote(manifest), b.cores),
+            depends=sorted(set(d for t in b.tasks for d in t.depends)),
+            targets=[t for task in b.tasks for t in task.targets], name=b.name,
+            time=b.time, mem=b.mem, cores=b.cores)
+    logger.info("bundled {} tasks into {} jobs".format(len(tasks), len(bundles)))
+    return bundles
+
+
+def up_to_date(task):
+    """Whether all of `task`'s targets exist and are newer than its dependencies."""
+    try:
+        oldest = min(os.stat(t).st_mtime for t in task.targets) if task.targets else None
+        newest = max(os.stat(d).st_mtime for d in task.depends) if task.depends else 0
+    except OSError:
+        return False
+    return oldest is not None and oldest >= newest
+
+
+def run_tasks(tasks, cores=1, status=None, skip_done=True, remove_failed=True):
+    """Run `tasks` here, as many at once as fit on `cores`, and return the names of those that failed.
+
+    Larger tasks start first; one that needs more than `cores` runs alone.
+    The targets of a failed task are removed, unless `remove_failed` is
+    false. With `status`, a line of JSON
+    per task (name, return code, seconds or "skipped") is appended to it.
+    """
+    def note(entry):
+        if status:
+            with open(status, "a") as f:
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    pending = []
+    for t in tasks:
+        if skip_done and up_to_date(t):
+            note({"name": t.name, "returncode": 0, "skipped": True})
+        else:
+            pending.append(t)
+    pending.sort(key=lambda t: (t.cores, t.time or 0), reverse=True)
+    running = {}  # pid -> (task, process, start)
+    free = cores
+    failed = []
+    while pending or running:
+        for t in list(pending):
+            need = min(t.cores, cores)
+            if need <= free:
+                pending.remove(t)
+                free -= need
+                logger.info("starting {}".format(t.name))
+                proc = subprocess.Popen(t.command, shell=True)
+                running[proc.pid] = (t, proc, time.perf_counter())
+        pid, code = os.wait()
+        if pid not in running:
+            continue
+        t, proc, start = running.pop(pid)
+        proc.returncode = returncode = os.waitstatus_to_exitcode(code)
+        free += min(t.cores, cores)
+        note({"name": t.name, "returncode": returncode, "seconds": round(time.perf_counter() - start, 3)})
+        if returncode:
+            logger.error("{} failed with exit status {}".format(t.name, returncode))
+            failed.append(t.name)
+            for target in t.targets if remove_failed else ():
+                if os.path.isfile(target):
+                    os.remove(target)
+    return failed
+
+
+class LocalGrid(object):
+    """Stands in for an anadama2 Workflow: records gridable tasks, and `go` runs them on this machine.
+
+    Tasks run in the order they were added, a wave at a time: each wave is
+    every remaining task whose dependencies aren't made by a later one. Tasks
+    depending on a failed one count as failed without running. `submitted`
+    keeps what was added, for checking what a workflow would send to the
+    grid. `latency` seconds are spent before each task starts, as a grid
+    job would spend in the queue.
+    """
+
+    def __init__(self, cores=1, latency=0):
+        self.cores = cores
+        self.latency = latency
+        self.submitted = []
+
+    def add_task_gridable(self, actions, depends=None, targets=None, name=None, time=None, mem=None, cores=1,
+            **kwargs):
+        name = name or "task{}".format(len(self.submitted))
+        task = Task(name, actions, tuple(depends or ()), tuple(targets or ()), time, mem, cores)
+        self.submitted.append(task)
+        return task
+
+    add_task = add_task_gridable
+
+    def go(self):
+        """Run everything submitted, and return the names of the tasks that failed."""
+        remaining = list(self.submitted)
+        failed = []
+        lost = set()  # targets of failed tasks
+        while remaining:
+            made_later = set(t for task in remaining for t in task.targets)
+            wave = [t for t in remaining if not made_later.intersection(t.depends)]
+            if not wave:
+                raise ValueError("tasks depend on each other in a cycle")
+            blocked = [t for t in wave if lost.intersection(t.depends)]
+            jobs = [t for t in wave if t not in blocked]
+            if self.latency:
+                jobs = [t._replace(command="sleep {}; {}".format(self.latency, t.command)) for t in jobs]
+            # like a grid, leave it to the task (eg runbundle.py) to clean up after itself
+            failed.extend(run_tasks(jobs, self.cores, skip_done=False, remove_failed=False))
+            failed.extend(t.name for t in blocked)
+            lost.update(target for t in wave if t.name in failed for target in t.targets)
+            remaining = [t for t in remaining if t not in wave]
+        return failed
@@ -0,0 +1,718 @@
+"""
+FASTQ concatenation behind `bin/catfiles.py`.
+
+`concatenate` joins a list of files into one output (zero-copy when it can,
+gzipping or appending gzip members as needed). `concatenate_samples` does the
+whole job of the script: find the files in a folder, group them by sample
+and write one output per sample (and mate).
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import errno
+import gzip
+import hashlib
+from itertools import repeat
+import json
+import logging
+import os
+import re
+import stat
+import time
+import zlib
+
+from . import metrics
+from .storage import atomic_write, partpath
+
+logger = logging.getLogger("Concatenate")
+
+# Bytes moved per read/write (or per zero-copy syscall) when concatenating.
+# Memory use is bounded by this no matter how large the input files are.
+CHUNK_SIZE = 1024 * 1024
+ZEROCOPY_CHUNK = 1024 * 1024 * 1024
+
+# Plain input headed for gzip output is cut into blocks of this size, and
+# each block is compressed on its own thread into a separate gzip member.
+GZIP_BLOCK = 1024 * 1024
+GZIP_LEVEL = 6
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Upcoming input files opened and read ahead on threads while the current one
+# is copied, and the bytes read ahead from each. Counting the current one, at
+# most PREFETCH + 1 inputs are open and (PREFETCH + 1) * PREFETCH_BYTES
+# buffered per output
+PREFETCH = 4
+PREFETCH_BYTES = 4 * 1024 * 1024
+
+# Written to the output folder in --incremental mode
+MANIFEST = ".catfiles_manifest.json"
+# Bytes read from each end of a file for its --hash fingerprint
+HASH_SAMPLE = 64 * 1024
+
+# errors indicating the kernel can't do an in-kernel copy between these files
+_NO_ZEROCOPY = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                errno.EOPNOTSUPP, errno.EBADF}
+
+
+def _zerocopy(infd, outfd):
+    """Copy `infd` from its current offset to `outfd` inside the kernel.
+
+    Uses `copy_file_range` where available, falling back to `sendfile`.
+    Returns the number of bytes copied, or `None` if neither call is
+    supported for this pair of files (and nothing was copied).
+    """
+    copied = 0
+    for call in ("copy_file_range", "sendfile"):
+        func = getattr(os, call, None)
+        if func is None:
+            continue
+        try:
+            while True:
+                if call == "copy_file_range":
+                    n = func(infd, outfd, ZEROCOPY_CHUNK)
+                else:
+                    n = func(outfd, infd, None, ZEROCOPY_CHUNK)
+                if n == 0:
+                    return copied
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in _NO_ZEROCOPY:
+                raise
+    return None
+
+
+def copyfile(infile, outfile, chunk_size=CHUNK_SIZE, zerocopy=True, callback=None):
+    """Append the remaining contents of `infile` to `outfile`.
+
+    Both arguments are open binary file objects. If both are regular files
+    and `zerocopy` is set, data never enters userspace; otherwise it is
+    streamed through one reusable buffer of `chunk_size` bytes, and each
+    chunk is also passed to `callback`, if given.
+    Returns the number of bytes written.
+    """
+    if zerocopy and callback is None:
+        try:
+            infd = infile.fileno()
+            outfd = outfile.fileno()
+        except (AttributeError, OSError, ValueError):
+            infd = outfd = None
+        if infd is not None and \
+                stat.S_ISREG(os.fstat(infd).st_mode) and \
+                stat.S_ISREG(os.fstat(outfd).st_mode):
+            outfile.flush()
+            # buffered readers may have read ahead of the logical position
+            raw = os.lseek(infd, 0, os.SEEK_CUR)
+            os.lseek(infd, infile.tell(), os.SEEK_SET)
+            copied = _zerocopy(infd, outfd)
+            if copied is not None:
+                infile.seek(0, os.SEEK_END)
+                return copied
+            # nothing was copied; put the descriptor back where the reader expects it
+            os.lseek(infd, raw, os.SEEK_SET)
+
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    copied = 0
+    while True:
+        n = infile.readinto(buf)
+        if not n:
+            break
+        outfile.write(view[:n])
+        if callback is not None:
+            callback(view[:n])
+        copied += n
+    return copied
+
+
+def is_gzip(path):
+    """Check the magic bytes of `path` for gzip compression."""
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+class Prefetched(object):
+    """An input file opened, and up to `size` bytes of it read, ahead of its turn.
+
+    Acts as the open binary file for the copy functions: reads return the
+    bytes read ahead first, then carry on from the file. `whole` is set
+    when the file was shorter than `size`, so `head` holds all of it.
+    """
+
+    def __init__(self, path, size=PREFETCH_BYTES):
+        self.name = path
+        self.file = open(path, "rb")
+        try:
+            self.head = self.file.read(size)
+        except BaseException:
+            self.file.close()
+            raise
+        self.whole = len(self.head) < size
+        self._pos = 0  # bytes of head consumed
+
+    def read(self, size=-1):
+        if self._pos >= len(self.head):
+            return self.file.read(size)
+        if size is None or size < 0:
+            data = self.head[self._pos:] + self.file.read()
+            self._pos = len(self.head)
+            return data
+        data = self.head[self._pos:self._pos + size]
+        self._pos += len(data)
+        if len(data) < size:
+            data += self.file.read(size - len(data))
+        return data
+
+    def readinto(self, b):
+        if self._pos >= len(self.head):
+            return self.file.readinto(b)
+        n = min(len(b), len(self.head) - self._pos)
+        b[:n] = self.head[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def tell(self):
+        return self.file.tell() - (len(self.head) - self._pos)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._pos = len(self.head)
+        return self.file.seek(offset, whence)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def prefetch(paths, depth=PREFETCH, size=PREFETCH_BYTES):
+    """Yield a `Prefetched` for each of `paths`, in order, with up to `depth` more opened and read ahead.
+
+    Opening a file and waiting for its first read is mostly latency (on a
+    network filesystem, a round trip or two to the server each), so the
+    next `depth` files are opened and read while the caller copies the
+    current one, so at most `depth + 1` are open at once. Errors are raised
+    when the file's turn comes. The caller closes each file it is given,
+    and should close the generator if it stops early, so the files read
+    ahead but not reached are closed too.
+    """
+    if depth <= 0:
+        for path in paths:
+            yield Prefetched(path, size)
+        return
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=depth)
+    try:
+        for path in paths:
+            pending.append(pool.submit(Prefetched, path, size))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+
+
+def compress_stream(infile, outfile, level=GZIP_LEVEL, threads=1, block_size=GZIP_BLOCK, callback=None):
+    """Gzip the remaining contents of `infile` onto `outfile` using `threads` cores.
+
+    Blocks are compressed independently and written in order as separate
+    gzip members, which any gzip reader decompresses as one stream. At most
+    `2 * threads` blocks are in flight, so memory use stays bounded.
+    Uncompressed blocks are passed to `callback`, if given.
+    Returns the number of compressed bytes written.
+    """
+    written = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        while True:
+            block = infile.read(block_size)
+            if block:
+                # zlib releases the GIL while compressing
+                pending.append(pool.submit(zlib.compress, block, level, 16 + zlib.MAX_WBITS))
+                if callback is not None:
+                    callback(block)
+            while pending and (not block or len(pending) > 2 * threads):
+                data = pending.popleft().result()
+                outfile.write(data)
+                written += len(data)
+            if not block:
+                return written
+
+
+def decompress_stream(infile, outfile, chunk_size=CHUNK_SIZE, callback=None):
+    """Write the decompressed contents of gzipped `infile` (all members) to `outfile`.
+
+    Decompressed chunks are passed to `callback`, if given.
+    Returns the number of decompressed bytes written.
+    """
+    with gzip.GzipFile(fileobj=infile, mode="rb") as gz:
+        return copyfile(gz, outfile, chunk_size, zerocopy=False, callback=callback)
+
+
+class Gunzip(object):
+    """Callback wrapper that decompresses gzip chunks before passing them on.
+
+    Used to inspect gzipped data that is otherwise copied verbatim.
+    Handles any number of concatenated members.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def __call__(self, chunk):
+        data = bytes(chunk)
+        while data:
+            self.callback(self._decomp.decompress(data))
+            if not self._decomp.eof:
+                break
+            data = self._decomp.unused_data
+            self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class FastqStats(object):
+    """Validate FASTQ data fed in chunks of any size, as it is copied.
+
+    Lines are split a chunk at a time and checked in strides of four:
+    headers must start with `@`, separators with `+`, and sequence and
+    quality lines must have the same length. Read names (first word of the
+    header, minus any `/1` or `/2` suffix) are hashed in order so the
+    name digests of two mates can be compared without keeping the names.
+    Only the first problem found is kept in `error`.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.bases = 0
+        self.error = None
+        self._names = hashlib.blake2b(digest_size=16)
+        self._tail = b""
+
+    @property
+    def names_digest(self):
+        return self._names.hexdigest()
+
+    def _fail(self, msg):
+        if self.error is None:
+            self.error = msg
+
+    def _check(self, lines):
+        headers = lines[0::4]
+        seqs = lines[1::4]
+        seps = lines[2::4]
+        quals = lines[3::4]
+
+        if not all(map(bytes.startswith, headers, repeat(b"@"))):
+            n = next(j for j, h in enumerate(headers) if not h.startswith(b"@"))
+            self._fail("record {} header does not start with '@'".format(self.records + n + 1))
+        if not all(map(bytes.startswith, seps, repeat(b"+"))):
+            n = next(j for j, x in enumerate(seps) if not x.startswith(b"+"))
+            self._fail("record {} separator does not start with '+'".format(self.records + n + 1))
+        seqlens = list(map(len, seqs))
+        if seqlens != list(map(len, quals)):
+            n = next(j for j, (a, b) in enumerate(zip(seqs, quals)) if len(a) != len(b))
+            self._fail("record {} sequence and quality lengths differ".format(self.records + n + 1))
+
+        if headers:
+            names = b"\n".join([h.partition(b" ")[0] for h in headers]) + b"\n"
+            self._names.update(names.replace(b"/1\n", b"\n").replace(b"/2\n", b"\n"))
+
+        self.records += len(headers)
+        self.bases += sum(seqlens)
+
+    def update(self, chunk):
+        """Check all complete records in `chunk` and hold back the rest."""
+        lines = (self._tail + chunk).split(b"\n")
+        # the last element is a partial line (or empty)
+        n = (len(lines) - 1) // 4 * 4
+        self._tail = b"\n".join(lines[n:])
+        self._check(lines[:n])
+
+    def end_file(self, path):
+        """Check nothing is left over at the end of the input file `path`."""
+        if self._tail:
+            lines = self._tail.split(b"\n")
+            if len(lines) == 4:
+                self._check(lines)
+                self._fail("{} does not end with a newline".format(os.path.basename(path)))
+            else:
+                self._fail("{} ends with a truncated record".format(os.path.basename(path)))
+        self._tail = b""
+
+
+def find_files(directory, exclude=()):
+    """Yield paths of fastq files (names containing `.fastq`) under `directory`.
+
+    Walks the tree with `os.scandir`, reusing the type information from
+    each directory listing instead of stat-ing every path. Hidden
+    directories and any directory in `exclude` (eg the output folder) are
+    pruned without being listed.
+    """
+    exclude = {os.path.realpath(d) for d in exclude if d}
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    if os.path.realpath(entry.path) not in exclude:
+                        stack.append(entry.path)
+                elif ".fastq" in entry.name:
+                    yield entry.path
+
+
+def group_files(files, regex, idgroup=0, pairgroup=1, paired_end=False):
+    """Group `files` matching `regex` in a single pass.
+
+    Returns a dict mapping `(sample id, mate)` to a sorted list of paths.
+    `mate` is the text matched by `pairgroup` for paired-end reads, and
+    `None` otherwise.
+    """
+    pattern = re.compile(regex)
+    groups = {}
+    for f in files:
+        m = pattern.search(f)
+        if m is None:
+            continue
+        g = m.groups()
+        key = (g[idgroup], g[pairgroup] if paired_end else None)
+        groups.setdefault(key, []).append(f)
+    for paths in groups.values():
+        paths.sort()
+    return groups
+
+
+def concatenate(infiles, outpath, chunk_size=CHUNK_SIZE, zerocopy=True,
+                compress=False, level=GZIP_LEVEL, threads=1, append=False, validator=None,
+                prefetch_files=PREFETCH):
+    """Write the files in `infiles`, in order, to `outpath`.
+
+    If `compress` is set the output is gzipped, otherwise it is plain.
+    Inputs already in the output format are appended byte for byte (gzip
+    members can simply be concatenated); the rest are compressed on
+    `threads` cores or decompressed on the fly.
+
+    Output goes to a hidden temporary file that is renamed over `outpath`
+    only once every input has been copied, so a failure never leaves a
+    truncated file behind under the final name. With `append`, the
+    existing `outpath` is moved to the temporary name and extended.
+
+    If a `validator` (eg `FastqStats`) is given, the uncompressed data is
+    fed to it during the copy; this disables the zero-copy path.
+
+    The next `prefetch_files` inputs are opened and read ahead (see
+    `prefetch`) while each one is copied, and inputs small enough to be
+    read ahead whole are written straight from that buffer, so many small
+    lane files don't each wait on an open and a first read in turn.
+    Returns the number of bytes written.
+    """
+    tmppath = partpath(outpath)
+    total = 0
+    m = metrics.active()
+    start = time.perf_counter()
+    try:
+        if append:
+            os.replace(outpath, tmppath)
+        # the generator is closed on the way out even if a copy fails, which closes the files read ahead
+        with open(tmppath, "ab" if append else "wb") as out, closing(prefetch(infiles, prefetch_files)) as files:
+            for infile in files:
+                with infile:
+                    gzipped = infile.head[:2] == GZIP_MAGIC
+                    callback = validator.update if validator is not None else None
+                    if gzipped == compress:
+                        if gzipped and callback is not None:
+                            callback = Gunzip(callback)
+                        if infile.whole:
+                            out.write(infile.head)
+                            if callback is not None:
+                                callback(infile.head)
+                            total += len(infile.head)
+                        else:
+                            total += copyfile(infile, out, chunk_size, zerocopy, callback)
+                    elif gzipped:
+                        total += decompress_stream(infile, out, chunk_size, callback)
+                    else:
+                        total += compress_stream(infile, out, level, threads, callback=callback)
+                if validator is not None:
+                    validator.end_file(infile.name)
+            if compress and not out.tell():
+                # an empty file isn't valid gzip, so write one empty member
+                empty = zlib.compress(b"", level, 16 + zlib.MAX_WBITS)
+                out.write(empty)
+                total += len(empty)
+        os.replace(tmppath, outpath)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+    finally:
+        m.add("copy", seconds=time.perf_counter() - start, bytes=total, files=len(infiles))
+    return total
+
+
+def fingerprint(path, content_hash=False):
+    """Describe `path` well enough to tell whether it has changed.
+
+    Records size and mtime, plus with `content_hash` a blake2b digest of
+    the first and last `HASH_SAMPLE` bytes, which catches rewrites that
+    preserve both without reading whole multi-GB files.
+    """
+    st = os.stat(path)
+    fp = {"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+    if content_hash:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            h.update(f.read(HASH_SAMPLE))
+            if st.st_size > HASH_SAMPLE:
+                f.seek(max(HASH_SAMPLE, st.st_size - HASH_SAMPLE))
+                h.update(f.read(HASH_SAMPLE))
+        fp["hash"] = h.hexdigest()
+    return fp
+
+
+def same_file(old, new):
+    """Compare two fingerprints, using hashes only if both have one."""
+    if any(old[k] != new[k] for k in ("path", "size", "mtime")):
+        return False
+    return "hash" not in old or "hash" not in new or old["hash"] == new["hash"]
+
+
+def load_manifest(folder):
+    """Read the --incremental manifest in `folder`, if there is one."""
+    path = os.path.join(folder, MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(folder, manifest):
+    """Atomically replace the --incremental manifest in `folder`."""
+    with atomic_write(os.path.join(folder, MANIFEST)) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def plan_output(entry, inputs, outpath, compress):
+    """Work out what an incremental run has to do for one output.
+
+    `entry` is the manifest record of the previous run (or None) and
+    `inputs` the fingerprints of the current, sorted inputs. Returns
+    "skip" if nothing changed, "append" if the only change is new inputs
+    after those already written, and "write" otherwise.
+    """
+    if entry is None or not os.path.isfile(outpath):
+        return "write"
+    if entry["compress"] != compress or os.path.getsize(outpath) != entry["size"]:
+        return "write"
+    old = entry["inputs"]
+    if len(old) > len(inputs) or not all(same_file(a, b) for a, b in zip(old, inputs)):
+        return "write"
+    return "skip" if len(old) == len(inputs) else "append"
+
+
+def concatenate_samples(directory, regex, output, paired_end=False, idgroup=0, pairgroup=1, dryrun=False,
+                        chunk_size=CHUNK_SIZE, zerocopy=True, compress="auto", level=GZIP_LEVEL, compress_threads=1,
+                        incremental=False, content_hash=False, validate=False, stats=None, jobs=1,
+                        prefetch_files=PREFETCH):
+    """Concatenate the FASTQ files under `directory` into one file per sample in `output`.
+
+    Files are grouped by `regex` (see `group_files`), and `compress` is
+    "auto", "gzip" or "none". The other options are those of
+    `bin/catfiles.py`. Outputs of samples that fail are removed.
+    Returns the set of samples that failed.
+    """
+    logger.info("Looking for matching files")
+
+    m = metrics.active()
+    with m.phase("discover"):
+        found = list(find_files(directory, exclude=[output]))
+    m.add("discover", files=len(found))
+    with m.phase("group"):
+        groups = group_files(found, regex, idgroup, pairgroup, paired_end)
+    if not groups:
+        logger.warning("no matching files found")
+
+    ids = sorted(set(i for i, _ in groups))
+    m.add("group", samples=len(ids))
+    logger.info("List of sample IDs:\n{}".format(ids))
+
+    if not os.path.isdir(output) and not dryrun:
+        os.mkdir(output)
+
+    # (sample, output path, input files, gzip output) for every file to be written
+    tasks = []
+    # samples whose inputs couldn't be read while planning; they fail without stopping the others
+    failed = set()
+    checker = ThreadPoolExecutor(max_workers=max(1, prefetch_files)) if compress == "auto" else None
+    for i in ids:
+        logger.info("Combining files for {}".format(i))
+        if paired_end:
+            f1 = groups.get((i, "1"), [])
+            f2 = groups.get((i, "2"), [])
+        else:
+            f1 = groups[(i, None)]
+            f2 = []
+
+        if not f1:
+            if paired_end:
+                logger.warning("no matches found for first read pair")
+            else:
+                logger.warning("no matches found")
+
+        if paired_end and not f2:
+            logger.warning("no matches found for second read pair")
+
+        for f in f1:
+            if paired_end:
+                logger.info("1st pair - using file {}".format(os.path.basename(f)))
+            else:
+                logger.info("Using file {}".format(os.path.basename(f)))
+
+        for f in f2:
+            logger.info("2nd pair - using file {}".format(os.path.basename(f)))
+
+        if compress == "auto":
+            # the first file usually settles it; otherwise check the rest at once rather than one by one
+            files = f1 + f2
+            try:
+                gz = bool(files) and (is_gzip(files[0]) or any(checker.map(is_gzip, files[1:])))
+            except OSError as e:
+                failed.add(i)
+                logger.error("failed to read the inputs of {}: {}".format(i, e))
+                continue
+        else:
+            gz = compress == "gzip"
+        ext = ".fastq.gz" if gz else ".fastq"
+
+        logger.info("Writing to {}".format(os.path.basename("{}.R1{}".format(i, ext))))
+        tasks.append((i, os.path.join(output, "{}.R1{}".format(i, ext)), f1, gz))
+        if paired_end:
+            logger.info("Writing to {}".format(os.path.basename("{}.R2{}".format(i, ext))))
+            tasks.append((i, os.path.join(output, "{}.R2{}".format(i, ext)), f2, gz))
+    if checker is not None:
+        checker.shutdown()
+
+    # what needs doing for each job: "write", "append" or "skip"
+    actions = ["write"] * len(tasks)
+    if incremental:
+        manifest = load_manifest(output)
+        fingerprints = {}
+        with m.phase("plan"):
+            for n, (i, out, f, gz) in enumerate(tasks):
+                key = os.path.basename(out)
+                try:
+                    fingerprints[key] = [fingerprint(x, content_hash) for x in f]
+                except OSError as e:
+                    failed.add(i)
+                    logger.error("failed to read the inputs of {}: {}".format(i, e))
+                    continue
+                actions[n] = plan_output(manifest.get(key), fingerprints[key], out, gz)
+                if actions[n] == "skip":
+                    logger.info("{} is up to date".format(key))
+                elif actions[n] == "append":
+                    logger.info("Appending {} new files to {}".format(len(f) - len(manifest[key]["inputs"]), key))
+        m.add("plan", skipped=actions.count("skip"), appended=actions.count("append"))
+    if failed:
+        # both mates of a sample go, even if only one of them couldn't be read
+        kept = [n for n, t in enumerate(tasks) if t[0] not in failed]
+        tasks = [tasks[n] for n in kept]
+        actions = [actions[n] for n in kept]
+
+    if dryrun:
+        return failed
+
+    # Copies spend their time in syscalls that release the GIL, so threads
+    # keep several writers busy without the cost of extra processes.
+    # Results are collected in submission order so log output is identical
+    # regardless of the number of jobs.
+    validators = [FastqStats() if validate and action != "skip" else None for action in actions]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = []
+        for (_, out, f, gz), action, validator in zip(tasks, actions, validators):
+            if action == "skip":
+                futures.append(None)
+                continue
+            if action == "append":
+                f = f[len(manifest[os.path.basename(out)]["inputs"]):]
+            futures.append(pool.submit(concatenate, f, out, chunk_size, zerocopy, gz,
+                level, compress_threads, action == "append", validator, prefetch_files))
+
+        for n, ((i, out, _, gz), future, validator) in enumerate(zip(tasks, futures, validators), 1):
+            if future is None:
+                # picks up hashes if this run added --hash
+                manifest[os.path.basename(out)]["inputs"] = fingerprints[os.path.basename(out)]
+                continue
+            try:
+                nbytes = future.result()
+            except Exception as e:
+                failed.add(i)
+                logger.error("[{}/{}] failed to write {}: {}".format(n, len(tasks), os.path.basename(out), e))
+                continue
+
+            if validator is not None:
+                m.add("copy", records=validator.records)
+            if validator is not None and validator.error:
+                failed.add(i)
+                logger.error("[{}/{}] {} is invalid: {}".format(n, len(tasks), os.path.basename(out), validator.error))
+                continue
+
+            logger.info("[{}/{}] wrote {} ({} bytes)".format(n, len(tasks), os.path.basename(out), nbytes))
+            if incremental:
+                # saved after every output so an interrupted run keeps its progress
+                key = os.path.basename(out)
+                manifest[key] = {"compress": gz, "size": os.path.getsize(out), "inputs": fingerprints[key]}
+                save_manifest(output, manifest)
+
+    if validate:
+        status = [v.error or "ok" if v is not None else "skipped" for v in validators]
+        if paired_end:
+            # R1 and R2 of a sample are adjacent in tasks
+            for n in range(0, len(tasks) - 1, 2):
+                r1, r2 = validators[n], validators[n + 1]
+                if r1 is None or r2 is None or r1.error or r2.error:
+                    continue
+                if r1.records != r2.records:
+                    msg = "mates have different record counts ({} vs {})".format(r1.records, r2.records)
+                elif r1.names_digest != r2.names_digest:
+                    msg = "mates have different read names"
+                else:
+                    continue
+                failed.add(tasks[n][0])
+                status[n] = status[n + 1] = msg
+                logger.error("{} is invalid: {}".format(tasks[n][0], msg))
+
+        statspath = stats or os.path.join(output, "validation.tsv")
+        with open(statspath, "w") as statsfile:
+            statsfile.write("sample\toutput\trecords\tbases\tstatus\n")
+            for (i, out, _, _), v, st in zip(tasks, validators, status):
+                statsfile.write("{}\t{}\t{}\t{}\t{}\n".format(i, os.path.basename(out),
+                    v.records if v else "", v.bases if v else "", st))
+
+    if incremental:
+        for i, out, _, _ in tasks:
+            if i in failed:
+                manifest.pop(os.path.basename(out), None)
+        save_manifest(output, manifest)
+
+    if failed:
+        # don't leave R1 without R2 (or vice versa) for a sample that failed
+        for i, out, _, _ in tasks:
+            if i in failed and os.path.exists(out):
+                os.remove(out)
+        logger.error("Failed samples:\n{}".format(sorted(failed)))
+    return failed
+
@@ -0,0 +1,192 @@
+"""
+Choosing which clades to strain-profile, and which samples to profile them in.
+
+`top_clades` reads the species rows of an abundance table once, keeping the
+`n` best clades (by mean abundance or by prevalence) in a heap along with
+the samples each one was found in. Marker extraction and strain profiling
+then only need the samples that contain at least one chosen clade, rather
+than every sample in the cohort.
+
+Rows come from `read_table` (a merged MetaPhlAn table, one column per
+sample) or `read_profiles` (separate per-sample MetaPhlAn profiles).
+`write_profile` writes the chosen clades back out as a merged table, so
+strain profiling that picks its own top clades from a table picks exactly
+these, and `keep_samples` picks the files of the samples to profile.
+
+Planning runs as a task of its own once the profiles exist, so the samples
+are only known then. `write_samples` lists them, and `plan_sam` makes each
+sample's SAM file for strain profiling from that list: a link to the real
+one for the listed samples, and only its header for the others.
+"""
+
+from collections import namedtuple
+import heapq
+import os
+
+# A chosen clade, its score and the samples it was found in, along with its
+# full name in the table and its abundance in every sample
+Clade = namedtuple("Clade", ["name", "score", "mean", "prevalence", "samples", "lineage", "values"])
+
+SPECIES = "s__"
+
+
+def _fields(line):
+    return line.rstrip("\r\n").split("\t")
+
+
+def read_table(path):
+    """Sample names and an iterator of `(clade, values)` rows of a merged abundance table.
+
+    The header is the first line not starting with `#` (or a `#SampleID`
+    line), and the first column holds the clade.
+    """
+    f = open(path)
+    header = None
+    for line in f:
+        if not line.startswith("#") or line.startswith("#SampleID"):
+            header = _fields(line)
+            break
+    if header is None:
+        f.close()
+        return [], iter(())
+
+    def rows():
+        with f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = _fields(line)
+                yield fields[0], [float(v) if v else 0.0 for v in fields[1:]]
+    return header[1:], rows()
+
+
+def read_profiles(paths, samples):
+    """Sample names and `(clade, values)` rows of separate per-sample profiles, joined on clade.
+
+    `samples` names the sample each file in `paths` belongs to. Clades a
+    sample's profile doesn't list count as 0 in that sample.
+    """
+    found = {}
+    for i, path in enumerate(paths):
+        with open(path) as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = _fields(line)
+                if len(fields) > 1:
+                    found.setdefault(fields[0], [0.0] * len(paths))[i] = float(fields[1])
+    return list(samples), iter(sorted(found.items()))
+
+
+def is_species(clade, level=SPECIES):
+    """Whether `clade` (eg `k__Bacteria|...|s__Escherichia_coli`) ends at `level`."""
+    return clade.rsplit("|", 1)[-1].startswith(level)
+
+
+def top_clades(samples, rows, n, by="mean", min_abundance=0.0, level=SPECIES):
+    """The `n` best clades at `level` in `rows`, best first, from a single pass.
+
+    Clades are ranked by mean abundance over all samples (`by="mean"`) or by
+    the fraction of samples they are found in (`by="prevalence"`), with the
+    other as tie-breaker. A clade is found in a sample when its abundance
+    there is above `min_abundance`.
+    """
+    if by not in ("mean", "prevalence"):
+        raise ValueError("rank clades by mean or prevalence, not {}".format(by))
+    if n <= 0 or not samples:
+        return []
+    heap = []
+    for clade, values in rows:
+        if not is_species(clade, level):
+            continue
+        present = [i for i, v in enumerate(values) if v > min_abundance]
+        if not present:
+            continue
+        mean = sum(values) / len(samples)
+        prevalence = len(present) / float(len(samples))
+        key = (mean, prevalence) if by == "mean" else (prevalence, mean)
+        entry = (key, clade.rsplit("|", 1)[-1], mean, prevalence, present, clade, values)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+    heap.sort(key=lambda e: e[:2], reverse=True)
+    return [Clade(name, key[0], mean, prevalence, [samples[i] for i in present], lineage, list(values))
+        for key, name, mean, prevalence, present, lineage, values in heap]
+
+
+def samples_with(clades):
+    """Which of `clades` each sample contains, for the samples containing any."""
+    chosen = {}
+    for clade in clades:
+        for sample in clade.samples:
+            chosen.setdefault(sample, []).append(clade.name)
+    return chosen
+
+
+def sample_name(path, tag):
+    """Sample name of a per-sample file, eg `S1` for `.../S1_bowtie2.sam` with `tag` "_bowtie2"."""
+    name = os.path.basename(path)
+    for suffix in (".sam", ".tsv", tag):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def keep_samples(files, tag, clades, profiled):
+    """The `files` (named as `sample_name(file, tag)`) of the samples worth strain-profiling.
+
+    Those are the samples containing any of `clades`, and any sample that
+    isn't among the `profiled` samples the clades were chosen from (eg one
+    added since the profile was made), since nothing is known about it yet.
+    """
+    chosen = samples_with(clades)
+    profiled = set(profiled)
+    return [f for f in files if sample_name(f, tag) in chosen or sample_name(f, tag) not in profiled]
+
+
+def write_profile(path, samples, clades):
+    """Write `clades` as a merged abundance table with a column for each of `samples`."""
+    with open(path, "w") as f:
+        f.write("\t".join(["ID"] + list(samples)) + "\n")
+        for c in clades:
+            f.write("\t".join([c.lineage] + [repr(v) for v in c.values]) + "\n")
+
+
+def write_plan(path, clades):
+    """Write the chosen clades, their scores and their samples as a TSV."""
+    with open(path, "w") as f:
+        f.write("clade\tmean\tprevalence\tsamples\n")
+        for c in clades:
+            f.write("{}\t{:.6g}\t{:.4g}\t{}\n".format(c.name, c.mean, c.prevalence, ",".join(c.samples)))
+
+
+def write_samples(path, samples):
+    """Write the names of the samples to strain-profile, one per line."""
+    with open(path, "w") as f:
+        f.writelines(sample + "\n" for sample in samples)
+
+
+def read_samples(path):
+    """The sample names written by `write_samples`."""
+    with open(path) as f:
+        return set(line.rstrip("\r\n") for line in f if line.strip())
+
+
+def plan_sam(sam, tag, samples, target):
+    """Make `target` stand in for the SAM file `sam` when strain profiling the `samples`.
+
+    `target` links to `sam` if its sample (named as `sample_name(sam, tag)`)
+    is one of `samples`, and otherwise holds only the header of `sam`: a
+    valid SAM file with no alignments, which adds no markers.
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+    if sample_name(sam, tag) in samples:
+        os.symlink(os.path.abspath(sam), target)
+        return
+    with open(sam) as f, open(target, "w") as out:
+        for line in f:
+            if not line.startswith("@"):
+                break
+            out.write(line)
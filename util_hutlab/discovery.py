@@ -0,0 +1,200 @@
+"""
+Finding a workflow's input files with as few filesystem calls as possible.
+
+`FileListing.scan` walks one or more folders with `os.scandir` on several
+threads at once (on network filesystems most of the time goes to waiting on
+the metadata server, so listings overlap well), and stats only the files
+whose names end in one of the given suffixes. The result answers `isfile`,
+`getsize` and `stat` for the rest of the workflow from memory; paths outside
+the scanned folders are stat-ed once and remembered.
+
+With a `cache` file, each folder's listing is saved along with its mtime.
+The next scan stats each folder once and reuses the saved listing of every
+folder whose mtime hasn't changed, so replanning a large tree costs one stat
+per folder. A folder's mtime only changes when files are added, removed or
+renamed in it, so files rewritten in place keep their saved size and mtime.
+
+`index_files` picks the files of one bowtie2 index out of a listing.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import logging
+import os
+import stat
+import time
+
+from .storage import atomic_write
+
+logger = logging.getLogger("Discovery")
+
+CACHE_VERSION = 1
+# Folders changed this soon (in seconds) before they were listed are listed
+# again next time, in case a file arrived in the same mtime tick
+RACY_SECONDS = 2
+JOBS = 8
+
+
+def index_files(paths, basename):
+    """The files among `paths` that belong to the bowtie2 index `basename`.
+
+    Index files are BASENAME.1.bt2, BASENAME.rev.1.bt2 and so on; matching up
+    to the "." keeps the index "ecoli" from also taking the files of "ecoli16".
+    """
+    prefix = basename + "."
+    return [path for path in paths if os.path.basename(path).startswith(prefix)]
+
+
+def _list_folder(path, suffixes, saved):
+    """`(mtime, listed, subfolders, {name: [size, mtime]})` for the folder at `path`.
+
+    `saved` is the cached result for this folder (or None), returned as is if
+    the folder hasn't changed since. Hidden entries are left out.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if saved is not None and saved[0] == mtime and saved[1] - mtime / 1e9 > RACY_SECONDS:
+        return saved
+    listed = time.time()
+    folders = []
+    files = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                folders.append(entry.name)
+            elif suffixes is None or entry.name.endswith(suffixes):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue  # removed while we were listing, or a broken link
+                if stat.S_ISREG(st.st_mode):
+                    files[entry.name] = [st.st_size, st.st_mtime_ns]
+    return [mtime, listed, sorted(folders), files]
+
+
+def load_cache(path, suffixes):
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except ValueError:
+        logger.warning("ignoring unreadable listing cache {}".format(path))
+        return {}
+    if saved.get("version") != CACHE_VERSION or saved.get("suffixes") != (list(suffixes) if suffixes else None):
+        return {}
+    return saved["folders"]
+
+
+def save_cache(path, suffixes, folders):
+    with atomic_write(path) as f:
+        # dumps uses the C encoder, dump (streaming) doesn't
+        f.write(json.dumps({"version": CACHE_VERSION, "suffixes": list(suffixes) if suffixes else None,
+            "folders": folders}))
+
+
+class FileListing(object):
+    """The files found by a scan, with their sizes and mtimes, plus any other paths looked up since."""
+
+    def __init__(self, folders=None, suffixes=None):
+        self.folders = folders or {}  # folder -> [mtime, listed, subfolders, {name: [size, mtime]}]
+        self.suffixes = suffixes
+        self._stats = {}  # path -> (size, mtime) or None, for paths looked up outside the scan
+
+    @classmethod
+    def scan(cls, roots, suffixes=None, recursive=True, exclude=(), jobs=JOBS, cache=None):
+        """List the folders `roots` (and, if `recursive`, everything below them) on `jobs` threads.
+
+        Only files ending in one of `suffixes` (a string or tuple; all files if
+        None) are stat-ed and kept. Hidden folders, and folders in `exclude`
+        (eg the output folder), aren't listed. Roots that aren't folders are
+        skipped. `cache` is the path of a listing cache to reuse and update.
+        """
+        if isinstance(suffixes, str):
+            suffixes = (suffixes,)
+        suffixes = tuple(suffixes) if suffixes else None
+        exclude = {os.path.realpath(d) for d in exclude if d}
+        saved = load_cache(cache, suffixes)
+        folders = {}
+        reused = 0
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            pending = {}
+            for root in roots:
+                root = os.path.normpath(root)
+                if root not in pending.values() and os.path.isdir(root):
+                    pending[pool.submit(_list_folder, root, suffixes, saved.get(root))] = root
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder = pending.pop(future)
+                    try:
+                        listing = future.result()
+                    except OSError as e:
+                        logger.warning("could not list {}: {}".format(folder, e))
+                        continue
+                    reused += listing is saved.get(folder)
+                    folders[folder] = listing
+                    if not recursive:
+                        continue
+                    for name in listing[2]:
+                        sub = os.path.join(folder, name)
+                        if sub not in folders and sub not in pending.values() and \
+                                os.path.realpath(sub) not in exclude:
+                            pending[pool.submit(_list_folder, sub, suffixes, saved.get(sub))] = sub
+        logger.info("listed {} folders ({} from the cache)".format(len(folders), reused))
+        if cache and (reused < len(folders) or len(folders) != len(saved)):
+            try:
+                save_cache(cache, suffixes, folders)
+            except OSError as e:
+                logger.warning("could not save listing cache: {}".format(e))
+        return cls(folders, suffixes)
+
+    def find(self, root=None, suffixes=None):
+        """Sorted paths of the files found (under `root`, ending in `suffixes`, if given)."""
+        if isinstance(suffixes, str):
+            suffixes = (suffixes,)
+        root = os.path.normpath(root) if root else None
+        paths = []
+        for folder, listing in self.folders.items():
+            if root and folder != root and not folder.startswith(root + os.sep):
+                continue
+            prefix = os.path.join(folder, "")
+            paths.extend(prefix + name for name in listing[3] if not suffixes or name.endswith(tuple(suffixes)))
+        return sorted(paths)
+
+    def stat(self, path):
+        """`(size, mtime_ns)` of the file at `path`, or None if there is no such file.
+
+        Files in scanned folders are answered from the scan; anything else is
+        stat-ed the first time it's asked about.
+        """
+        folder, name = os.path.split(os.path.normpath(path))
+        listing = self.folders.get(folder)
+        if listing is not None and (self.suffixes is None or name.endswith(self.suffixes)):
+            found = listing[3].get(name)
+            return tuple(found) if found else None
+        if path not in self._stats:
+            try:
+                st = os.stat(path)
+                self._stats[path] = (st.st_size, st.st_mtime_ns) if stat.S_ISREG(st.st_mode) else None
+            except OSError:
+                self._stats[path] = None
+        return self._stats[path]
+
+    def isfile(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        return os.path.normpath(path) in self.folders or os.path.isdir(path)
+
+    def getsize(self, path):
+        st = self.stat(path)
+        if st is None:
+            raise OSError("no such file: {}".format(path))
+        return st[0]
+
+    def total_size(self, folder):
+        """Bytes in the files found directly in `folder`."""
+        listing = self.folders.get(os.path.normpath(folder))
+        return sum(size for size, _ in listing[3].values()) if listing else 0
@@ -0,0 +1,266 @@
+"""
+Line and FASTQ record extraction behind `bin/crap2.py`.
+
+`getlines` and `getrecords` copy a range of lines (or records) from a file
+without decoding it, and `split_records` cuts a FASTQ file into record-aligned
+shards.
+"""
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+from . import metrics
+from .storage import read_index, write_index
+
+# Bytes read (and written) at a time
+CHUNK_SIZE = 8 * 1024 * 1024
+# Bytes counted at once while narrowing down to a particular newline
+SCAN_BLOCK = 64 * 1024
+
+# Sidecar line index written next to the file with --index
+INDEX_SUFFIX = ".lineidx"
+INDEX_VERSION = 2
+INDEX_EVERY = 100000
+
+
+def newline_offsets(infile, n, chunk_size=CHUNK_SIZE):
+    """Yield the offset just past every `n`-th newline of `infile`.
+
+    Counting starts at the current position of `infile`, a binary file.
+    Newlines are counted per chunk with bytes.count(), and only looked up
+    one by one within the small block that holds the one wanted.
+    """
+    pos = infile.tell()
+    left = n  # newlines until the next offset
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            return
+        count = chunk.count(b"\n")
+        start = 0
+        while count >= left:
+            while True:
+                c = chunk.count(b"\n", start, start + SCAN_BLOCK)
+                if c >= left:
+                    break
+                left -= c
+                count -= c
+                start += SCAN_BLOCK
+            for _ in range(left):
+                start = chunk.index(b"\n", start) + 1
+            count -= left
+            left = n
+            yield pos + start
+        left -= count
+        pos += len(chunk)
+
+
+def copy_rest(infile, outfile, size=None, chunk_size=CHUNK_SIZE):
+    """Copy `infile` from its current position to `outfile`, up to `size` bytes if given.
+
+    Returns the number of lines copied.
+    """
+    lines = 0
+    last = b"\n"
+    while True:
+        chunk = infile.read(chunk_size if size is None else min(chunk_size, size))
+        if not chunk:
+            break
+        outfile.write(chunk)
+        lines += chunk.count(b"\n")
+        last = chunk[-1:]
+        if size is not None:
+            size -= len(chunk)
+    # an unterminated last line still counts
+    return lines + (last != b"\n")
+
+
+class LineIndex(object):
+    """Offsets of lines 1, k + 1, 2k + 1... of a file, stored as `<file>.lineidx`.
+
+    The index records the file's size and mtime and is only used while they
+    match; it is stored with `storage.write_index`.
+    """
+
+    def __init__(self, every, offsets, size, mtime):
+        self.every = every
+        self.offsets = offsets
+        self.size = size
+        self.mtime = mtime
+
+    def seek_point(self, n):
+        """The closest indexed line at or before line `n`, and its offset."""
+        i = min((n - 1) // self.every, len(self.offsets) - 1)
+        return i * self.every + 1, self.offsets[i]
+
+    @classmethod
+    def build(cls, path, every=INDEX_EVERY):
+        """Index the file at `path` with one pass over it."""
+        st = os.stat(path)
+        offsets = array("Q", [0])
+        with open(path, "rb") as f:
+            offsets.extend(newline_offsets(f, every))
+        return cls(every, offsets, st.st_size, st.st_mtime_ns)
+
+    def save(self, path):
+        write_index(path, INDEX_VERSION, self.size, self.mtime, self.offsets, every=self.every)
+
+    @classmethod
+    def load(cls, path, target, every=INDEX_EVERY):
+        """Read the index at `path`, or return None if it's missing or out of date for `target`."""
+        saved = read_index(path, target, INDEX_VERSION, every=every)
+        if saved is None:
+            return None
+        meta, offsets, _ = saved
+        return cls(every, offsets, meta["size"], meta["mtime"])
+
+
+def load_index(f, every=INDEX_EVERY):
+    """Load the line index of file `f`, (re)building it if needed."""
+    path = f + INDEX_SUFFIX
+    index = LineIndex.load(path, f, every)
+    if index is None:
+        logging.warning("building line index {}".format(path))
+        index = LineIndex.build(f, every)
+        try:
+            index.save(path)
+        except OSError as e:
+            logging.warning("could not save line index: {}".format(e))
+    return index
+
+
+def find_line(infile, n, line=1, offset=0):
+    """Offset of line `n` of binary file `infile`, or None if it has fewer lines.
+
+    Counting starts from `offset`, which must be where line `line` starts.
+    """
+    if n <= line:
+        return offset
+    infile.seek(offset)
+    return next(newline_offsets(infile, n - line), None)
+
+
+def getlines(f, o, n, index=False, every=INDEX_EVERY, end=None):
+    """Write file `f` from line `n` (counting from 1) to the end into file `o`.
+
+    If `end` is given, stop before that line instead. With `index`, a
+    `LineIndex` of every `every`-th line is used (and built or refreshed if
+    needed) to start counting close to each line.
+    Returns the number of lines written.
+    """
+    n = max(int(n), 1)
+    m = metrics.active()
+    lineindex = None
+    if index:
+        with m.phase("index"):
+            lineindex = load_index(f, every)
+    logging.warning("skipping until line {}".format(n))
+    with open(f, "rb") as infile, open(o, "wb") as outfile:
+        with m.phase("seek"):
+            start = find_line(infile, n, *(lineindex.seek_point(n) if lineindex else (1, 0)))
+        if start is None:
+            logging.warning("{} has fewer than {} lines, nothing written".format(f, n))
+            return 0
+        size = None
+        if end is not None:
+            end = max(int(end), n)
+            line, offset = lineindex.seek_point(end) if lineindex else (n, start)
+            if line < n:
+                line, offset = n, start
+            with m.phase("seek"):
+                stop = find_line(infile, end, line, offset)
+            if stop is not None:
+                size = stop - start
+        m.add("seek", bytes=start)
+        logging.warning("writing starting at line {} (byte {})".format(n, start))
+        infile.seek(start)
+        with m.phase("copy"):
+            lines = copy_rest(infile, outfile, size)
+        m.add("copy", bytes=outfile.tell(), rows=lines)
+    logging.warning("wrote lines {} to {}".format(n, n - 1 + lines))
+    return lines
+
+
+def getrecords(f, o, n, index=False, every=INDEX_EVERY, end=None):
+    """Like `getlines`, for FASTQ records (4 lines each, counting from 1).
+
+    Returns the number of records written.
+    """
+    first = 4 * (max(int(n), 1) - 1) + 1
+    last = None if end is None else 4 * (max(int(end), 1) - 1) + 1
+    return (getlines(f, o, first, index, every, last) + 3) // 4
+
+
+def _is_record(lines):
+    """True if `lines` (4 lines of bytes) look like one FASTQ record."""
+    return lines[0].startswith(b"@") and lines[2].startswith(b"+") and bool(lines[3]) and \
+        len(lines[1].rstrip(b"\r\n")) == len(lines[3].rstrip(b"\r\n"))
+
+
+def record_start(infile, offset):
+    """Offset of the first FASTQ record of `infile` that starts at or after `offset`.
+
+    Reads from `offset` and checks line by line for a header, then a
+    sequence, a `+` line and a quality line as long as the sequence. A
+    quality line can start with `@`, but two lines on from it is another
+    sequence, never a `+`. Returns the end of the file if there is none.
+    """
+    if offset <= 0:
+        return 0
+    infile.seek(offset - 1)
+    infile.readline()  # the rest of the line holding offset - 1
+    pos = infile.tell()
+    lines = [infile.readline() for _ in range(4)]
+    while lines[0]:
+        if _is_record(lines):
+            return pos
+        pos += len(lines[0])
+        lines = lines[1:] + [infile.readline()]
+    return pos
+
+
+def shard_offsets(f, k):
+    """Byte offsets that cut FASTQ file `f` into `k` record-aligned pieces of about the same size.
+
+    Returns `k + 1` offsets, from 0 to the size of `f`.
+    """
+    size = os.path.getsize(f)
+    with open(f, "rb") as infile:
+        return [0] + [record_start(infile, size * i // k) for i in range(1, k)] + [size]
+
+
+def _write_range(f, o, start, end):
+    m = metrics.active()
+    with open(f, "rb") as infile, open(o, "wb") as outfile, m.phase("copy"):
+        infile.seek(start)
+        lines = copy_rest(infile, outfile, end - start)
+    m.add("copy", bytes=end - start, rows=lines, files=1)
+    return lines
+
+
+def split_records(f, outputs, jobs=None):
+    """Split FASTQ file `f` into one record-aligned shard per file in `outputs`.
+
+    Shards are about the same size (in bytes) and are written at the same
+    time on `jobs` threads (one per shard by default). If any fails, all
+    outputs are removed.
+    Returns the number of records in each shard.
+    """
+    with metrics.active().phase("seek"):
+        offsets = shard_offsets(f, len(outputs))
+    logging.warning("splitting {} at bytes {}".format(f, offsets[1:-1]))
+    with ThreadPoolExecutor(max_workers=jobs or len(outputs)) as pool:
+        futures = [pool.submit(_write_range, f, o, start, end)
+            for o, start, end in zip(outputs, offsets[:-1], offsets[1:])]
+        try:
+            lines = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.exception()  # wait for the others before cleaning up
+            for o in outputs:
+                if os.path.exists(o):
+                    os.remove(o)
+            raise
+    return [(l + 3) // 4 for l in lines]
@@ -0,0 +1,227 @@
+"""
+Per-phase timers and counters for the utilities, written as JSON lines.
+
+A command line tool calls `start` when it is given `--metrics FILE`, and
+writes the collected `Metrics` with `stop().write(FILE)` when it is done.
+The library code asks `active()` for the current collector, times each
+phase with `with m.phase("copy"):` and counts what went through it with
+`m.add("copy", bytes=n, files=1)`. Phases are timed per file or per block
+of lines, never per line, and while no collector is started `active()`
+returns `OFF`, whose `phase` and `add` do nothing.
+
+Each run appends one line to the metrics file: the tool, a name for the run
+(eg the sample or table), the host, wall and CPU time, peak memory and, for
+each phase, its seconds (summed over threads), counts and bytes/s. Tasks of a
+workflow all append to the same file (`bin/tasksize.py run --metrics` does
+the same for commands that aren't ours), and `summarize` and `slowest`
+(`bin/metrics.py`) gather them across the cohort.
+"""
+
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger("Metrics")
+
+
+def max_rss_mb(usage):
+    """Peak resident memory in MB from a `resource.getrusage` result."""
+    # kB on Linux, bytes on macOS
+    return usage.ru_maxrss / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
+
+
+def append_line(path, entry):
+    """Append `entry` to the JSON-lines file at `path`."""
+    # one write on an O_APPEND descriptor, so concurrent tasks don't interleave lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry, sort_keys=True) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+class _Timer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.name, seconds=time.perf_counter() - self.start)
+        return False
+
+
+class Metrics(object):
+    """Seconds and counts (bytes, rows, files...) for each phase of one run of `tool`."""
+    enabled = True
+
+    def __init__(self, tool, name=None):
+        self.tool = tool
+        self.name = name
+        self.phases = {}  # phase -> {"seconds": s, count: n, ...}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def phase(self, name):
+        """Context manager adding the time spent inside it to phase `name`."""
+        return _Timer(self, name)
+
+    def add(self, phase, **counts):
+        """Add `counts` (eg `bytes=n`) to those of `phase`."""
+        with self._lock:
+            totals = self.phases.setdefault(phase, {"seconds": 0.0})
+            for key, n in counts.items():
+                totals[key] = totals.get(key, 0) + n
+
+    def merge(self, phases):
+        """Add the `phases` of another run (eg one in a worker process) to this one's."""
+        for phase, counts in phases.items():
+            self.add(phase, **counts)
+
+    def entry(self):
+        """This run as one metrics record."""
+        import socket  # only needed once, at the end of a run
+        phases = {}
+        for phase, counts in sorted(self.phases.items()):
+            counts = dict(counts)
+            seconds = counts["seconds"]
+            if seconds > 0:
+                for key in ("bytes", "rows", "records"):
+                    if counts.get(key):
+                        counts[key + "_per_s"] = round(counts[key] / seconds)
+            counts["seconds"] = round(seconds, 4)
+            phases[phase] = counts
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {"tool": self.tool, "name": self.name, "host": socket.gethostname(),
+            "wall": round(time.perf_counter() - self._start, 3),
+            "cpu": round(usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime, 3),
+            "max_rss_mb": round(max(max_rss_mb(usage), max_rss_mb(children)), 1),
+            "phases": phases, "time": int(time.time())}
+
+    def write(self, path):
+        """Append this run to the metrics file at `path`."""
+        try:
+            append_line(path, self.entry())
+        except OSError as e:
+            logger.warning("could not write metrics to {}: {}".format(path, e))
+
+
+class _NoTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Off(object):
+    """Stands in for `Metrics` while none is started: every call does nothing."""
+    enabled = False
+    phases = {}
+    _timer = _NoTimer()
+
+    def phase(self, name):
+        return self._timer
+
+    def add(self, phase, **counts):
+        pass
+
+    def merge(self, phases):
+        pass
+
+    def write(self, path):
+        pass
+
+
+OFF = _Off()
+_active = OFF
+
+
+def active():
+    """The `Metrics` of the current run, or `OFF`."""
+    return _active
+
+
+def start(tool, name=None):
+    """Start collecting metrics for a run of `tool`, and return the collector."""
+    global _active
+    _active = Metrics(tool, name)
+    return _active
+
+
+def stop():
+    """Stop collecting, and return what was collected (`OFF` if nothing was started)."""
+    global _active
+    metrics, _active = _active, OFF
+    return metrics
+
+
+def read_metrics(paths):
+    """Records in the JSON-lines files at `paths`, skipping lines that can't be parsed.
+
+    Reads resource logs (`sizing.read_log`) as well as metrics files.
+    """
+    entries = []
+    for path in paths:
+        bad = 0
+        with open(path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    bad += 1
+        if bad:
+            logger.warning("skipped {} unreadable lines in {}".format(bad, path))
+    return entries
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def summarize(entries):
+    """Totals over `entries` for each tool and phase, sorted by tool and phase.
+
+    Returns dicts with the tool, phase, number of runs, total seconds, bytes
+    and rows, overall bytes/s and the median bytes/s of a run. Rates only
+    count the runs that counted bytes in that phase.
+    """
+    groups = {}
+    for e in entries:
+        for phase, counts in e.get("phases", {}).items():
+            groups.setdefault((e.get("tool"), phase), []).append(counts)
+    summary = []
+    for (tool, phase), runs in sorted(groups.items(), key=lambda g: (str(g[0][0]), g[0][1])):
+        rated = [c for c in runs if c.get("bytes") and c.get("seconds")]
+        rated_seconds = sum(c["seconds"] for c in rated)
+        summary.append({"tool": tool, "phase": phase, "runs": len(runs),
+            "seconds": round(sum(c.get("seconds", 0) for c in runs), 3),
+            "bytes": sum(c.get("bytes", 0) for c in runs), "rows": sum(c.get("rows", 0) for c in runs),
+            "bytes_per_s": round(sum(c["bytes"] for c in rated) / rated_seconds) if rated else None,
+            "median_bytes_per_s": round(_median([c["bytes"] / c["seconds"] for c in rated])) if rated else None})
+    return summary
+
+
+def slowest(entries, phase, n=10):
+    """The `n` runs with the lowest bytes/s in `phase`, slowest first, as `(bytes/s, entry)`."""
+    rated = []
+    for e in entries:
+        counts = e.get("phases", {}).get(phase)
+        if counts and counts.get("bytes") and counts.get("seconds"):
+            rated.append((counts["bytes"] / counts["seconds"], e))
+    rated.sort(key=lambda r: r[0])
+    return rated[:n]
@@ -0,0 +1,1025 @@
+"""
+Column and row selection for delimited tables, behind `bin/selectcols.py`.
+
+`select_columns` filters an open table into an open file. The other
+`select_columns_*` functions are faster paths for table files (memory-mapped
+with numpy, through a sidecar index, or on several processes), and
+`select_table` picks between them the way the script does.
+"""
+
+from array import array
+from bisect import bisect_right
+import bz2
+from collections import deque, namedtuple
+import fnmatch
+import gzip
+import io
+import logging
+import lzma
+import math
+import mmap
+from operator import itemgetter
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+from . import metrics
+from .storage import read_index, write_index
+
+# numpy, once `load_numpy` has imported it
+np = None
+
+logger = logging.getLogger("Column selector")
+
+# Lines read (and rows written) per batch; see `select_columns`
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# Common spellings of zero, checked before falling back to float()
+_ZERO_STRINGS = ["0", "0.0", "0.00", "0.000", "0.0000", "0.00000", "0.000000", "-0", "-0.0", "0e0", "0E0"]
+ZEROS = frozenset(_ZERO_STRINGS + [z + "\n" for z in _ZERO_STRINGS] + [z + "\r\n" for z in _ZERO_STRINGS])
+
+# Bytes of the memory-mapped table handled per vectorized chunk with --numpy
+NUMPY_CHUNK = 16 * 1024 * 1024
+# numpy goes over every byte of a chunk, while splitting lines costs about the
+# same per selected field, so it only pays off when this fraction of the
+# columns (or more) is selected
+NUMPY_MIN_COLUMNS = 0.75
+# Bytes of the table handed to each worker task with --jobs
+PARALLEL_CHUNK = 16 * 1024 * 1024
+
+# Compressed formats, recognized by magic bytes on input and extension on output
+MAGIC = [(b"\x1f\x8b", "gz"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "xz")]
+EXTENSIONS = {".gz": "gz", ".bz2": "bz2", ".xz": "xz"}
+CODECS = {
+    "gz": lambda path, mode: gzip.open(path, mode, compresslevel=6),
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+# Blocks queued between the parser and a codec thread
+QUEUE_DEPTH = 4
+
+# Row filters beyond dropping all-zero rows; see `make_row_filter`
+Filters = namedtuple("Filters", ["min_abundance", "min_samples", "min_prevalence", "label_regex", "labels",
+                                 "sorted_labels"])
+Filters.__new__.__defaults__ = (None, 1, None, None, None, False)
+
+# Sidecar index written next to the table with --index
+INDEX_SUFFIX = ".selidx"
+INDEX_VERSION = 2
+
+
+def parse_separator(sep):
+    """Translate the --separator argument into the actual separator."""
+    if sep == "\\t" or sep == "t" or sep == "tab":
+        return "\t"
+    elif sep == "s" or sep == "space" or sep == " ":
+        return " "
+    elif sep == "c" or sep == "comma" or sep == ",":
+        return ","
+    else:
+        raise ValueError("Invalid separator")
+
+
+def sniff_compression(path):
+    """Name of the compression format of `path` ("gz", "bz2" or "xz"), or None."""
+    with open(path, "rb") as f:
+        head = f.read(6)
+    for magic, codec in MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+class ThreadedReader(io.RawIOBase):
+    """Raw stream that reads blocks of `raw` on a background thread.
+
+    Used to decompress on its own thread: blocks are passed over through a
+    queue of `depth` entries, so the codec stays at most that far ahead of
+    the reader.
+    """
+
+    def __init__(self, raw, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+        self._queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._block = b""
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, args=(raw, block_size), daemon=True)
+        self._thread.start()
+
+    def _fill(self, raw, block_size):
+        try:
+            with raw:
+                while not self._stop.is_set():
+                    block = raw.read(block_size)
+                    self._queue.put(block)
+                    if not block:
+                        return
+        except Exception as e:
+            self._queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._block):
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._block = item
+            self._pos = 0
+        n = min(len(b), len(self._block) - self._pos)
+        b[:n] = self._block[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            # make room in case the thread is blocked on a full queue
+            while not self._queue.empty():
+                self._queue.get_nowait()
+        super(ThreadedReader, self).close()
+
+
+class ThreadedWriter(io.RawIOBase):
+    """Raw stream that writes to `raw` on a background thread.
+
+    Used to compress on its own thread: writes are queued (at most `depth`
+    of them) and `raw` is closed once everything is written. Errors from
+    the thread are raised on the next write or on close.
+    """
+
+    def __init__(self, raw, depth=QUEUE_DEPTH):
+        self._queue = queue.Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, args=(raw,), daemon=True)
+        self._thread.start()
+
+    def _drain(self, raw):
+        try:
+            with raw:
+                while True:
+                    block = self._queue.get()
+                    if block is None:
+                        return
+                    if self._error is None:
+                        raw.write(block)
+        except Exception as e:
+            self._error = e
+            # keep emptying the queue so writers don't block
+            while self._queue.get() is not None:
+                pass
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            super(ThreadedWriter, self).close()
+            self._queue.put(None)
+            self._thread.join()
+            if self._error is not None:
+                raise self._error
+
+
+def open_table(path, binary=False):
+    """Open a table for reading, decompressing on a background thread if needed."""
+    codec = sniff_compression(path)
+    if codec is None:
+        return open(path, "rb" if binary else "r", buffering=BLOCK_SIZE)
+    stream = io.BufferedReader(ThreadedReader(CODECS[codec](path, "rb")), BLOCK_SIZE)
+    return stream if binary else io.TextIOWrapper(stream)
+
+
+def open_output(path):
+    """Open `path` for writing, compressing on a background thread if its extension says so."""
+    codec = EXTENSIONS.get(os.path.splitext(path)[1])
+    if codec is None:
+        return open(path, "w+", buffering=BLOCK_SIZE)
+    return io.TextIOWrapper(io.BufferedWriter(ThreadedWriter(CODECS[codec](path, "wb")), BLOCK_SIZE))
+
+
+def same_file(table, output):
+    """Whether writing `output` would overwrite `table` (through links or relative paths too)."""
+    if os.path.exists(output):
+        return os.path.samefile(table, output)
+    return os.path.realpath(table) == os.path.realpath(output)
+
+
+def read_lines(data):
+    """Split `data` (bytes of whole lines) the way text-mode iteration would.
+
+    Newlines are translated as in universal newlines mode, and every line,
+    including an unterminated last one, ends with a newline.
+    """
+    lines = io.StringIO(data.decode(), newline=None).readlines()
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    return lines
+
+
+class ColumnPatterns(object):
+    """Column names, regular expressions and globs, used like a set of names.
+
+    The patterns are compiled into one expression; regular expressions
+    match anywhere in a name and globs must match all of it.
+    """
+
+    def __init__(self, names=(), regexes=(), globs=()):
+        self.names = frozenset(names)
+        parts = list(regexes) + [r"\A" + fnmatch.translate(g) for g in globs]
+        self._search = re.compile("|".join("(?:{})".format(p) for p in parts)).search if parts else None
+
+    def __contains__(self, name):
+        return name in self.names or (self._search is not None and self._search(name) is not None)
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+def pick_columns(cols, columns, keep_first=False):
+    """Indices of the header fields `cols` that are in `columns`."""
+    if not isinstance(columns, ColumnPatterns):
+        columns = set(columns)
+    colnos = [i for i, x in enumerate(cols) if x in columns]
+
+    if keep_first and (not colnos or colnos[0] != 0):
+        colnos.insert(0, 0)
+
+    logger.debug(colnos)
+    return colnos
+
+
+def nonzero(values):
+    """True if any of `values` (numeric strings) is not zero.
+
+    Stops at the first non-zero value, and only calls float() on values
+    that aren't an obvious spelling of zero.
+    """
+    for x in values:
+        if x in ZEROS:
+            continue
+        if float(x) != 0:
+            return True
+    return False
+
+
+def make_row_filter(nvalues, skip=0, keep_zeros=False, min_abundance=None, min_samples=1, min_prevalence=None):
+    """Build a function that filters a list of rows on their values.
+
+    Rows are sequences of strings, of which all but the first `skip` are
+    the `nvalues` numeric values. A value counts as present
+    when it is at least `min_abundance`, or above zero if that is None;
+    rows need `min_samples` present values, and at least `min_prevalence`
+    of `nvalues` if it's given. Rows of only zeros are dropped unless
+    `keep_zeros` is set. Returns None if no row would be dropped.
+
+    Counting stops as soon as a row has enough present values, and common
+    spellings of zero are skipped without calling float().
+    """
+    numeric = min_abundance is not None or min_prevalence is not None or min_samples != 1
+    if not numeric:
+        if keep_zeros:
+            return None
+        return lambda rows: [r for r in rows if nonzero(r[skip:])]
+
+    required = min_samples
+    if min_prevalence is not None:
+        # allow for rounding in eg 0.3 * 10
+        required = max(required, int(math.ceil(min_prevalence * nvalues - 1e-9)))
+    if min_abundance is None:
+        present = lambda v: v > 0
+        zero_absent = True
+    else:
+        present = lambda v: v >= min_abundance
+        zero_absent = min_abundance > 0
+    # enough present values already rule out all-zero rows
+    check_zeros = not keep_zeros and not (zero_absent and required > 0)
+
+    def enough(values):
+        if required <= 0:
+            return True
+        n = 0
+        for x in values:
+            if zero_absent and x in ZEROS:
+                continue
+            if present(float(x)):
+                n += 1
+                if n >= required:
+                    return True
+        return False
+
+    def filter_rows(rows):
+        if check_zeros:
+            return [r for r in rows if enough(r[skip:]) and nonzero(r[skip:])]
+        return [r for r in rows if enough(r[skip:])]
+
+    return filter_rows
+
+
+def make_selector(colnos, ncols, sep, keep_first=False, keep_zeros=False, filters=None):
+    """Build a function that filters a list of table lines.
+
+    `colnos` are the (ascending) indices to keep out of `ncols` columns.
+    The returned function takes a list of lines, each ending in a newline,
+    and returns the selected rows as one string, skipping rows whose
+    values are all zero unless `keep_zeros` is set, and rows that fail
+    `filters` (see `Filters` and `make_row_filter`; with `labels`, only
+    rows whose first field is in that set are kept). The row count it
+    returns with the string is the number of rows kept.
+    """
+    if not colnos:
+        get = lambda fields: ()
+    elif len(colnos) == 1:
+        col = colnos[0]
+        get = lambda fields: (fields[col],)
+    else:
+        get = itemgetter(*colnos)
+    # lines only need splitting up to the last selected column
+    last = colnos[-1] if colnos else -1
+    maxsplit = last + 1 if last < ncols - 1 else -1
+    # if the last column is selected, its values keep the line's newline
+    # instead of having it stripped and added back
+    newline = "" if maxsplit == -1 else "\n"
+    skip = 1 if keep_first else 0
+    filters = filters or Filters()
+    filter_rows = make_row_filter(len(colnos) - skip, skip, keep_zeros, filters.min_abundance, filters.min_samples,
+        filters.min_prevalence)
+    label = re.compile(filters.label_regex).search if filters.label_regex is not None else None
+    labels = filters.labels
+
+    def select(lines):
+        # a line without a separator is all label, less its newline
+        if labels is not None:
+            lines = [l for l in lines if l[:l.find(sep)] in labels]
+        if label is not None:
+            lines = [l for l in lines if label(l[:l.find(sep)])]
+        rows = [get(l.split(sep, maxsplit)) for l in lines]
+        if filter_rows is not None:
+            rows = filter_rows(rows)
+        return "".join([sep.join(r) + newline for r in rows]), len(rows)
+
+    return select
+
+
+def _last_label(filters):
+    """With sorted `filters.labels`, the label past which no row is wanted, else None."""
+    if filters is None or filters.labels is None or not filters.sorted_labels:
+        return None
+    return max(filters.labels) if filters.labels else ""
+
+
+def _past(line, sep, last):
+    """True if the table line `line` (text or bytes) is labelled after `last`."""
+    if isinstance(line, bytes):
+        line = line.decode()
+    return line.rstrip("\r\n").split(sep, 1)[0] > last
+
+
+def _final_line(chunk):
+    """The last line of `chunk`, bytes of whole lines."""
+    return chunk[chunk.rfind(b"\n", 0, len(chunk) - 1) + 1:]
+
+
+def select_columns(table, out, columns, sep, keep_first=False, keep_zeros=False, block_size=BLOCK_SIZE,
+                   filters=None):
+    """Write the `columns` of open file `table` to open file `out`.
+
+    Lines are read `block_size` bytes at a time, and each batch of
+    selected rows is written with a single call. With sorted labels in
+    `filters`, reading stops after the block that passes the last one.
+    Returns the number of rows read and the number written (not counting
+    the header). Reading, selecting and writing each block are timed as
+    the parse, filter and write phases of the active `metrics`.
+    """
+    cols = table.readline().rstrip("\n").split(sep)
+    colnos = pick_columns(cols, columns, keep_first)
+
+    out.write(sep.join([cols[i] for i in colnos]) + "\n")
+
+    select = make_selector(colnos, len(cols), sep, keep_first, keep_zeros, filters)
+    last = _last_label(filters)
+    m = metrics.active()
+    rows_in = rows_out = 0
+    while True:
+        with m.phase("parse"):
+            lines = table.readlines(block_size)
+        if not lines:
+            break
+        if not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        with m.phase("filter"):
+            text, n = select(lines)
+        with m.phase("write"):
+            out.write(text)
+        m.add("write", bytes=len(text))
+        rows_in += len(lines)
+        rows_out += n
+        if last is not None and _past(lines[-1], sep, last):
+            break
+    return rows_in, rows_out
+
+
+# Byte classes for the numpy path, combined per field with bitwise or
+_NONZERO, _DIGIT, _EXP, _BAD = 1, 2, 4, 8
+_CLASSES = None
+
+
+def load_numpy():
+    """Import numpy the first time the numpy path needs it.
+
+    numpy takes longer to import than the rest of this module, so it is
+    only loaded when asked for. Returns the module, or None if it isn't
+    installed.
+    """
+    global np, _CLASSES
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        _CLASSES = numpy.full(256, _BAD, dtype=numpy.uint8)
+        _CLASSES[[ord(c) for c in "1234567890"]] = _DIGIT
+        _CLASSES[[ord(c) for c in "123456789"]] |= _NONZERO
+        _CLASSES[[ord(c) for c in "eE"]] = _EXP
+        _CLASSES[[ord(c) for c in ".+-\r\t\n, "]] = 0
+        np = numpy
+    return np
+
+
+def _runs(colnos):
+    """Group ascending column numbers into (first, last) runs of adjacent columns."""
+    runs = [[colnos[0], colnos[0]]]
+    for c in colnos[1:]:
+        if c == runs[-1][1] + 1:
+            runs[-1][1] = c
+        else:
+            runs.append([c, c])
+    return [r[0] for r in runs], [r[1] for r in runs]
+
+
+def _mask(size, starts, stops):
+    """Boolean array of `size` that is True inside each [start, stop) range.
+
+    Ranges must not overlap.
+    """
+    mark = np.zeros(size + 1, dtype=np.int8)
+    mark[starts.ravel()] += 1
+    mark[stops.ravel()] -= 1
+    return np.cumsum(mark[:-1], dtype=np.int8).view(bool)
+
+
+def _numpy_chunk(chunk, colnos, ncols, sep, keep_first, keep_zeros):
+    """Select columns from `chunk` (bytes of whole lines) with array operations.
+
+    Every row must have exactly `ncols` fields, end in a bare newline, and
+    every selected value field must look like a decimal number (digits,
+    `.`, sign, exponent, ending in a digit). Returns the selected rows as
+    bytes and the number of rows kept, or None if the chunk doesn't fit
+    those rules, fewer than `NUMPY_MIN_COLUMNS` of the columns are
+    selected (splitting lines is faster then) or numpy isn't installed.
+    """
+    if not colnos or len(colnos) < ncols * NUMPY_MIN_COLUMNS or load_numpy() is None:
+        return None
+    if b"\r" in chunk:
+        # the normal path drops the \r of CRLF lines, which copying fields as they are wouldn't
+        return None
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    nl = ord("\n")
+    delims = np.flatnonzero((buf == ord(sep)) | (buf == nl))
+    nrows = len(delims) // ncols
+    if nrows * ncols != len(delims):
+        return None
+    ends = delims.reshape(nrows, ncols)
+    if not (buf[ends[:, -1]] == nl).all():
+        return None
+    starts = np.empty_like(ends)
+    starts[0, 0] = 0
+    starts[1:, 0] = ends[:-1, -1] + 1
+    starts[:, 1:] = ends[:, :-1] + 1
+
+    # bytes of each run of adjacent selected columns plus the delimiter after it
+    first, last = _runs(colnos)
+    seg_starts = starts[:, first]
+    seg_ends = ends[:, last]
+    mask = _mask(len(buf), seg_starts, seg_ends + 1)
+
+    if keep_zeros:
+        keep = np.ones(nrows, dtype=bool)
+    else:
+        values = colnos[1:] if keep_first else colnos
+        classes = _CLASSES[buf]
+        # a valid number ends in a digit, which also rules out empty fields
+        if not (classes[ends[:, values] - 1] & _DIGIT).all():
+            return None
+        np.multiply(classes, mask, out=classes)
+        if (classes & _EXP).any():
+            # only digits before an exponent decide whether a value is zero,
+            # so clear the nonzero flag from each exponent to the field's end
+            epos = np.flatnonzero(classes & _EXP)
+            field = np.searchsorted(delims, epos)
+            firsts = np.concatenate(([True], field[1:] != field[:-1]))
+            epos, field = epos[firsts], field[firsts]
+            fstarts = np.where(field > 0, delims[field - 1] + 1, 0)
+            if (epos == fstarts).any():
+                return None
+            classes[_mask(len(buf), epos, delims[field])] &= ~np.uint8(_NONZERO)
+        # only selected bytes are left, so or-ing each row's values together
+        # (after the first column with keep_first) says if any is non-zero
+        rowstart = ends[:, 0] if keep_first else starts[:, 0]
+        bounds = np.stack([rowstart, ends[:, -1]], axis=-1).ravel()
+        rowflags = np.bitwise_or.reduceat(classes, bounds)[::2]
+        if (rowflags & _BAD).any():
+            return None
+        keep = (rowflags & _NONZERO) > 0
+        if not keep.all():
+            rowlens = np.diff(np.append(starts[:, 0], len(buf)))
+            mask &= np.repeat(keep, rowlens)
+
+    kept = int(keep.sum())
+    if not kept:
+        return b"", 0
+    out = buf[mask]
+    if colnos[-1] != ncols - 1:
+        # the delimiter after each row's last selected field is a sep
+        outlens = (seg_ends - seg_starts + 1).sum(axis=1)[keep]
+        out[np.cumsum(outlens) - 1] = nl
+    return out.tobytes(), kept
+
+
+def _select_chunk(chunk, select, colnos, ncols, sep, keep_first, keep_zeros, use_numpy):
+    """Filter `chunk`, the bytes of whole table lines, with numpy if possible.
+
+    Returns the selected rows as bytes, the number of rows read and the
+    number kept.
+    """
+    if use_numpy and chunk.endswith(b"\n"):
+        result = _numpy_chunk(chunk, colnos, ncols, sep, keep_first, keep_zeros)
+        if result is not None:
+            return result[0], chunk.count(b"\n"), result[1]
+    lines = read_lines(chunk)
+    text, n = select(lines)
+    return text.encode(), len(lines), n
+
+
+def _select_data(chunk, colnos, ncols, sep, keep_first, keep_zeros, use_numpy, filters=None):
+    """Worker task for `select_columns_parallel`: filter `chunk`, bytes of whole lines."""
+    select = make_selector(colnos, ncols, sep, keep_first, keep_zeros, filters)
+    return _select_chunk(chunk, select, colnos, ncols, sep, keep_first, keep_zeros,
+        use_numpy and filters is None)
+
+
+def _select_range(path, start, end, colnos, ncols, sep, keep_first, keep_zeros, use_numpy, filters=None):
+    """Worker task for `select_columns_parallel`: filter bytes [start, end) of `path`."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    return _select_data(chunk, colnos, ncols, sep, keep_first, keep_zeros, use_numpy, filters)
+
+
+def select_columns_mmap(path, out, columns, sep, keep_first=False, keep_zeros=False, chunk_size=NUMPY_CHUNK,
+                        filters=None):
+    """Like `select_columns`, but vectorized with numpy over a memory-mapped file.
+
+    `path` is the table's file name and `out` a binary file object. Chunks
+    that can't be handled as a dense numeric block (ragged rows, labels or
+    NA in value columns, no final newline) go through the pure-Python
+    selector instead, so the output is identical either way. So do all
+    chunks when `filters` are given, and the whole table when fewer than
+    `NUMPY_MIN_COLUMNS` of its columns are selected.
+    Returns the number of rows read and the number written.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0, 0
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        size = len(mm)
+        header_end = mm.find(b"\n") + 1 or size
+        cols = read_lines(mm[:header_end])[0].rstrip("\n").split(sep)
+        colnos = pick_columns(cols, columns, keep_first)
+        if len(colnos) < len(cols) * NUMPY_MIN_COLUMNS:
+            logger.info("Only {} of {} columns selected, not using numpy".format(len(colnos), len(cols)))
+            text = io.TextIOWrapper(out)
+            with open_table(path) as f:
+                result = select_columns(f, text, columns, sep, keep_first, keep_zeros, filters=filters)
+            text.flush()
+            text.detach()
+            return result
+
+        out.write((sep.join([cols[i] for i in colnos]) + "\n").encode())
+
+        select = make_selector(colnos, len(cols), sep, keep_first, keep_zeros, filters)
+        last = _last_label(filters)
+        rows_in = rows_out = 0
+        pos = header_end
+        while pos < size:
+            end = min(pos + chunk_size, size)
+            if end < size:
+                cut = mm.rfind(b"\n", pos, end)
+                end = cut + 1 if cut >= 0 else (mm.find(b"\n", end) + 1 or size)
+            chunk = mm[pos:end]
+            data, n_in, n_out = _select_chunk(chunk, select, colnos, len(cols), sep,
+                keep_first, keep_zeros, filters is None)
+            out.write(data)
+            rows_in += n_in
+            rows_out += n_out
+            if last is not None and _past(_final_line(chunk), sep, last):
+                break
+            pos = end
+    finally:
+        mm.close()
+    return rows_in, rows_out
+
+
+class TableIndex(object):
+    """Sidecar index of a table, stored as `<table>.selidx`.
+
+    Holds the header fields, the byte offset of every row (plus the end of
+    the last one) and a flag per row that is set when every field after
+    the first is zero. Such rows can be skipped without being read for any
+    selection that doesn't treat the first column as a value. The index
+    records the table's size and mtime and is only used while they match.
+    It is stored with `storage.write_index`, the flags after the offsets.
+    """
+
+    def __init__(self, columns, offsets, zeros, size, mtime, sep):
+        self.columns = columns
+        self.offsets = offsets
+        self.zeros = zeros
+        self.size = size
+        self.mtime = mtime
+        self.sep = sep
+        self.positions = {}
+        for i, x in enumerate(columns):
+            self.positions.setdefault(x, []).append(i)
+
+    @property
+    def rows(self):
+        return len(self.zeros)
+
+    def pick_columns(self, columns, keep_first=False):
+        """Like `pick_columns`, using the stored header map for plain names."""
+        if isinstance(columns, ColumnPatterns):
+            return pick_columns(self.columns, columns, keep_first)
+        colnos = sorted(i for c in set(columns) for i in self.positions.get(c, ()))
+        if keep_first and (not colnos or colnos[0] != 0):
+            colnos.insert(0, 0)
+        logger.debug(colnos)
+        return colnos
+
+    @classmethod
+    def build(cls, path, sep):
+        """Index the table at `path` with one pass over the file."""
+        st = os.stat(path)
+        offsets = array("Q")
+        zeros = bytearray()
+        with open(path, "rb") as f:
+            header = f.readline()
+            columns = read_lines(header)[0].rstrip("\n").split(sep) if header else [""]
+            pos = len(header)
+            while True:
+                lines = f.readlines(BLOCK_SIZE)
+                if not lines:
+                    break
+                for line in lines:
+                    offsets.append(pos)
+                    pos += len(line)
+                    try:
+                        zeros.append(not nonzero(line.decode().split(sep)[1:]))
+                    except ValueError:
+                        zeros.append(False)
+            offsets.append(pos)
+        return cls(columns, offsets, bytes(zeros), st.st_size, st.st_mtime_ns, sep)
+
+    def save(self, path):
+        write_index(path, INDEX_VERSION, self.size, self.mtime, self.offsets, self.zeros, sep=self.sep,
+            columns=self.columns)
+
+    @classmethod
+    def load(cls, path, table, sep):
+        """Read the index at `path`, or return None if it's missing or out of date for `table`."""
+        saved = read_index(path, table, INDEX_VERSION, sep=sep)
+        if saved is None:
+            return None
+        meta, offsets, zeros = saved
+        return cls(meta["columns"], offsets, zeros, meta["size"], meta["mtime"], sep)
+
+
+def load_index(table, sep):
+    """Load the sidecar index of `table`, (re)building it if needed."""
+    path = table + INDEX_SUFFIX
+    index = TableIndex.load(path, table, sep)
+    if index is None:
+        logger.info("Building index {}".format(path))
+        index = TableIndex.build(table, sep)
+        try:
+            index.save(path)
+        except OSError as e:
+            logger.warning("Could not save index: {}".format(e))
+    return index
+
+
+def _newline_pieces(f, pos, size, chunk_size):
+    """Yield (start, end) byte ranges of about `chunk_size` that end at a newline."""
+    while pos < size:
+        f.seek(min(pos + chunk_size, size))
+        f.readline()
+        end = f.tell()
+        yield pos, end
+        pos = end
+
+
+def _stream_pieces(f, chunk_size):
+    """Yield chunks of about `chunk_size` bytes of whole lines read from `f`."""
+    while True:
+        lines = f.readlines(chunk_size)
+        if not lines:
+            return
+        yield b"".join(lines)
+
+
+def _index_pieces(index, skip_zeros, chunk_size):
+    """Yield (start, end) byte ranges of whole rows, at most `chunk_size` unless a row is longer.
+
+    With `skip_zeros`, rows flagged as all zero are left out.
+    """
+    offsets = index.offsets
+    if skip_zeros:
+        runs = ((m.start(), m.end()) for m in re.finditer(b"\x00+", index.zeros))
+    else:
+        runs = [(0, index.rows)]
+    for a, b in runs:
+        while a < b:
+            e = max(a + 1, bisect_right(offsets, offsets[a] + chunk_size, a + 1, b + 1) - 1)
+            yield offsets[a], offsets[e]
+            a = e
+
+
+def _skip_zeros(colnos, keep_first, keep_zeros):
+    """Whether an index's all-zero flags can drop rows for this selection."""
+    values = colnos[1:] if keep_first else colnos
+    return not keep_zeros and 0 not in values
+
+
+def select_columns_indexed(path, out, columns, sep, keep_first=False, keep_zeros=False, index=None,
+                           use_numpy=False, block_size=BLOCK_SIZE, filters=None):
+    """Like `select_columns`, but use a `TableIndex` to find the rows to read.
+
+    The header is taken from the index, and runs of all-zero rows are
+    seeked over without being read, as is everything past the last of
+    sorted labels in `filters`. `out` is a binary file object.
+    Returns the number of rows in the table and the number written.
+    """
+    if index is None:
+        index = load_index(path, sep)
+    colnos = index.pick_columns(columns, keep_first)
+    ncols = len(index.columns)
+
+    out.write((sep.join([index.columns[i] for i in colnos]) + "\n").encode())
+
+    select = make_selector(colnos, ncols, sep, keep_first, keep_zeros, filters)
+    use_numpy = use_numpy and filters is None
+    last = _last_label(filters)
+    rows_out = 0
+    with open(path, "rb") as f:
+        for start, end in _index_pieces(index, _skip_zeros(colnos, keep_first, keep_zeros), block_size):
+            f.seek(start)
+            chunk = f.read(end - start)
+            data, _, n = _select_chunk(chunk, select, colnos, ncols, sep, keep_first, keep_zeros, use_numpy)
+            out.write(data)
+            rows_out += n
+            if last is not None and _past(_final_line(chunk), sep, last):
+                break
+    return index.rows, rows_out
+
+
+def select_columns_parallel(path, out, columns, sep, keep_first=False, keep_zeros=False, jobs=2,
+                            use_numpy=False, chunk_size=PARALLEL_CHUNK, index=None, filters=None):
+    """Like `select_columns`, but filter the table on `jobs` processes.
+
+    The table at `path` is cut at newlines into pieces of about
+    `chunk_size` bytes, which workers read and filter independently.
+    Results are written to the binary file object `out` in the original
+    order, so the output is identical to the serial path. At most
+    `2 * jobs` pieces are in flight, which bounds memory use. If a
+    `TableIndex` is given, pieces come from its row offsets and all-zero
+    rows are never read. Compressed tables are decompressed in the parent
+    and the decompressed pieces sent to the workers. With sorted labels
+    in `filters`, no pieces are sent past the last one.
+    Returns the number of rows read and the number written.
+    """
+    # multiprocessing takes a while to import, so only load it when needed
+    from concurrent.futures import ProcessPoolExecutor
+
+    rows_in = rows_out = 0
+    compressed = sniff_compression(path) is not None
+    with open_table(path, binary=True) as f:
+        if index is None:
+            header = f.readline()
+            cols = read_lines(header)[0].rstrip("\n").split(sep) if header else [""]
+            colnos = pick_columns(cols, columns, keep_first)
+            if compressed:
+                pieces = _stream_pieces(f, chunk_size)
+            else:
+                pieces = _newline_pieces(f, len(header), os.fstat(f.fileno()).st_size, chunk_size)
+        else:
+            cols = index.columns
+            colnos = index.pick_columns(columns, keep_first)
+            pieces = _index_pieces(index, _skip_zeros(colnos, keep_first, keep_zeros), chunk_size)
+
+        out.write((sep.join([cols[i] for i in colnos]) + "\n").encode())
+
+        pending = deque()
+        last = _last_label(filters)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            args = (colnos, len(cols), sep, keep_first, keep_zeros, use_numpy, filters)
+            for piece in pieces:
+                if isinstance(piece, bytes):
+                    pending.append(pool.submit(_select_data, piece, *args))
+                    if last is not None and _past(_final_line(piece), sep, last):
+                        break
+                else:
+                    if last is not None:
+                        # a piece that starts past the last label has nothing to keep
+                        f.seek(piece[0])
+                        if _past(f.readline(), sep, last):
+                            break
+                    pending.append(pool.submit(_select_range, path, piece[0], piece[1], *args))
+                while len(pending) > 2 * jobs:
+                    data, n_in, n_out = pending.popleft().result()
+                    out.write(data)
+                    rows_in += n_in
+                    rows_out += n_out
+            while pending:
+                data, n_in, n_out = pending.popleft().result()
+                out.write(data)
+                rows_in += n_in
+                rows_out += n_out
+    if index is not None:
+        rows_in = index.rows
+    return rows_in, rows_out
+
+
+def select_table(table, output, columns, sep=",", keep_first=False, keep_zeros=False, use_numpy=False, jobs=1,
+                 use_index=False, filters=None):
+    """Write the `columns` of the table file `table` to the file `output`, or STDOUT if it's None.
+
+    Runs on `jobs` processes, through the sidecar index with `use_index`,
+    or memory-mapped with `use_numpy`, as long as the table allows it:
+    compressed tables can't be indexed, and only go through numpy with
+    more than one job. `columns` can be names or a `ColumnPatterns`.
+    Returns the number of rows read and the number written.
+    """
+    if output and same_file(table, output):
+        raise ValueError("output {} is the table itself".format(output))
+    if use_numpy and load_numpy() is None:
+        logger.warning("numpy is not installed, using the pure-Python path")
+        use_numpy = False
+
+    compression = sniff_compression(table)
+    if compression:
+        logger.info("Reading {}-compressed table".format(compression))
+        if use_index:
+            logger.warning("--index needs an uncompressed table, ignoring it")
+        if use_numpy and jobs <= 1:
+            logger.warning("--numpy needs an uncompressed table (or --jobs), ignoring it")
+            use_numpy = False
+    index = load_index(table, sep) if use_index and not compression else None
+
+    m = metrics.active()
+    start = time.perf_counter()
+    out = open_output(output) if output else sys.stdout
+    try:
+        if jobs > 1:
+            out.flush()
+            rows_in, rows_out = select_columns_parallel(table, out.buffer, columns, sep, keep_first, keep_zeros,
+                jobs, use_numpy, index=index, filters=filters)
+            out.buffer.flush()
+        elif index is not None:
+            out.flush()
+            rows_in, rows_out = select_columns_indexed(table, out.buffer, columns, sep, keep_first, keep_zeros,
+                index, use_numpy, filters=filters)
+            out.buffer.flush()
+        elif use_numpy:
+            out.flush()
+            rows_in, rows_out = select_columns_mmap(table, out.buffer, columns, sep, keep_first, keep_zeros,
+                filters=filters)
+            out.buffer.flush()
+        else:
+            with open_table(table) as f:
+                rows_in, rows_out = select_columns(f, out, columns, sep, keep_first, keep_zeros, filters=filters)
+    finally:
+        if output:
+            out.close()
+    logger.info("Wrote {} of {} rows".format(rows_out, rows_in))
+    if m.enabled:
+        if jobs > 1 or index is not None or use_numpy:
+            # these parse, filter and write in one go (on other processes with jobs), counted here as filter
+            m.add("filter", seconds=time.perf_counter() - start, bytes=os.path.getsize(table), tables=1)
+        else:
+            m.add("parse", bytes=os.path.getsize(table), tables=1)
+        m.add("filter", rows=rows_in, kept=rows_out)
+    return rows_in, rows_out
+
+
+def _select_one(table, output, columns, sep, keep_first, keep_zeros, use_numpy, use_index, filters,
+                collect=False):
+    """Worker task for `select_tables`: (rows read, rows written), or the exception raised.
+
+    With `collect` (in a worker process), also returns the phases of the
+    table's metrics, for the parent to add to its own.
+    """
+    if collect:
+        metrics.start("selectcols")
+    try:
+        result = select_table(table, output, columns, sep, keep_first, keep_zeros, use_numpy, 1, use_index, filters)
+    except Exception as e:
+        result = e
+    if collect:
+        return result, metrics.stop().phases
+    return result
+
+
+def select_tables(tables, outdir, columns, sep=",", keep_first=False, keep_zeros=False, use_numpy=False, jobs=1,
+                  use_index=False, filters=None, summary=None):
+    """Run `select_table` on each of `tables`, writing outputs of the same name to `outdir`.
+
+    Tables are handled on `jobs` processes (in this one if `jobs` is 1),
+    with at most `2 * jobs` submitted at a time, so memory use doesn't
+    grow with the number of tables. `columns` and `filters` are parsed
+    once by the caller and sent along with each table. A TSV of rows
+    read, kept and dropped per table is written to `summary` (default:
+    `outdir/selectcols_summary.tsv`), and outputs of tables that fail
+    are removed. Raises ValueError before writing anything if an output
+    would overwrite its table (`outdir` is the tables' folder).
+    Returns the list of tables that failed.
+    """
+    names = [os.path.basename(t) for t in tables]
+    if len(set(names)) != len(names):
+        raise ValueError("tables must have different file names to share an output folder")
+    outputs = [os.path.join(outdir, n) for n in names]
+    clobbered = [t for t, o in zip(tables, outputs) if same_file(t, o)]
+    if clobbered:
+        raise ValueError("{} of the outputs in {} would overwrite their tables (eg {}), use another "
+            "folder".format(len(clobbered), outdir, clobbered[0]))
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    args = (columns, sep, keep_first, keep_zeros, use_numpy, use_index, filters)
+
+    def results():
+        if jobs <= 1:
+            for table, output in zip(tables, outputs):
+                yield _select_one(table, output, *args)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        m = metrics.active()
+
+        def result(future):
+            if not m.enabled:
+                return future.result()
+            value, phases = future.result()
+            m.merge(phases)
+            return value
+
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for table, output in zip(tables, outputs):
+                pending.append(pool.submit(_select_one, table, output, *args, collect=m.enabled))
+                while len(pending) > 2 * jobs:
+                    yield result(pending.popleft())
+            while pending:
+                yield result(pending.popleft())
+
+    failed = []
+    summary = summary or os.path.join(outdir, "selectcols_summary.tsv")
+    with open(summary, "w") as summaryfile:
+        summaryfile.write("table\toutput\trows\tkept\tdropped\tstatus\n")
+        for n, (table, output, result) in enumerate(zip(tables, outputs, results()), 1):
+            if isinstance(result, Exception):
+                failed.append(table)
+                logger.error("[{}/{}] failed on {}: {}".format(n, len(tables), table, result))
+                if os.path.exists(output):
+                    os.remove(output)
+                summaryfile.write("{}\t{}\t\t\t\t{}\n".format(table, output, " ".join(str(result).split())))
+                continue
+            rows_in, rows_out = result
+            logger.info("[{}/{}] kept {} of {} rows of {}".format(n, len(tables), rows_out, rows_in, table))
+            summaryfile.write("{}\t{}\t{}\t{}\t{}\tok\n".format(table, output, rows_in, rows_out,
+                rows_in - rows_out))
+    return failed
@@ -0,0 +1,208 @@
+"""
+Per-task time, memory and core requests for the gridable workflows.
+
+Commands run through `record` (`bin/tasksize.py run`) append one line of JSON
+to a resource log: the kind of task, its input and reference index sizes, and
+the wall time, CPU time and peak memory it used. `SizingModel.fit` fits those
+records by least squares, separately for each kind of task, and
+`SizingModel.resources` turns a new task's sizes into the `time`, `mem` and
+`cores` to pass to `add_task_gridable`. Kinds with too few records keep the
+defaults the workflow passes in.
+"""
+
+import json
+import logging
+import math
+import os
+import subprocess
+import time
+
+from .metrics import append_line, max_rss_mb, read_metrics
+
+logger = logging.getLogger("Task sizing")
+
+GB = 1024 ** 3
+MODEL_VERSION = 1
+
+# Successful runs of a kind needed before it's sized from the log
+MIN_RECORDS = 5
+# Predictions are scaled up by the worst under-prediction seen in the log,
+# kept within these bounds
+MIN_MARGIN = 1.2
+MAX_MARGIN = 3.0
+# Added to every request: minutes of time and MB of memory
+TIME_PAD = 5
+MEM_PAD = 256
+
+
+def record(log, cmd, kind, input_bytes=0, index_bytes=0, refs=1, cores=1, metrics=None, name=None):
+    """Run `cmd` (an argv list), append its resource use to the log file `log`, and return its exit status.
+
+    `index_bytes` is the index size of one reference. When `refs` references
+    are mapped together, their processes run at the same time and the peak
+    memory recorded is that of the largest one. With a `metrics` file, the
+    run is also appended there (named `name`) as a single "run" phase, so
+    tasks of the workflows can be gathered along with our own tools. Either
+    file can be None.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd)
+    # the usage of this child (and whatever it waited for) alone; RUSAGE_CHILDREN would
+    # give the peak memory of every command this process has run
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = returncode = os.waitstatus_to_exitcode(status)
+    cpu = round(usage.ru_utime + usage.ru_stime, 3)
+    rss = round(max_rss_mb(usage), 1)
+    if log:
+        append_line(log, {"kind": kind, "input_bytes": input_bytes, "index_bytes": index_bytes, "refs": refs,
+            "cores": cores, "wall": round(wall, 3), "cpu": cpu, "max_rss_mb": rss, "returncode": returncode,
+            "time": int(time.time())})
+    if metrics:
+        import socket
+        run = {"seconds": round(wall, 4), "bytes": input_bytes}
+        if input_bytes and wall > 0:
+            run["bytes_per_s"] = round(input_bytes / wall)
+        append_line(metrics, {"tool": kind, "name": name, "host": socket.gethostname(), "wall": round(wall, 3),
+            "cpu": cpu, "max_rss_mb": rss, "phases": {"run": run}, "returncode": returncode,
+            "time": int(time.time())})
+    return returncode
+
+
+def read_log(path):
+    """Records in the resource log at `path`, skipping lines that can't be parsed."""
+    # the same JSON-lines format as a metrics file
+    return read_metrics([path])
+
+
+def _solve(a, b):
+    """Solve the square system `a x = b` by Gaussian elimination with partial pivoting."""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if m[col][col] == 0:
+            continue
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        if m[r][r] != 0:
+            x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def fit_linear(xs, ys):
+    """Least-squares coefficients `c` of `y = c[0] + c[1] * x[0] + ...`, all kept >= 0.
+
+    A term whose coefficient comes out negative is dropped and the others are
+    refitted, which is plenty for the two or three terms used here.
+    """
+    nterms = len(xs[0]) + 1
+    rows = [[1.0] + [float(v) for v in x] for x in xs]
+    active = list(range(nterms))
+    while active:
+        ata = [[sum(row[i] * row[j] for row in rows) for j in active] for i in active]
+        for k in range(len(active)):
+            # a touch of ridge, so a term that never varies (eg one reference) doesn't make this singular
+            ata[k][k] += 1e-9 * (ata[k][k] or 1.0)
+        aty = [sum(row[i] * y for row, y in zip(rows, ys)) for i in active]
+        solution = _solve(ata, aty)
+        negative = [i for i, c in zip(active, solution) if c < 0]
+        if not negative:
+            coefs = [0.0] * nterms
+            for i, c in zip(active, solution):
+                coefs[i] = c
+            return coefs
+        active.remove(min(negative, key=lambda i: solution[active.index(i)]))
+    return [0.0] * nterms
+
+
+def _features(input_bytes, index_bytes):
+    return (input_bytes / GB, index_bytes / GB)
+
+
+def _predict(coefs, x):
+    return coefs[0] + sum(c * v for c, v in zip(coefs[1:], x))
+
+
+def _margin(actual, predicted):
+    ratios = [a / p for a, p in zip(actual, predicted) if p > 0]
+    return min(max(max(ratios) if ratios else MAX_MARGIN, MIN_MARGIN), MAX_MARGIN)
+
+
+class SizingModel(object):
+    """Resource use of each kind of task as a linear function of its input and index sizes (in GB).
+
+    For each kind, `cpu` gives CPU seconds per reference and `mem` the peak MB
+    of one mapping process. `time_margin` and `mem_margin` scale predictions
+    up so that they would have covered every run they were fitted on.
+    """
+
+    def __init__(self, kinds=None):
+        self.kinds = kinds or {}
+
+    @classmethod
+    def fit(cls, records, min_records=MIN_RECORDS):
+        """Fit a model to resource log records; failed runs are left out."""
+        by_kind = {}
+        for r in records:
+            if r.get("returncode") == 0 and r.get("wall", 0) > 0:
+                by_kind.setdefault(r["kind"], []).append(r)
+        kinds = {}
+        for kind, runs in sorted(by_kind.items()):
+            if len(runs) < min_records:
+                logger.info("{}: only {} runs, keeping the default resources".format(kind, len(runs)))
+                continue
+            xs = [_features(r["input_bytes"], r["index_bytes"]) for r in runs]
+            cpu = fit_linear(xs, [r["cpu"] / max(r["refs"], 1) for r in runs])
+            mem = fit_linear(xs, [r["max_rss_mb"] for r in runs])
+            walls = [_predict(cpu, x) * max(r["refs"], 1) / max(r["cores"], 1) for r, x in zip(runs, xs)]
+            kinds[kind] = {"cpu": cpu, "mem": mem, "runs": len(runs),
+                "time_margin": _margin([r["wall"] for r in runs], walls),
+                "mem_margin": _margin([r["max_rss_mb"] for r in runs], [_predict(mem, x) for x in xs])}
+        return cls(kinds)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"version": MODEL_VERSION, "kinds": self.kinds}, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Read a model saved with `save`. A missing or outdated file gives an empty model."""
+        if not path or not os.path.isfile(path):
+            logger.warning("no sizing model at {}, using default resources".format(path))
+            return cls()
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get("version") != MODEL_VERSION:
+            logger.warning("sizing model {} is from another version, using default resources".format(path))
+            return cls()
+        return cls(saved["kinds"])
+
+    def resources(self, kind, default, input_bytes, index_bytes=0, refs=1, cores=None, max_cores=8,
+            target_minutes=4*60):
+        """`time` (minutes), `mem` (MB) and `cores` for a task, as a dict for `add_task_gridable`.
+
+        `default` is returned (with `cores` filled in) for kinds the model has
+        no fit for. When `cores` is None, enough cores (up to `max_cores`) are
+        asked for to bring the predicted time under `target_minutes`.
+        """
+        fit = self.kinds.get(kind)
+        if fit is None:
+            sized = dict(default)
+            if cores is not None:
+                sized["cores"] = cores
+            sized.setdefault("cores", 1)
+            return sized
+        x = _features(input_bytes, index_bytes)
+        minutes = _predict(fit["cpu"], x) * refs * fit["time_margin"] / 60.0
+        if cores is None:
+            cores = min(max(int(math.ceil(minutes / target_minutes)), 1), max_cores)
+        # mappers sharing a task run at the same time
+        mem = _predict(fit["mem"], x) * refs * fit["mem_margin"]
+        return {"time": int(math.ceil(minutes / cores)) + TIME_PAD, "mem": int(math.ceil(mem)) + MEM_PAD,
+            "cores": cores}
@@ -0,0 +1,82 @@
+"""
+Files the utilities keep alongside their data: caches, manifests and indexes.
+
+`atomic_write` writes a file under a temporary name and renames it into place
+once it is complete, so readers (and later runs) never see half a file.
+
+`write_index` and `read_index` store the sidecar indexes of `bin/crap2.py`
+(`.lineidx`) and `bin/selectcols.py` (`.selidx`): one line of JSON metadata,
+then an array of uint64 offsets, then any other bytes the index needs. The
+metadata records the indexed file's size and mtime, and an index is only
+read back while they still match.
+"""
+
+from array import array
+from contextlib import contextmanager
+import json
+import os
+import sys
+
+
+def partpath(path):
+    """Temporary name `path` is written under until it is complete."""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, ".{}.part".format(name))
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Open a temporary file to write `path`, and rename it to `path` once the block is done.
+
+    If the block raises, the temporary file is removed and `path` is left
+    as it was.
+    """
+    tmp = partpath(path)
+    try:
+        with open(tmp, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_index(path, version, size, mtime, offsets, data=b"", **meta):
+    """Write a sidecar index to `path`.
+
+    `size` and `mtime` (in ns) are those of the indexed file when it was
+    read, `offsets` is an `array("Q")` and `data` any further bytes; `meta`
+    is stored along with them.
+    """
+    meta = dict(meta, version=version, size=size, mtime=mtime, entries=len(offsets), byteorder=sys.byteorder)
+    with atomic_write(path, "wb") as f:
+        f.write((json.dumps(meta) + "\n").encode())
+        offsets.tofile(f)
+        f.write(data)
+
+
+def read_index(path, target, version, **expected):
+    """Read the sidecar index at `path` as `(meta, offsets, data)`.
+
+    Returns None if there is no index, or it has another version, doesn't
+    match `target`'s current size and mtime, or has metadata other than
+    `expected` (eg the separator it was built with).
+    """
+    if not os.path.isfile(path):
+        return None
+    st = os.stat(target)
+    with open(path, "rb") as f:
+        try:
+            meta = json.loads(f.readline().decode())
+        except ValueError:
+            return None
+        if meta.get("version") != version or meta.get("size") != st.st_size or \
+                meta.get("mtime") != st.st_mtime_ns or any(meta.get(k) != v for k, v in expected.items()):
+            return None
+        offsets = array("Q")
+        offsets.fromfile(f, meta["entries"])
+        if meta["byteorder"] != sys.byteorder:
+            offsets.byteswap()
+        data = f.read()
+    return meta, offsets, data
@@ -1,13 +1,28 @@
 #!/usr/bin/env python
 
 from anadama2 import Workflow
+import logging
 import os
+import sys
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
-workflow = Workflow(version="0.0.2",
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.batching import Task, submit
+from util_hutlab.discovery import FileListing, index_files
+from util_hutlab.sizing import SizingModel
+
+TASKSIZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "tasksize.py")
+
+logger = logging.getLogger("PanPhlAn map")
+
+workflow = Workflow(version="0.0.3",
     description="A workflow to run PanPhlAn")
 
-workflow.add_argument("threads", default=1,
-    desc="number of threads for panphlan to use")
+workflow.add_argument("threads", default=1, type=int,
+    desc="number of threads for panphlan to use (0 to size each task from --sizing)")
 workflow.add_argument("dbfolder", default=None,
     desc="folder containing database")
 workflow.add_argument("filesfile", default=None,
@@ -16,22 +31,40 @@ workflow.add_argument("ref", default=None,
     desc="name of reference db")
 workflow.add_argument("refs", default=None,
     desc="file with list of references (relative to dbfolder)")
+workflow.add_argument("fanout", default=1, type=int,
+    desc="references mapped per task, from one decompression of each sample (0 for all of them)")
+workflow.add_argument("sizing", default=None,
+    desc="sizing model from bin/tasksize.py fit, to set each task's time, memory and cores")
+workflow.add_argument("resource-log", default=None,
+    desc="log each task's resource use here, to fit a sizing model from")
+workflow.add_argument("metrics", default=None,
+    desc="append each task's run time, throughput and peak memory here, to gather with bin/metrics.py")
+workflow.add_argument("batch-minutes", default=0, type=int,
+    desc="bundle tasks into grid jobs of about this many minutes (0 to submit each on its own)")
+workflow.add_argument("batch-cores", default=1, type=int,
+    desc="cores per bundle, shared between its tasks")
+workflow.add_argument("listing-cache", default=None,
+    desc="cache of the input folder listings, reused while the folders are unchanged (default: OUTPUT/.listing_cache.json)")
 
 
 args = workflow.parse_args()
 
-in_files = workflow.get_input_files(".fastq.gz")
-out_files = workflow.name_output_files(name=in_files, tag="panphlan_map", extension="csv.bz2")
+if not os.path.isdir(args.output):
+    os.makedirs(args.output)
+cache = args.listing_cache or os.path.join(args.output, ".listing_cache.json")
 
+# List the input folder (or the folders of the listed files) once, on several threads;
+# every later check on an input is answered from the listing
 if args.filesfile:
     with open(args.filesfile) as f:
-        in_files = [l.strip() for l in f]
-
-if args.dbfolder:
-    cmd = "panphlan_map.py -c [reference] -i [depend] -o [target] -p [threads] --i_bowtie2_indexes [db]"
+        in_files = [os.path.join(args.input, l.strip()) for l in f if l.strip()]
+    listing = FileListing.scan(sorted(set(os.path.dirname(f) for f in in_files)), ".fastq.gz", recursive=False,
+        cache=cache)
 else:
-    cmd = "panphlan_map.py -c [reference] -i [depend] -o [target] -p [threads]"
+    listing = FileListing.scan([args.input], ".fastq.gz", recursive=False, cache=cache)
+    in_files = listing.find()
 
+db = " --i_bowtie2_indexes {}".format(quote(args.dbfolder)) if args.dbfolder else ""
 
 if args.ref:
     refs = [args.ref]
@@ -40,29 +73,115 @@ elif args.refs:
     refs = [l.strip() for l in r]
     r.close()
 
+
+def sample_name(path):
+    name = os.path.basename(path)
+    return name[:-len(".fastq.gz")] if name.endswith(".fastq.gz") else name
+
+
+def map_target(ref, name):
+    return os.path.join(args.output, ref, "{}_panphlan_map.csv.bz2".format(name))
+
+
+def logged(command, name, input_bytes, index_bytes, refs, cores):
+    """Wrap task `name`'s `command` to append its resource use to --resource-log and --metrics, if given."""
+    if not (args.resource_log or args.metrics):
+        return command
+    log = quote(os.path.abspath(args.resource_log)) if args.resource_log else ""
+    if args.metrics:
+        log += " --metrics {} --name {}".format(quote(os.path.abspath(args.metrics)), quote(name))
+    return "python {} run {} --kind panphlan_map --input-bytes {} --index-bytes {} --refs {} --cores {} -- {}".format(
+        quote(TASKSIZE), log, input_bytes, index_bytes, refs, cores, command)
+
+
+def sized(input_bytes, index_bytes, refs):
+    """Threads per mapper, and the time, memory and cores for a task mapping one sample to `refs` references."""
+    default = {"time": 4*60, "mem": 8*1000*refs}
+    if args.threads:
+        return args.threads, model.resources("panphlan_map", default, input_bytes, index_bytes, refs,
+            args.threads * refs)
+    resources = model.resources("panphlan_map", default, input_bytes, index_bytes, refs)
+    threads = max(resources["cores"] // refs, 1)
+    resources["cores"] = threads * refs
+    return threads, resources
+
+
+def fanout_command(fq_path, targets, threads):
+    """Shell command that decompresses `fq_path` once and feeds it to one panphlan_map.py per reference.
+
+    `targets` maps each reference to its output. Every mapper reads from
+    its own named pipe, which `tee` fills from the single decompression;
+    the command fails if gzip or any mapper does.
+    """
+    lines = ['set -e', 'd=$(mktemp -d)', 'trap \'rm -rf "$d"\' EXIT', 'pids=""', 'mkfifo "$d/in"']
+    pipes = []
+    for n, (ref, target) in enumerate(sorted(targets.items())):
+        pipe = '"$d/{}"'.format(n)
+        pipes.append(pipe)
+        lines.append('mkfifo {}'.format(pipe))
+        lines.append('panphlan_map.py -c {} -o {} -p {}{} < {} & pids="$pids $!"'.format(
+            quote(ref), quote(target), threads, db, pipe))
+    lines.append('gzip -dc {} > "$d/in" & gz=$!'.format(quote(fq_path)))
+    lines.append('tee {} < "$d/in" > /dev/null'.format(" ".join(pipes)))
+    lines.append('wait $gz')
+    lines.append('for p in $pids; do wait $p; done')
+    return "\n".join(lines)
+
+
+model = SizingModel.load(args.sizing) if args.sizing else SizingModel()
+
+# Check the filesystem once, rather than once per (sample, reference) pair
+db_listing = FileListing.scan([args.dbfolder], (".bt2", ".bt2l"), recursive=False) if args.dbfolder else None
+db_files = db_listing.find() if db_listing else []
+index_sizes = {}
+for ref in refs:
+    if not os.path.isdir(os.path.join(args.output, ref)):
+        os.makedirs(os.path.join(args.output, ref))
+    index = index_files(db_files, "panphlan_" + ref)
+    if args.dbfolder and not index:
+        logger.warning("no bowtie2 index for {} in {}".format(ref, args.dbfolder))
+    index_sizes[ref] = sum(db_listing.getsize(f) for f in index)
+
+samples = []
+skipped = []
 for f in in_files:
+    st = listing.stat(f)
+    if st is not None:
+        samples.append((f, sample_name(f), st[0]))
+    else:
+        skipped.append(f)
 
+if skipped and args.filesfile:
     for ref in refs:
-        if not os.path.isdir("{}/{}".format(args.output, ref)):
-            os.makedirs("{}/{}".format(args.output, ref))
-        fq_path = os.path.join(args.input, f)
-
-        if args.filesfile:
-            if not fq_path in files:
-                skipped = open("{}/{}/skippedfiles.txt".format(args.output, ref), "a")
-                skipped.write("{}\n".format(f))
-                skipped.close()
-        elif not os.path.isfile(fq_path):
-            continue
-
-        workflow.add_task_gridable(
-            cmd, reference=ref,
-            depend=fq_path,
-            target="{}{}_panphlan_map.csv.bz2".format(args.output, os.path.basename(f.strip(".fastq.gz"))),
-            folder=args.output,
-            threads=args.threads,
-            cores=args.threads,
-            db=args.dbfolder,
-            time=4*60, mem=8*1000)
+        with open(os.path.join(args.output, ref, "skippedfiles.txt"), "a") as s:
+            s.writelines("{}\n".format(os.path.relpath(f, args.input)) for f in skipped)
+
+tasks = []
+if args.fanout == 1:
+    for fq_path, name, fq_size in samples:
+        for ref in refs:
+            threads, resources = sized(fq_size, index_sizes[ref], 1)
+            target = map_target(ref, name)
+            command = "panphlan_map.py -c {} -i {} -o {} -p {}{}".format(quote(ref), quote(fq_path), quote(target),
+                threads, db)
+            task = "panphlan_map_{}_{}".format(name, ref)
+            tasks.append(Task(task, logged(command, task, fq_size, index_sizes[ref], 1, resources["cores"]),
+                (fq_path,), (target,), **resources))
+else:
+    # each sample is read once per group of references instead of once per reference
+    size = args.fanout if args.fanout > 0 else len(refs)
+    groups = [refs[i:i + size] for i in range(0, len(refs), size)]
+    for fq_path, name, fq_size in samples:
+        for group in groups:
+            targets = dict((ref, map_target(ref, name)) for ref in group)
+            index_bytes = sum(index_sizes[ref] for ref in group) // len(group)
+            threads, resources = sized(fq_size, index_bytes, len(group))
+            command = "sh -c {}".format(quote(fanout_command(fq_path, targets, threads)))
+            task = "panphlan_map_{}_{}".format(name, "_".join(group))
+            tasks.append(Task(task, logged(command, task, fq_size, index_bytes, len(group), resources["cores"]),
+                (fq_path,), tuple(targets[ref] for ref in group), **resources))
+
+submit(workflow, tasks, os.path.join(args.output, "bundles"), args.batch_minutes, args.batch_cores,
+    prefix="panphlan_map")
 
 workflow.go()
@@ -2,6 +2,18 @@
 
 from anadama2 import Workflow
 import os
+import sys
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab.batching import Task, submit
+from util_hutlab.discovery import FileListing, index_files
+from util_hutlab.sizing import SizingModel
+
+TASKSIZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "tasksize.py")
 
 workflow = Workflow(version="0.0.1",
     description="A workflow to run PanPhlAn")
@@ -12,10 +24,21 @@ workflow.add_argument("ref", default=None,
     desc="name of reference db")
 workflow.add_argument("refs", default=None,
     desc="file with list of references (relative to dbfolder)")
+workflow.add_argument("sizing", default=None,
+    desc="sizing model from bin/tasksize.py fit, to set each task's time and memory")
+workflow.add_argument("resource-log", default=None,
+    desc="log each task's resource use here, to fit a sizing model from")
+workflow.add_argument("metrics", default=None,
+    desc="append each task's run time, throughput and peak memory here, to gather with bin/metrics.py")
+workflow.add_argument("batch-minutes", default=0, type=int,
+    desc="bundle tasks into grid jobs of about this many minutes (0 to submit each on its own)")
+workflow.add_argument("batch-cores", default=1, type=int,
+    desc="cores per bundle, shared between its tasks")
 
 args = workflow.parse_args()
 
-cmd = "panphlan_profile.py -c {0} -i {0}/ --o_dna [target] --add_strains"
+# the map outputs of each reference are in INPUT/<ref>/, where panphlan_map.py writes them
+cmd = "panphlan_profile.py -c {} -i {}/ --o_dna {} --add_strains"
 
 if args.dbfolder:
     cmd += " --i_bowtie2_indexes {}".format(args.dbfolder)
@@ -27,12 +50,33 @@ elif args.refs:
     refs = [l.strip() for l in r]
     r.close()
 
+model = SizingModel.load(args.sizing) if args.sizing else SizingModel()
+
+# list every reference's folder of map outputs (and the database) at once, on several threads
+folders = dict((ref, os.path.join(args.input, ref)) for ref in refs)
+listing = FileListing.scan(list(folders.values()), recursive=False)
+db_listing = FileListing.scan([args.dbfolder], (".bt2", ".bt2l"), recursive=False) if args.dbfolder else None
+db_files = db_listing.find() if db_listing else []
+
+tasks = []
 for ref in refs:
-    if os.path.isdir(ref):
-        workflow.add_task_gridable(
-            cmd.format(ref, os.path.join(args.input, ref)),
-            target="{}profiles/{}_pa.tsv".format(args.output,ref),
-            cores=1,
-            time=30, mem=1000)
+    if listing.isdir(folders[ref]):
+        # the task reads every map output in the reference's folder
+        input_bytes = listing.total_size(folders[ref])
+        index_bytes = sum(db_listing.getsize(f) for f in index_files(db_files, "panphlan_" + ref))
+        resources = model.resources("panphlan_profile", {"time": 30, "mem": 1000}, input_bytes, index_bytes, cores=1)
+        target = "{}profiles/{}_pa.tsv".format(args.output,ref)
+        name = "panphlan_profile_{}".format(ref)
+        task = cmd.format(quote(ref), quote(folders[ref]), quote(target))
+        if args.resource_log or args.metrics:
+            log = quote(os.path.abspath(args.resource_log)) if args.resource_log else ""
+            if args.metrics:
+                log += " --metrics {} --name {}".format(quote(os.path.abspath(args.metrics)), quote(name))
+            task = "python {} run {} --kind panphlan_profile --input-bytes {} --index-bytes {} -- {}".format(
+                quote(TASKSIZE), log, input_bytes, index_bytes, task)
+        tasks.append(Task(name, task, listing.find(folders[ref], "_panphlan_map.csv.bz2"), (target,), **resources))
+
+submit(workflow, tasks, os.path.join(args.output, "bundles"), args.batch_minutes, args.batch_cores,
+    prefix="panphlan_profile")
 
 workflow.go()
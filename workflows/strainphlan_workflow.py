@@ -26,6 +26,12 @@ THE SOFTWARE.
 import sys
 import os, fnmatch
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from util_hutlab import metrics
+from util_hutlab.clades import (keep_samples, plan_sam, read_profiles, read_samples, read_table, sample_name,
+                                top_clades, write_plan, write_profile, write_samples)
+from util_hutlab.discovery import FileListing
+
 # import the workflow class from anadama2
 from anadama2 import Workflow
 
@@ -47,40 +53,99 @@ workflow.add_argument("threads", desc="number of threads/cores for each task to
 workflow.add_argument("bypass-taxonomic-profiling", desc="do not run the taxonomic profiling tasks (a tsv profile for each sequence file must be included in the input folder using the same sample name)", action="store_true")
 workflow.add_argument("strain-profiling-options", desc="additional options when running the strain profiling step", default="")
 workflow.add_argument("max-strains", desc="the max number of strains to profile", default=20, type=int)
+workflow.add_argument("strain-ranking", desc="how to choose the strains to profile: by mean abundance or by prevalence", default="mean", choices=["mean","prevalence"])
+workflow.add_argument("bypass-strain-profiling", desc="do not run the strain profiling tasks", action="store_true")
+workflow.add_argument("listing-cache", desc="cache of the input folder listing, reused while the folder is unchanged (default: OUTPUT/.listing_cache.json)", default=None)
+workflow.add_argument("metrics", desc="append the time spent finding inputs and planning the strain profiling to this JSON-lines file", default=None)
 
 # get the arguments from the command line
 args = workflow.parse_args()
+m = metrics.start("strainphlan_workflow", args.output) if args.metrics else metrics.active()
 
 # get all input files with the input extension provided on the command line
 # return an error if no files are found
-input_files = utilities.find_files(args.input, extension=args.input_extension, exit_if_not_found=True)
+# the folder is listed once (along with any profiles and sam files to bypass profiling with),
+# and later checks for files in it are answered from that listing
+if not os.path.isdir(args.output):
+    os.makedirs(args.output)
+suffixes = ["." + args.input_extension] + ([".tsv", ".sam"] if args.bypass_taxonomic_profiling else [])
+with m.phase("discover"):
+    listing = FileListing.scan([args.input], suffixes, recursive=False, exclude=[args.output],
+        cache=args.listing_cache or os.path.join(args.output, ".listing_cache.json"))
+input_files = listing.find(suffixes="." + args.input_extension)
+m.add("discover", files=len(input_files))
+if not input_files:
+    sys.exit("ERROR: No files were found in the input folder with the extension "+args.input_extension)
 
 ### STEP #1: Run taxonomic profiling on all of the filtered files ###
 if not args.bypass_taxonomic_profiling:
     merged_taxonomic_profile, taxonomy_tsv_files, taxonomy_sam_files = shotgun.taxonomic_profile(workflow,
         input_files,args.output,args.threads,args.input_extension)
-elif:
+else:
     sample_names = utilities.sample_names(input_files,args.input_extension)
-    tsv_profiles = utilities.name_files(sample_names, demultiplex_output_folder, tag="taxonomic_profile", extension="tsv")
+    tsv_profiles = utilities.name_files(sample_names, args.input, tag="taxonomic_profile", extension="tsv")
     # check all of the expected profiles are found
-    if len(tsv_profiles) != len(list(filter(os.path.isfile,tsv_profiles))):
+    if len(tsv_profiles) != len(list(filter(listing.isfile,tsv_profiles))):
         sys.exit("ERROR: Bypassing taxonomic profiling but all of the tsv taxonomy profile files are not found in the input folder. Expecting the following input files:\n"+"\n".join(tsv_profiles))
     # run taxonomic profile steps bypassing metaphlan2
     merged_taxonomic_profile, taxonomy_tsv_files, taxonomy_sam_files = shotgun.taxonomic_profile(workflow,
         tsv_profiles,args.output,args.threads,"tsv",already_profiled=True)
     # look for the sam profiles
-    taxonomy_sam_files = utilities.name_files(sample_names, demultiplex_output_folder, tag="bowtie2", extension="sam")
+    taxonomy_sam_files = utilities.name_files(sample_names, args.input, tag="bowtie2", extension="sam")
     # if they do not all exist, then bypass strain profiling if not already set
-    if len(taxonomy_sam_files) != len(list(filter(os.path.isfile,taxonomy_sam_files))):
+    if len(taxonomy_sam_files) != len(list(filter(listing.isfile,taxonomy_sam_files))):
         print("Warning: Bypassing taxonomic profiling but not all taxonomy sam files are present in the input folder. Strain profiling will be bypassed. Expecting the following input files:\n"+"\n".join(taxonomy_sam_files))
         args.bypass_strain_profiling = True
 
+### Plan the strain profiling: once the profiles are made, choose the top clades from them in one pass,
+# and only extract markers from the samples that contain at least one of them
+if not args.bypass_strain_profiling:
+    plan_folder = os.path.join(args.output, "strain_profiling_plan")
+    if not os.path.isdir(plan_folder):
+        os.makedirs(plan_folder)
+    plan_file = os.path.join(args.output, "strain_profiling_plan.tsv")
+    plan_samples = os.path.join(args.output, "strain_profiling_plan_samples.txt")
+    # strain profiling picks its top clades from the profile it's given, so give it only the
+    # planned ones: it then profiles exactly those, however it ranks them
+    plan_profile = os.path.join(args.output, "strain_profiling_plan_profile.tsv")
+    profiles = tsv_profiles if args.bypass_taxonomic_profiling else [merged_taxonomic_profile]
+
+    def plan_strains(task):
+        plan_metrics = metrics.Metrics("strainphlan_plan", args.output) if args.metrics else metrics.OFF
+        with plan_metrics.phase("plan"):
+            if args.bypass_taxonomic_profiling:
+                profile_samples, profile_rows = read_profiles(tsv_profiles, sample_names)
+            else:
+                profile_samples, profile_rows = read_table(merged_taxonomic_profile)
+                profile_samples = [sample_name(name, "_taxonomic_profile") for name in profile_samples]
+            top = top_clades(profile_samples, profile_rows, args.max_strains, args.strain_ranking)
+            write_plan(plan_file, top)
+            write_profile(plan_profile, profile_samples, top)
+            keep = keep_samples(taxonomy_sam_files, "_bowtie2", top, profile_samples)
+            write_samples(plan_samples, [sample_name(f, "_bowtie2") for f in keep])
+        plan_metrics.add("plan", samples=len(keep), clades=len(top))
+        plan_metrics.write(args.metrics)
+
+    workflow.add_task(plan_strains, depends=profiles, targets=[plan_file, plan_profile, plan_samples],
+        name="strain_profiling_plan")
+
+    def planned_sam(task):
+        plan_sam(task.depends[0].name, "_bowtie2", read_samples(task.depends[1].name), task.targets[0].name)
+
+    # samples left out of the plan get a SAM file with no alignments, so they cost nothing to profile
+    planned_sam_files = [os.path.join(plan_folder, os.path.basename(f)) for f in taxonomy_sam_files]
+    for sam, planned in zip(taxonomy_sam_files, planned_sam_files):
+        workflow.add_task(planned_sam, depends=[sam, plan_samples], targets=[planned],
+            name="strain_profiling_plan_" + sample_name(sam, "_bowtie2"))
+
 ### STEP #2: Run strain profiling
-# Provide taxonomic profiling output so top strains by abundance will be selected
+# Provide the planned clades' profile and SAM files, so the planned strains are profiled in the planned samples
 if not args.bypass_strain_profiling:
-    shotgun.strain_profile(workflow,taxonomy_sam_files,args.output,args.threads,
-        workflow_config.strainphlan_db_reference,workflow_config.strainphlan_db_markers,merged_taxonomic_profile,
+    shotgun.strain_profile(workflow,planned_sam_files,args.output,args.threads,
+        workflow_config.strainphlan_db_reference,workflow_config.strainphlan_db_markers,plan_profile,
         args.strain_profiling_options,args.max_strains)
 
+metrics.stop().write(args.metrics)
+
 # start the workflow
 workflow.go()